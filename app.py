@@ -6,14 +6,43 @@ from typing import List, Dict, Any
 # 将KMP_DUPLICATE_LIB_OK设置为TRUE，以避免OMP错误
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+from image_search.embedding_cache import EmbeddingCache
 from image_search.embedding_generator import EmbeddingGenerator
+from image_search.filters import SearchFilter
+from image_search.metrics import SearchMetrics
+from image_search.result_cache import ResultCache
 from image_search.search_engine import SearchEngine
+from image_search.startup import StartupTimer
+from image_search.thumbnails import ThumbnailStore
 from config import (
     DATABASE_PATH,
     IMAGE_INDEX_PATH,
     TEXT_INDEX_PATH,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
     CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
     EMBEDDING_DIM,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_PATH,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    HYBRID_RRF_K,
+    FILTER_EXACT_THRESHOLD,
+    METRICS_ENABLED,
+    METRICS_WINDOW,
+    SLOW_QUERY_MS,
+    SLOW_QUERY_LOG_PATH,
+    THUMBNAIL_DIR,
+    THUMBNAIL_SIZES,
+    STARTUP_MODE,
     PAGE_TITLE,
     PAGE_ICON,
     LAYOUT,
@@ -26,21 +55,50 @@ st.set_page_config(page_title=PAGE_TITLE, page_icon=PAGE_ICON, layout=LAYOUT)
 # --- 初始化 ---
 setup_logging()
 
+@st.cache_resource
+def get_startup_timer():
+    """进程级的启动计时"""
+    return StartupTimer()
+
 @st.cache_resource
 def get_embedder():
-    """缓存EmbeddingGenerator实例"""
-    return EmbeddingGenerator(model_name=CLIP_MODEL_NAME)
+    """缓存EmbeddingGenerator实例。lazy模式下模型在后台线程中加载，页面无需等待。"""
+    with get_startup_timer().stage('embedder'):
+        embedder = EmbeddingGenerator(
+            model_name=CLIP_MODEL_NAME,
+            backend=INFERENCE_BACKEND, onnx_dir=ONNX_MODEL_DIR,
+            drift_report=INFERENCE_DRIFT_REPORT, max_drift=INFERENCE_MAX_DRIFT,
+            towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR, lazy=STARTUP_MODE == 'lazy'
+        )
+    if STARTUP_MODE == 'lazy':
+        embedder.warmup(background=True)
+    return embedder
 
 @st.cache_resource
 def get_search_engine(_embedder):
-    """缓存SearchEngine实例"""
-    return SearchEngine(
-        embedding_generator=_embedder,
-        embedding_dim=EMBEDDING_DIM,
-        db_path=DATABASE_PATH,
-        image_index_path=IMAGE_INDEX_PATH,
-        text_index_path=TEXT_INDEX_PATH
-    )
+    """缓存SearchEngine实例。lazy模式下以内存映射方式打开索引。"""
+    timer = get_startup_timer()
+    with timer.stage('search_engine'):
+        search_engine = SearchEngine(
+            embedding_generator=_embedder,
+            embedding_dim=EMBEDDING_DIM,
+            db_path=DATABASE_PATH,
+            image_index_path=IMAGE_INDEX_PATH,
+            text_index_path=TEXT_INDEX_PATH,
+            index_backend=INDEX_BACKEND,
+            index_params=INDEX_PARAMS,
+            embedding_cache=EmbeddingCache(f"{CLIP_MODEL_NAME}/{_embedder.backend}", max_entries=EMBEDDING_CACHE_SIZE, disk_path=EMBEDDING_CACHE_PATH),
+            result_cache=ResultCache(max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL),
+            thumbnail_store=ThumbnailStore(THUMBNAIL_DIR, THUMBNAIL_SIZES),
+            passage_overlap=TEXT_PASSAGE_OVERLAP,
+            max_passages_per_ad=MAX_PASSAGES_PER_AD,
+            mmap_indexes=STARTUP_MODE == 'lazy',
+            metrics=SearchMetrics(enabled=METRICS_ENABLED, window=METRICS_WINDOW, slow_query_ms=SLOW_QUERY_MS, slow_log_path=SLOW_QUERY_LOG_PATH),
+            rrf_k=HYBRID_RRF_K,
+            filter_exact_threshold=FILTER_EXACT_THRESHOLD
+        )
+    timer.report(f"启动耗时 (startup_mode={STARTUP_MODE})")
+    return search_engine
 
 embedder = get_embedder()
 search_engine = get_search_engine(embedder)
@@ -48,42 +106,99 @@ search_engine = get_search_engine(embedder)
 # --- 页面布局 ---
 st.title("🎨 " + PAGE_TITLE)
 
+with st.sidebar:
+    cache_stats = search_engine.embedding_cache.stats()
+    st.caption(f"查询向量缓存：命中 {cache_stats['hits'] + cache_stats['disk_hits']} 次，"
+               f"未命中 {cache_stats['misses']} 次，命中率 {cache_stats['hit_rate']:.0%}")
+    result_stats = search_engine.result_cache.stats()
+    st.caption(f"搜索结果缓存：命中 {result_stats['hits']} 次，未命中 {result_stats['misses']} 次，"
+               f"命中率 {result_stats['hit_rate']:.0%}")
+    latency = search_engine.metrics.snapshot()['modes']
+    for mode, summary in latency.items():
+        if 'total' in summary:
+            st.caption(f"{mode}：{summary['count']} 次，p50 {summary['total']['p50_ms']:.0f}ms / "
+                       f"p95 {summary['total']['p95_ms']:.0f}ms / p99 {summary['total']['p99_ms']:.0f}ms")
+
+    # 过滤条件对所有搜索模式生效，在索引检索过程中应用
+    st.subheader("筛选")
+    tables = search_engine.metadata.tables
+    selected_categories = st.multiselect("参赛类别", sorted(tables.category_bitmaps))
+    min_score = st.slider("最低应数评分", 0.0, 10.0, 0.0, 0.5)
+    years = tables.ad_publish[tables.ad_publish > 0] // 10000
+    first_year, last_year = (int(years.min()), int(years.max())) if len(years) else (0, 0)
+    year_range = (first_year, last_year)
+    if first_year < last_year:
+        year_range = st.slider("发布年份", first_year, last_year, (first_year, last_year))
+    search_filter = SearchFilter(
+        categories=selected_categories, min_score=min_score or None,
+        published_from=str(year_range[0]) if year_range[0] > first_year else None,
+        published_to=str(year_range[1]) if year_range[1] < last_year else None,
+    )
+
 tab1, tab2, tab3, tab4 = st.tabs(["文搜图", "图搜图", "图搜文", "文搜文"])
 
-def display_results(results: List[Dict[str, Any]]):
-    """以卡片形式展示广告案例结果"""
+def show_image(container, original: str, thumbnail: str, size: int, **kwargs):
+    """优先展示预先生成的缩略图；缩略图缺失时按需从原图补生成，仍失败时回退到原图。"""
+    try:
+        container.image(thumbnail or original, **kwargs)
+    except Exception:
+        path = search_engine.thumbnail_store.ensure(original, size)
+        if path or os.path.exists(original):
+            container.image(path or original, **kwargs)
+
+def display_results(results: List[Dict[str, Any]], key: str):
+    """
+    以卡片形式展示广告案例结果。
+
+    默认只加载缩略图：代表图片使用大档缩略图，其余图片在用户展开后才加载小档缩略图，
+    原图只在点击“查看原图”后加载。
+    """
     if not results:
         st.info("未找到匹配的结果。")
         return
     
     st.subheader(f"为你找到 {len(results)} 个相关的广告案例")
     st.markdown("---")
+    large, small = THUMBNAIL_SIZES[-1], THUMBNAIL_SIZES[0]
 
     for result in results:
+        ad_key = f"{key}_{result['ad_id']}"
         with st.container(border=True):
             col1, col2 = st.columns([1, 2])
             with col1:
                 if result.get("representative_image"):
-                    st.image(result["representative_image"], use_container_width=True, caption="最佳匹配图片")
+                    show_image(st, result["representative_image"], result.get("representative_thumbnail"), large,
+                               use_container_width=True, caption="最佳匹配图片")
+                    if st.toggle("查看原图", key=f"{ad_key}_original"):
+                        st.image(result["representative_image"], use_container_width=True)
                 else:
                     st.info("该案例无图片")
             with col2:
                 st.markdown(f"#### {result.get('title', '无标题')}")
                 st.markdown(f"**广告ID**: `{result['ad_id']}` | **最高匹配分**: `{result['score']:.2f}`")
-                st.caption(result.get('text', '无详细描述')[:300] + "...")
+                st.caption((result.get('text') or '无详细描述')[:300] + "...")
             
-            # 为其他图片创建可展开区域
+            # 其余图片在用户展开后才加载
             other_images = result.get("other_images", [])
-            if other_images:
-                with st.expander(f"查看其余 {len(other_images)} 张图片"):
-                    # 定义网格布局来展示其他图片
-                    expander_cols = st.columns(4)
-                    for i, img_path in enumerate(other_images):
-                        if os.path.exists(img_path):
-                            expander_cols[i % 4].image(img_path, use_container_width=True)
+            if other_images and st.toggle(f"查看其余 {len(other_images)} 张图片", key=f"{ad_key}_more"):
+                other_thumbnails = result.get("other_thumbnails") or [None] * len(other_images)
+                # 定义网格布局来展示其他图片
+                grid_cols = st.columns(4)
+                for i, (img_path, thumb_path) in enumerate(zip(other_images, other_thumbnails)):
+                    show_image(grid_cols[i % 4], img_path, thumb_path, small, use_container_width=True)
 
         st.write("") # 添加垂直间距
 
+def run_search(key: str, search_fn, query):
+    """执行搜索 (应用侧边栏的筛选条件) 并将结果保存在session_state中，页面因展开图片等操作重新运行时无需重新搜索。"""
+    with st.spinner("正在搜索..."):
+        st.session_state[f"results_{key}"] = search_fn(query, filters=search_filter)
+    get_startup_timer().mark_first_query()
+
+def show_saved_results(key: str):
+    if f"results_{key}" in st.session_state:
+        display_results(st.session_state[f"results_{key}"], key)
+
 
 # --- 各搜索模式的实现 ---
 
@@ -92,11 +207,10 @@ with tab1: # 文搜图
     text_query_img = st.text_input("输入文本描述", key="text_to_image_input")
     if st.button("搜索", key="text_to_image_button"):
         if text_query_img:
-            with st.spinner("正在搜索..."):
-                search_results = search_engine.text_to_image_search(text_query_img)
-                display_results(search_results)
+            run_search("text_to_image", search_engine.text_to_image_search, text_query_img)
         else:
             st.warning("请输入文本描述。")
+    show_saved_results("text_to_image")
 
 with tab2: # 图搜图
     st.header("🖼️ 图搜图")
@@ -104,9 +218,8 @@ with tab2: # 图搜图
     if uploaded_file_img is not None:
         st.image(uploaded_file_img, caption="您上传的图片", width=200)
         if st.button("开始搜索", key="image_to_image_button"):
-            with st.spinner("正在搜索..."):
-                search_results = search_engine.image_to_image_search(uploaded_file_img)
-                display_results(search_results)
+            run_search("image_to_image", search_engine.image_to_image_search, uploaded_file_img)
+        show_saved_results("image_to_image")
 
 with tab3: # 图搜文
     st.header("📝 图搜文")
@@ -114,17 +227,17 @@ with tab3: # 图搜文
     if uploaded_file_text is not None:
         st.image(uploaded_file_text, caption="您上传的图片", width=200)
         if st.button("开始搜索", key="image_to_text_button"):
-            with st.spinner("正在搜索..."):
-                search_results = search_engine.image_to_text_search(uploaded_file_text)
-                display_results(search_results)
+            run_search("image_to_text", search_engine.image_to_text_search, uploaded_file_text)
+        show_saved_results("image_to_text")
 
 with tab4: # 文搜文
     st.header("📝 文搜文")
     text_query_text = st.text_input("输入关键词", key="text_to_text_input")
+    use_hybrid = st.checkbox("关键词 + 语义混合检索 (品牌名、标题等精确查询更准确)", value=True, key="text_to_text_hybrid")
     if st.button("搜索", key="text_to_text_button"):
         if text_query_text:
-            with st.spinner("正在搜索..."):
-                search_results = search_engine.text_to_text_search(text_query_text)
-                display_results(search_results)
+            search_fn = search_engine.hybrid_search if use_hybrid else search_engine.text_to_text_search
+            run_search("text_to_text", search_fn, text_query_text)
         else:
-            st.warning("请输入关键词。") 
\ No newline at end of file
+            st.warning("请输入关键词。")
+    show_saved_results("text_to_text") 
\ No newline at end of file
@@ -18,20 +18,74 @@ DATABASE_PATH = os.path.join(DATABASE_DIR, 'advertisements.db')
 # 模型配置
 CLIP_MODEL_NAME = "ViT-B-16"  # 可选: "ViT-L-14", "ViT-H-14", "RN50"
 EMBEDDING_DIM = 512  # ViT-B-16的向量维度
+ENCODE_BATCH_SIZE = 32  # 批量编码时每次前向计算的样本数
+ENCODE_NUM_WORKERS = 4  # 批量编码时解码/预处理图片的线程数
+INFERENCE_BACKEND = "torch"  # 编码推理后端，可选: "torch" (fp32/GPU), "torch-int8", "onnx", "onnx-int8" (后三者仅CPU)
+ONNX_MODEL_DIR = os.path.join(PROJECT_ROOT, 'models', 'onnx')  # 导出的ONNX模型目录
+MODEL_ARTIFACT_DIR = os.path.join(PROJECT_ROOT, 'models', 'artifacts')  # 预先序列化的编码塔，冷启动时跳过checkpoint转换
+ENCODER_TOWERS = ("image", "text")  # 允许加载的编码塔，各自在首次使用时加载；纯文本部署可设为 ("text",)
+INFERENCE_DRIFT_REPORT = os.path.join(INDEX_DIR, 'inference_drift.json')  # scripts/benchmark_inference.py 的输出
+INFERENCE_MAX_DRIFT = 0.02  # 与fp32向量的余弦偏差 (p99) 上限，超出或未测量时回退为 "torch"
+STARTUP_MODE = "lazy"  # 服务启动模式: "lazy" (内存映射打开索引，后台加载模型，缩短首次查询时间) 或 "eager" (启动时全部加载)
 
 # Faiss索引配置
 IMAGE_INDEX_PATH = os.path.join(INDEX_DIR, 'image_embeddings.index')
-TEXT_INDEX_PATH = os.path.join(INDEX_DIR, 'text_embeddings.index')
+TEXT_INDEX_PATH = os.path.join(INDEX_DIR, 'text_passages.index')  # 段落级文本索引，旧的整篇文本索引需用 build_index.py 重建
+INDEX_BACKEND = "flat"  # 图片索引后端，可选: "flat" (精确), "hnsw", "ivf"
+INDEX_PARAMS = {
+    'hnsw_m': 32,            # HNSW每个节点的邻居数
+    'ef_construction': 200,  # HNSW构建时的搜索宽度
+    'ef_search': 128,        # HNSW查询时的搜索宽度
+    'nlist': 1024,           # IVF聚类中心数量
+    'nprobe': 16,            # IVF查询时访问的聚类数量
+    # 图片向量在索引中的存储编码: "float32" (2KB/向量), "fp16" (1KB), "sq8" (512B), "pq" (pq_m字节)。
+    # 有损编码的检索结果会用磁盘上的原始向量精确重排；修改后用 update_index.py --rebuild-image-index 重建
+    'encoding': 'float32',
+    'pq_m': 64,              # PQ子空间数量，需整除向量维度 (启用PCA时为pca_dim)
+    'pca_dim': 0,            # 大于0时先用PCA降维再编码
+    'rerank_factor': 4,      # 压缩索引多取的候选倍数，用于精确重排
+}
+INDEX_BUILD_CHUNK_SIZE = 4096  # 构建索引时每次index.add的向量数
+INDEX_BUILD_CHECKPOINT_EVERY = 50000  # 每写入多少个向量保存一次断点
+INDEX_BUILD_CHECKPOINT_PATH = os.path.join(INDEX_DIR, 'build_checkpoint.json')
+TEXT_PASSAGE_OVERLAP = 8  # 广告文本按token窗口切分为段落时相邻窗口重叠的token数
+MAX_PASSAGES_PER_AD = 64  # 每条广告最多索引的段落数 (不超过 passages.PASSAGE_STRIDE)
+
+# 数据导入配置 (scripts/ingest_data.py)
+INGEST_CHUNK_SIZE = 5000  # 流式读取导出文件时每块的行数，每块一个事务
 
 # 图片下载配置
 MAX_DOWNLOAD_WORKERS = 10
 DOWNLOAD_TIMEOUT = 30
 MAX_RETRIES = 3
+ASYNC_DOWNLOAD_CONCURRENCY = 256  # 异步下载的全局最大在途请求数
+DOWNLOAD_PER_HOST_CONCURRENCY = 8  # 每个主机的最大在途请求数
+DOWNLOAD_PER_HOST_RATE = 0  # 每个主机每秒最多请求数，0表示不限速
 IMAGE_SIZE = (224, 224)  # 统一图片尺寸
+MAX_IMAGE_BYTES = 20 * 1024 * 1024  # 单张图片的大小上限，超出视为下载失败
+THUMBNAIL_DIR = os.path.join(DATA_DIR, 'thumbnails')
+THUMBNAIL_SIZES = (160, 480)  # 缩略图长边尺寸档位：小档用于图片网格，大档用于代表图片
+PHASH_MAX_DISTANCE = None  # 图片去重时视为近似重复的dHash汉明距离上限 (0-64)，None表示只合并内容完全相同的文件
 
 # 搜索配置
 DEFAULT_TOP_K = 10
 MAX_TOP_K = 50
+EMBEDDING_CACHE_SIZE = 2048  # 内存中缓存的查询向量数
+EMBEDDING_CACHE_PATH = os.path.join(INDEX_DIR, 'query_embedding_cache.db')  # 磁盘缓存路径，设为None则只使用内存缓存
+RESULT_CACHE_SIZE = 1024  # 缓存的搜索结果数
+RESULT_CACHE_TTL = 300  # 搜索结果缓存的有效期 (秒)
+HYBRID_RRF_K = 60  # 混合检索 (BM25 + 文本向量) 倒数排名融合的平滑常数
+FILTER_EXACT_THRESHOLD = 2048  # 过滤后剩余的图片向量不超过该数量时改为在其中精确检索，不再经过ANN索引
+METRICS_ENABLED = True  # 按阶段统计每次搜索的耗时 (HTTP服务通过 /metrics 导出)
+METRICS_WINDOW = 2048  # 计算滚动p50/p95/p99时每个模式/阶段保留的最近样本数
+SLOW_QUERY_MS = 500  # 慢查询阈值 (毫秒)，<=0 表示不记录
+SLOW_QUERY_LOG_PATH = os.path.join(DATA_DIR, 'slow_queries.jsonl')  # 慢查询日志，设为None则只输出到日志
+
+# HTTP搜索服务配置 (scripts/serve.py)
+SERVER_HOST = "0.0.0.0"
+SERVER_PORT = 8080
+SERVER_MAX_BATCH_SIZE = 32  # 每批最多合并的请求数
+SERVER_MAX_WAIT_MS = 5  # 第一个请求到达后最多等待合并的毫秒数
 
 # Streamlit配置
 PAGE_TITLE = "创意广告图文搜索系统"
@@ -64,7 +118,7 @@ def create_directories():
     """创建项目所需的目录结构"""
     directories = [
         DATA_DIR, RAW_DATA_DIR, PROCESSED_DATA_DIR, 
-        IMAGE_DIR, DATABASE_DIR, INDEX_DIR
+        IMAGE_DIR, THUMBNAIL_DIR, DATABASE_DIR, INDEX_DIR
     ]
     
     for directory in directories:
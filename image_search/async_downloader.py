@@ -0,0 +1,218 @@
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from loguru import logger
+from tqdm import tqdm
+
+from . import database
+from .downloader import Downloader
+from .image_io import StreamedImageWriter, InvalidImage, ImageTooLarge, check_content_length, image_path_for
+from .thumbnails import ThumbnailStore
+
+# 这些状态码视为暂时性错误，退避后重试；其余4xx直接判定失败
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+class HostLimiter:
+    """单个主机的并发与速率限制：信号量控制在途请求数，令牌桶控制每秒请求数。"""
+    def __init__(self, concurrency: int, rate: float = 0):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate = rate
+        # 桶容量至少为1，否则 rate<1 时令牌数永远达不到1
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire_token(self):
+        """按速率取得一个令牌，rate<=0 表示不限速。等待期间不阻塞其他主机的下载。"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class AsyncDownloader(Downloader):
+    """
+    基于asyncio的图片下载器。
+
+    - 所有请求共用一个aiohttp会话，连接池保持长连接，同一主机的后续请求无需重新握手；
+    - 按主机限制并发数和每秒请求数；
+    - 失败后按带随机抖动的指数退避重试，等待使用 asyncio.sleep，不占用其他下载的并发名额；
+    - 响应分块流式写盘并增量解码 (见 StreamedImageWriter)，写盘/解码和数据库回写放到线程池，
+      事件循环只负责网络IO。
+    """
+    def __init__(self, db_path: str, image_dir: str, max_concurrency: int = 256, per_host_concurrency: int = 8,
+                 per_host_rate: float = 0, timeout: int = 30, max_retries: int = 3,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0, db_batch_size: int = 200,
+                 max_image_bytes: int = 20 * 1024 * 1024, thumbnail_store: ThumbnailStore = None):
+        """
+        初始化AsyncDownloader。
+
+        Args:
+            db_path (str): SQLite数据库路径。
+            image_dir (str): 图片存储目录。
+            max_concurrency (int): 全局最大在途请求数。
+            per_host_concurrency (int): 每个主机的最大在途请求数。
+            per_host_rate (float): 每个主机每秒最多发起的请求数，0表示不限速。
+            timeout (int): 单次请求的总超时时间 (秒)。
+            max_retries (int): 最大尝试次数。
+            backoff_base (float): 退避的基础等待时间 (秒)，第n次重试最多等待 base * 2^n 秒。
+            backoff_max (float): 单次退避的最长等待时间 (秒)。
+            db_batch_size (int): 累积多少条下载结果后批量回写数据库。
+            max_image_bytes (int): 单张图片的大小上限，超出视为失败。
+            thumbnail_store (ThumbnailStore, optional): 提供时在下载的同时生成展示用缩略图。
+        """
+        super().__init__(db_path, image_dir, max_workers=max_concurrency, timeout=timeout, max_retries=max_retries,
+                         max_image_bytes=max_image_bytes, thumbnail_store=thumbnail_store)
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rate = per_host_rate
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.db_batch_size = db_batch_size
+        self._limiters: Dict[str, HostLimiter] = {}
+        # 数据库回写固定在同一个线程中执行，复用该线程的长连接
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="download-db")
+        self._io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="download-io")
+
+    def _limiter(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = self._limiters[host] = HostLimiter(self.per_host_concurrency, self.per_host_rate)
+        return limiter
+
+    def _backoff(self, attempt: int, retry_after: str = None) -> float:
+        """完全抖动的指数退避；服务端给出 Retry-After 时以其为下限。"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        return delay
+
+    def _write_records(self, records: List[Tuple]):
+        """批量回写下载结果，records为 (status, local_path, width, height, file_size, content_hash, phash, id)。"""
+        with database.transaction(self.db_path) as conn:
+            conn.executemany(
+                "UPDATE images SET download_status=?, local_path=?, width=?, height=?, file_size=?, "
+                "content_hash=?, phash=?, canonical_id=NULL WHERE id=?",
+                records
+            )
+
+    async def _fetch(self, session: aiohttp.ClientSession, image_data: Tuple) -> Tuple:
+        """下载单张图片 (含重试)，返回待回写数据库的记录。"""
+        image_id, ad_id, image_url = image_data
+        limiter = self._limiter(image_url)
+        local_path = image_path_for(self.image_dir, ad_id, image_id, image_url)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries):
+            retry_after = None
+            try:
+                await limiter.acquire_token()
+                async with limiter.semaphore:
+                    async with session.get(image_url) as response:
+                        if response.status >= 400:
+                            retry_after = response.headers.get('Retry-After')
+                            if response.status not in RETRYABLE_STATUS:
+                                logger.error(f"下载失败 (HTTP {response.status})，不再重试: {image_url}")
+                                return ('failed', None, None, None, None, None, None, image_id)
+                            raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                              status=response.status, message=response.reason)
+                        check_content_length(response.headers, self.max_image_bytes)
+                        writer = await loop.run_in_executor(self._io_executor, StreamedImageWriter, local_path, self.max_image_bytes)
+                        try:
+                            async for chunk in response.content.iter_chunked(256 * 1024):
+                                await loop.run_in_executor(self._io_executor, writer.feed, chunk)
+                            info = await loop.run_in_executor(self._io_executor, writer.commit, self.thumbnail_store)
+                        except BaseException:
+                            writer.abort()  # 删除临时文件，不留下不完整的图片
+                            raise
+                return ('completed', local_path, info['width'], info['height'], info['file_size'],
+                        info['content_hash'], info['phash'], image_id)
+            except (InvalidImage, ImageTooLarge) as e:
+                # 内容本身有问题，重试也无济于事
+                logger.error(f"图片无效，标记为失败: {image_url}, 错误: {e}")
+                return ('failed', None, None, None, None, None, None, image_id)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"下载失败 (第 {attempt + 1} 次): {image_url}, 错误: {type(e).__name__}: {e}")
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        logger.error(f"下载失败，已达最大重试次数: {image_url}")
+        return ('failed', None, None, None, None, None, None, image_id)
+
+    async def download_all(self, images: List[Tuple], session: aiohttp.ClientSession = None) -> Dict[str, int]:
+        """
+        下载一组图片并回写数据库。
+
+        Args:
+            images (List[Tuple]): (id, ad_id, image_url) 列表。
+            session (aiohttp.ClientSession, optional): 外部传入的会话 (如测试时指向本地HTTP服务)，默认自动创建。
+
+        Returns:
+            Dict[str, int]: 各状态的图片数量。
+        """
+        loop = asyncio.get_running_loop()
+        self._limiters = {}  # 限流器绑定当前事件循环，每次运行重新创建
+        queue = asyncio.Queue()
+        for image_data in images:
+            queue.put_nowait(image_data)
+        pending_records, counts = [], {'completed': 0, 'failed': 0}
+        progress = tqdm(total=len(images), desc="下载图片")
+
+        async def flush_records():
+            if pending_records:
+                records = pending_records[:]
+                pending_records.clear()
+                await loop.run_in_executor(self._db_executor, self._write_records, records)
+
+        async def worker(session):
+            while True:
+                try:
+                    image_data = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                record = await self._fetch(session, image_data)
+                counts[record[0]] += 1
+                progress.update(1)
+                pending_records.append(record)
+                if len(pending_records) >= self.db_batch_size:
+                    await flush_records()
+
+        own_session = session is None
+        if own_session:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_concurrency,
+                                             ttl_dns_cache=300, keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            # 固定数量的工作协程从队列取任务，数万个URL也不会一次性创建数万个协程
+            await asyncio.gather(*[worker(session) for _ in range(min(self.max_concurrency, len(images)))])
+            await flush_records()
+        finally:
+            progress.close()
+            if own_session:
+                await session.close()
+        return counts
+
+    def run(self):
+        """
+        执行图片下载的主流程。
+        """
+        pending_images = self.get_pending_images()
+        if not pending_images:
+            logger.info("没有待下载的图片。")
+            return
+
+        logger.info(f"发现 {len(pending_images)} 张待下载的图片，开始异步下载 (并发 {self.max_concurrency}，每主机 {self.per_host_concurrency})...")
+        counts = asyncio.run(self.download_all(pending_images))
+        logger.info(f"图片下载流程完成：成功 {counts['completed']} 张，失败 {counts['failed']} 张。")
@@ -1,8 +1,51 @@
+import os
 import pandas as pd
-from typing import List, Dict
-import json
+from loguru import logger
+from typing import Dict, Iterator, List
 import re
-import sqlite3
+
+from . import database, lexical
+
+# 原始导出文件的列名到数据库字段的映射
+COLUMN_MAPPING = {
+    '创意广告名字': 'name',
+    '广告URL': 'url',
+    '参赛说明标题': 'title',
+    '背景与目标内容': 'background',
+    '洞察与策略内容': 'insight',
+    '创意阐述内容': 'creative',
+    '结果与影响内容': 'result',
+    '应数评分': 'score',
+    '收藏': 'favorites',
+    '评论': 'comments',
+    '发布时间': 'publish_time',
+    '参赛类别': 'category',
+    '创意图片地址': 'images_str'
+}
+
+AD_FIELDS = ('name', 'url', 'title', 'background', 'insight', 'creative', 'result',
+             'score', 'favorites', 'comments', 'publish_time', 'category')
+# 参与文本索引的字段，变化时清空 text_embedding_id，由增量更新重新生成段落向量
+TEXT_FIELDS = ('title', 'background', 'insight', 'creative')
+
+# 以广告URL为键的upsert：只有字段确实变化的行才会被改写
+_UPSERT_AD_SQL = f'''
+INSERT INTO advertisements ({', '.join(AD_FIELDS)})
+VALUES ({', '.join(':' + field for field in AD_FIELDS)})
+ON CONFLICT (url) DO UPDATE SET
+    {', '.join(f'{field} = excluded.{field}' for field in AD_FIELDS if field != 'url')},
+    text_embedding_id = CASE WHEN {' AND '.join(f'advertisements.{field} IS excluded.{field}' for field in TEXT_FIELDS)}
+                        THEN advertisements.text_embedding_id ELSE NULL END
+WHERE {' OR '.join(f'advertisements.{field} IS NOT excluded.{field}' for field in AD_FIELDS if field != 'url')}
+'''
+
+_INSERT_IMAGE_SQL = '''
+INSERT INTO images (ad_id, image_url, download_status) VALUES (?, ?, 'pending')
+ON CONFLICT (ad_id, image_url) DO NOTHING
+'''
+
+# 单条SQL中IN列表的最大参数个数 (低于SQLite的默认上限)
+_MAX_SQL_PARAMS = 500
 
 class DataProcessor:
     """
@@ -11,7 +54,7 @@ class DataProcessor:
     def __init__(self, db_path: str):
         """
         初始化DataProcessor。
-        
+
         Args:
             db_path (str): SQLite数据库文件路径。
         """
@@ -20,48 +63,10 @@ class DataProcessor:
 
     def _create_tables(self):
         """
-        创建数据库表结构 (advertisements 和 images)。
-        如果表已存在，则不会重复创建。
+        创建或升级数据库表结构 (advertisements 和 images)。
+        建表、加列和建索引都由 database 模块的迁移完成，已是最新版本时不做任何操作。
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS advertisements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            url TEXT,
-            title TEXT,
-            background TEXT,
-            insight TEXT,
-            creative TEXT,
-            result TEXT,
-            score REAL,
-            favorites INTEGER,
-            comments INTEGER,
-            publish_time TEXT,
-            category TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ad_id INTEGER,
-            image_url TEXT,
-            local_path TEXT,
-            embedding_id INTEGER,
-            width INTEGER,
-            height INTEGER,
-            file_size INTEGER,
-            download_status TEXT,
-            FOREIGN KEY (ad_id) REFERENCES advertisements (id)
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        database.migrate(database.get_connection(self.db_path))
 
     def parse_csv(self, csv_path: str) -> List[Dict]:
         """
@@ -73,39 +78,70 @@ class DataProcessor:
         Returns:
             List[Dict]: 清洗后的数据列表，每个字典代表一条广告。
         """
-        df = pd.read_csv(csv_path)
-        
-        # 定义字段映射关系
-        column_mapping = {
-            '创意广告名字': 'name',
-            '广告URL': 'url',
-            '参赛说明标题': 'title',
-            '背景与目标内容': 'background',
-            '洞察与策略内容': 'insight',
-            '创意阐述内容': 'creative',
-            '结果与影响内容': 'result',
-            '应数评分': 'score',
-            '收藏': 'favorites',
-            '评论': 'comments',
-            '发布时间': 'publish_time',
-            '参赛类别': 'category',
-            '创意图片地址': 'images_str'
-        }
-        
-        df = df[list(column_mapping.keys())].rename(columns=column_mapping)
-        
+        return [record for chunk in self.iter_chunks(csv_path) for record in chunk]
+
+    def iter_chunks(self, path: str, chunk_size: int = 5000) -> Iterator[List[Dict]]:
+        """
+        分块流式读取CSV或Excel (.xlsx) 导出文件，每次只在内存中保留一块。
+
+        Args:
+            path (str): 文件路径。
+            chunk_size (int): 每块的行数。
+
+        Yields:
+            List[Dict]: 清洗后的一块广告数据。
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.csv':
+            frames = pd.read_csv(path, usecols=list(COLUMN_MAPPING), chunksize=chunk_size)
+        elif ext in ('.xlsx', '.xlsm'):
+            frames = self._iter_excel_frames(path, chunk_size)
+        else:
+            raise ValueError(f"不支持的文件格式: {path}")
+        for df in frames:
+            yield self._clean_frame(df)
+
+    @staticmethod
+    def _iter_excel_frames(path: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """以只读模式逐行读取Excel的第一个工作表 (pandas.read_excel不支持分块)。"""
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(name).strip() if name is not None else '' for name in next(rows, ())]
+            missing = set(COLUMN_MAPPING) - set(header)
+            if missing:
+                raise ValueError(f"{path} 缺少列: {sorted(missing)}")
+            width = len(header)
+            buffer = []
+            for row in rows:
+                buffer.append(tuple(row[:width]) + (None,) * (width - len(row)))
+                if len(buffer) >= chunk_size:
+                    yield pd.DataFrame(buffer, columns=header)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=header)
+        finally:
+            workbook.close()
+
+    def _clean_frame(self, df: pd.DataFrame) -> List[Dict]:
+        """字段重命名与清洗，返回字典列表 (缺失值为None)。"""
+        df = df[list(COLUMN_MAPPING.keys())].rename(columns=COLUMN_MAPPING)
+
         # 数据清洗
-        df['score'] = pd.to_numeric(df['score'], errors='coerce').fillna(0)
+        df['score'] = pd.to_numeric(df['score'], errors='coerce').fillna(0).astype(float)
         df['favorites'] = pd.to_numeric(df['favorites'], errors='coerce').fillna(0).astype(int)
         df['comments'] = pd.to_numeric(df['comments'], errors='coerce').fillna(0).astype(int)
-        
+        # Excel中的日期单元格与CSV中的文本统一为字符串，保证两种来源导入的数据一致
+        df['publish_time'] = df['publish_time'].map(lambda value: value if value is None or isinstance(value, str) or pd.isna(value) else str(value))
+
         # 提取图片URL
         df['image_urls'] = df['images_str'].apply(self.extract_image_urls)
-        
+
         # 转换为字典列表
-        clean_data = df.drop(columns=['images_str']).to_dict('records')
-        
-        return clean_data
+        df = df.drop(columns=['images_str']).astype(object)
+        return df.where(df.notna(), None).to_dict('records')
 
     def extract_image_urls(self, url_string: str) -> List[str]:
         """
@@ -120,39 +156,90 @@ class DataProcessor:
         """
         if not isinstance(url_string, str):
             return []
-        
+
         # 使用正则表达式匹配URL，更健壮
         urls = re.findall(r'https?://[^\s,;]+', url_string)
         return urls
 
-    def save_to_database(self, data: List[Dict]):
+    def save_to_database(self, data: List[Dict]) -> Dict[str, int]:
         """
-        将数据批量保存到SQLite数据库中。
+        将数据批量写入SQLite数据库 (一个事务)，按广告URL和 (广告, 图片URL) 做upsert，重复导入是幂等的：
+        新广告插入，字段有变化的广告更新 (文本字段变化时等待重新生成文本向量)，未变化的广告不做任何写入；
+        新的图片URL以pending状态插入，已有的图片记录保持不变。
 
         Args:
-            data (List[Dict]): 从Excel中解析出的数据列表。
+            data (List[Dict]): 解析出的数据列表。
+
+        Returns:
+            Dict[str, int]: {'inserted', 'updated', 'unchanged', 'skipped', 'new_images'}。
+        """
+        with database.transaction(self.db_path) as conn:
+            return self._upsert(conn, data)
+
+    def _select_by_url(self, conn, urls: List[str], columns: tuple = ()) -> Dict[str, tuple]:
+        """返回 {url: (id, *columns)}。"""
+        rows = {}
+        select = ', '.join(('url', 'id') + tuple(columns))
+        for start in range(0, len(urls), _MAX_SQL_PARAMS):
+            batch = urls[start:start + _MAX_SQL_PARAMS]
+            cursor = conn.execute(f"SELECT {select} FROM advertisements WHERE url IN ({','.join('?' for _ in batch)})", batch)
+            rows.update((row[0], row[1:]) for row in cursor.fetchall())
+        return rows
+
+    def _upsert(self, conn, data: List[Dict]) -> Dict[str, int]:
+        records = [record for record in data if record.get('url')]
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': len(data) - len(records), 'new_images': 0}
+        if not records:
+            return stats
+        urls = list(dict.fromkeys(record['url'] for record in records))
+        existing = self._select_by_url(conn, urls, lexical.FTS_COLUMNS)
+
+        cursor = conn.executemany(_UPSERT_AD_SQL, [{field: record.get(field) for field in AD_FIELDS} for record in records])
+        # rowcount为实际插入与更新的行数，字段未变化的冲突行不计入
+        stats['inserted'] = len(urls) - len(existing)
+        stats['updated'] = max(cursor.rowcount - stats['inserted'], 0)
+        stats['unchanged'] = len(urls) - stats['inserted'] - stats['updated']
+
+        ad_ids = {url: row[0] for url, row in self._select_by_url(conn, urls).items()}
+        image_rows = [(ad_ids[record['url']], image_url) for record in records for image_url in record.get('image_urls') or []]
+        if image_rows:
+            stats['new_images'] = conn.executemany(_INSERT_IMAGE_SQL, image_rows).rowcount
+        self._update_fts(conn, records, existing, ad_ids)
+        return stats
+
+    def _update_fts(self, conn, records: List[Dict], existing: Dict[str, tuple], ad_ids: Dict[str, int]):
+        """为新增或参与全文索引的字段有变化的广告重建全文索引 (同一URL以最后一条记录为准)。"""
+        if not lexical.has_index(conn):
+            return
+        latest = {record['url']: record for record in records}
+        rows = []
+        for url, record in latest.items():
+            values = tuple(record.get(field) for field in lexical.FTS_COLUMNS)
+            if url not in existing or existing[url][1:] != values:
+                rows.append((ad_ids[url],) + values)
+        lexical.index_ads(conn, rows)
+
+    def ingest(self, path: str, chunk_size: int = 5000) -> Dict[str, int]:
+        """
+        流式导入一个CSV/Excel导出文件：分块读取，每块一个事务批量upsert。
+        可以重复执行，重新导入更新后的导出文件只会写入有变化的行。
+
+        Args:
+            path (str): 文件路径。
+            chunk_size (int): 每块的行数 (也是每个事务写入的广告数)。
+
+        Returns:
+            Dict[str, int]: 各块统计的合计，见 save_to_database。
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        for record in data:
-            ad_data = {k: v for k, v in record.items() if k != 'image_urls'}
-            
-            # 插入广告数据
-            cursor.execute('''
-            INSERT INTO advertisements (name, url, title, background, insight, creative, result, score, favorites, comments, publish_time, category)
-            VALUES (:name, :url, :title, :background, :insight, :creative, :result, :score, :favorites, :comments, :publish_time, :category)
-            ''', ad_data)
-            
-            ad_id = cursor.lastrowid
-            
-            # 插入图片URL
-            if 'image_urls' in record and record['image_urls']:
-                for img_url in record['image_urls']:
-                    cursor.execute('''
-                    INSERT INTO images (ad_id, image_url, download_status)
-                    VALUES (?, ?, ?)
-                    ''', (ad_id, img_url, 'pending'))
-
-        conn.commit()
-        conn.close() 
\ No newline at end of file
+        totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'new_images': 0}
+        rows = 0
+        for chunk in self.iter_chunks(path, chunk_size):
+            stats = self.save_to_database(chunk)
+            for key, value in stats.items():
+                totals[key] += value
+            rows += len(chunk)
+            logger.info(f"{os.path.basename(path)}: 已处理 {rows} 行 (新增 {totals['inserted']}，更新 {totals['updated']}，"
+                        f"未变化 {totals['unchanged']}，新图片 {totals['new_images']})")
+        if totals['skipped']:
+            logger.warning(f"{os.path.basename(path)}: {totals['skipped']} 行缺少广告URL，已跳过。")
+        return totals
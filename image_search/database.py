@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from loguru import logger
+
+from . import lexical
+
+# 每个连接建立时应用的PRAGMA
+# WAL模式下读写互不阻塞，多个下载线程的写入只需串行提交而不必等待读者
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",      # WAL下NORMAL即可保证一致性，提交无需每次fsync
+    "PRAGMA busy_timeout = 30000",      # 写锁竞争时最多等待30秒而不是立即报错
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",       # 64MB页缓存
+    "PRAGMA mmap_size = 268435456",     # 256MB内存映射读取
+)
+
+def _migration_1(cursor):
+    """基础表结构。"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS advertisements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        url TEXT,
+        title TEXT,
+        background TEXT,
+        insight TEXT,
+        creative TEXT,
+        result TEXT,
+        score REAL,
+        favorites INTEGER,
+        comments INTEGER,
+        publish_time TEXT,
+        category TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ad_id INTEGER,
+        image_url TEXT,
+        local_path TEXT,
+        embedding_id INTEGER,
+        width INTEGER,
+        height INTEGER,
+        file_size INTEGER,
+        download_status TEXT,
+        FOREIGN KEY (ad_id) REFERENCES advertisements (id)
+    )
+    ''')
+
+def _migration_2(cursor):
+    """广告文本向量标记列 (已加入文本索引时等于广告id)。"""
+    cursor.execute("PRAGMA table_info(advertisements)")
+    if 'text_embedding_id' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE advertisements ADD COLUMN text_embedding_id INTEGER")
+
+def _migration_3(cursor):
+    """检索与下载常用过滤条件上的二级索引。"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_ad_id ON images (ad_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_embedding_id ON images (embedding_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_download_status ON images (download_status)")
+
+def _migration_4(cursor):
+    """图片去重：内容哈希、感知哈希、canonical_id 列以及向量到图片/广告的映射视图。"""
+    cursor.execute("PRAGMA table_info(images)")
+    columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (('content_hash', 'TEXT'), ('phash', 'TEXT'), ('canonical_id', 'INTEGER')):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE images ADD COLUMN {column} {column_type}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images (content_hash)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_canonical_id ON images (canonical_id)")
+    # 重复图片共用canonical图片的向量 (embedding_id = canonical_id)，一个向量对应多行图片和多个广告
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS embedding_members AS
+    SELECT embedding_id, id AS image_id, ad_id FROM images WHERE embedding_id IS NOT NULL
+    ''')
+
+def _migration_5(cursor):
+    """广告URL、(广告, 图片URL) 上的唯一约束，用于导入时按URL幂等地upsert；先合并已有的重复记录。"""
+    # 同一URL的广告保留id最小的一条，重复广告的图片归到保留的广告下
+    cursor.execute('''
+    CREATE TEMP TABLE ad_duplicates AS
+    SELECT a.id AS id, k.keep_id AS keep_id FROM advertisements a
+    JOIN (SELECT url, MIN(id) AS keep_id FROM advertisements WHERE url IS NOT NULL GROUP BY url HAVING COUNT(*) > 1) k
+    ON a.url = k.url WHERE a.id != k.keep_id
+    ''')
+    cursor.execute('''
+    UPDATE images SET ad_id = (SELECT keep_id FROM ad_duplicates WHERE ad_duplicates.id = images.ad_id)
+    WHERE ad_id IN (SELECT id FROM ad_duplicates)
+    ''')
+    cursor.execute("DELETE FROM advertisements WHERE id IN (SELECT id FROM ad_duplicates)")
+    cursor.execute("DROP TABLE ad_duplicates")
+    # 同一广告下重复的图片URL优先保留已有向量、已下载的记录，其余记录删除
+    cursor.execute('''
+    CREATE TEMP TABLE image_duplicates AS
+    SELECT id, keep_id FROM (
+        SELECT id, FIRST_VALUE(id) OVER w AS keep_id, ROW_NUMBER() OVER w AS rank FROM images
+        WHERE image_url IS NOT NULL
+        WINDOW w AS (PARTITION BY ad_id, image_url ORDER BY embedding_id IS NULL, download_status IS NOT 'completed', id)
+    ) WHERE rank > 1
+    ''')
+    cursor.execute('''
+    UPDATE images SET canonical_id = (SELECT keep_id FROM image_duplicates WHERE image_duplicates.id = images.canonical_id)
+    WHERE canonical_id IN (SELECT id FROM image_duplicates)
+    ''')
+    cursor.execute("DELETE FROM images WHERE id IN (SELECT id FROM image_duplicates)")
+    cursor.execute("DROP TABLE image_duplicates")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_advertisements_url ON advertisements (url)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_images_ad_url ON images (ad_id, image_url)")
+
+def _migration_6(cursor):
+    """广告标题与正文的FTS5全文索引 (汉字切分为二元组后写入)，用于关键词与混合检索。"""
+    lexical.create_index(cursor)
+
+# 按顺序执行的迁移，版本号记录在 PRAGMA user_version 中
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+]
+
+_local = threading.local()
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+def migrate(conn: sqlite3.Connection):
+    """将数据库升级到最新版本，已执行过的迁移会被跳过。"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+    with conn:
+        cursor = conn.cursor()
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"正在执行数据库迁移 {number}: {step.__doc__}")
+            step(cursor)
+        cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """
+    获取当前线程对该数据库的长连接。
+    每个线程首次访问时建立连接并应用PRAGMA，每个进程首次访问某个数据库时执行迁移。
+
+    Args:
+        db_path (str): SQLite数据库路径。
+
+    Returns:
+        sqlite3.Connection: 当前线程专用的连接，请勿跨线程共享或关闭。
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = os.path.abspath(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        conn = sqlite3.connect(key)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[key] = conn
+        with _migrate_lock:
+            if key not in _migrated:
+                migrate(conn)
+                _migrated.add(key)
+    return conn
+
+@contextmanager
+def transaction(db_path: str):
+    """
+    在当前线程的长连接上执行一个事务，正常退出时提交，异常时回滚。
+
+    Example:
+        with transaction(db_path) as conn:
+            conn.executemany("UPDATE images SET ... WHERE id = ?", rows)
+    """
+    conn = get_connection(db_path)
+    with conn:
+        yield conn
+
+def close_connections():
+    """关闭当前线程持有的全部连接。"""
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
@@ -0,0 +1,171 @@
+import hashlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from loguru import logger
+from typing import Optional, Tuple
+
+from . import database
+
+def dhash(image: Image.Image, hash_size: int = 8) -> Optional[str]:
+    """
+    计算图片的差值感知哈希 (dHash)：缩放为 (hash_size+1) x hash_size 的灰度图，比较相邻像素的明暗。
+    对重新编码、缩放和轻微调色不敏感，可识别同一张主视觉的不同副本。
+
+    Returns:
+        Optional[str]: 16位十六进制字符串；纯色等几乎没有信息量的图片返回None，避免被误判为重复。
+    """
+    gray = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    if bits.all() or not bits.any():
+        return None
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):0{hash_size * hash_size // 4}x}"
+
+def dhash_file(path: str) -> Optional[str]:
+    """
+    计算图片文件的dHash。JPEG先以draft模式按DCT缩放解码为小尺寸灰度图，省去完整解码。
+    下载时与补算时都经由此函数计算，保证同一文件得到相同的感知哈希。
+    """
+    with Image.open(path) as image:
+        image.draft('L', (64, 64))
+        return dhash(image)
+
+def hash_file(path: str) -> Tuple[str, Optional[str]]:
+    """计算图片文件的 (sha256, dHash)。"""
+    with open(path, 'rb') as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    return content_hash, dhash_file(path)
+
+def phash_distance(a: str, b: str) -> int:
+    """两个dHash之间的汉明距离 (不同的位数)。"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+# 0-255 每个字节值中1的个数，用于批量计算汉明距离
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _hamming_distances(value: int, values: np.ndarray) -> np.ndarray:
+    """value 与 values (uint64数组) 中每个元素的汉明距离。"""
+    xor = np.bitwise_xor(values, np.uint64(value))
+    return _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def backfill_hashes(db_path: str, num_workers: int = 8) -> int:
+    """
+    为已下载但尚未计算哈希的图片补算内容哈希与感知哈希 (通常是引入去重之前下载的图片)。
+    无法读取或解码的图片标记为下载失败。
+
+    Returns:
+        int: 补算的图片数量。
+    """
+    cursor = database.get_connection(db_path).cursor()
+    cursor.execute("SELECT id, local_path FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL AND content_hash IS NULL")
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    def task(row):
+        try:
+            return row[0], hash_file(row[1])
+        except Exception as e:
+            logger.warning(f"计算图片哈希失败，标记为下载失败: {row[1]}, 错误: {e}")
+            return row[0], None
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(task, rows))
+    with database.transaction(db_path) as conn:
+        conn.executemany("UPDATE images SET content_hash = ?, phash = ? WHERE id = ?",
+                         [(hashes[0], hashes[1], image_id) for image_id, hashes in results if hashes])
+        conn.executemany("UPDATE images SET download_status = 'failed' WHERE id = ?",
+                         [(image_id,) for image_id, hashes in results if not hashes])
+    logger.info(f"已为 {len(rows)} 张图片补算哈希。")
+    return len(rows)
+
+def assign_canonical_ids(db_path: str, phash_max_distance: Optional[int] = None) -> int:
+    """
+    为尚未分组的图片分配 canonical_id：同一组重复图片共用组内最早出现的图片id，
+    只有 id = canonical_id 的图片需要生成向量，其余图片通过 embedding_id 共用该向量。
+    已分配的 canonical_id 保持不变，新图片加入已有分组时沿用该组的 canonical_id。
+
+    只有内容哈希相同的文件才视为重复。感知哈希相同并不代表是同一张图 (同一模板的不同海报dHash可能完全一致)，
+    仅在显式给出 phash_max_distance 时作为近似重复的判据：没有完全相同的文件时，
+    加入感知哈希与组内canonical图片相差不超过该位数的分组。
+    不再满足当前规则的已有分组成员 (如以前按感知哈希合并的不同图片) 会被拆出，并清除embedding_id以重新生成向量。
+
+    Args:
+        db_path (str): SQLite数据库路径。
+        phash_max_distance (int, optional): 近似重复允许的dHash汉明距离 (0-64)，为None时只合并完全相同的文件。
+
+    Returns:
+        int: 新分配的图片数量。
+    """
+    with database.transaction(db_path) as conn:
+        # canonical图片下载失败后，组内其余图片重新分组
+        conn.execute("UPDATE images SET canonical_id = NULL WHERE canonical_id IN "
+                     "(SELECT id FROM images WHERE download_status != 'completed')")
+    cursor = database.get_connection(db_path).cursor()
+    cursor.execute(
+        "SELECT id, content_hash, phash, canonical_id FROM images "
+        "WHERE download_status = 'completed' AND content_hash IS NOT NULL ORDER BY id"
+    )
+    rows = cursor.fetchall()
+    hashes = {image_id: (content_hash, phash) for image_id, content_hash, phash, _ in rows}
+
+    def same_group(image_id, canonical_id):
+        content_hash, phash = hashes[image_id]
+        canonical_hash, canonical_phash = hashes[canonical_id]
+        if content_hash == canonical_hash:
+            return True
+        return (phash_max_distance is not None and phash is not None and canonical_phash is not None
+                and phash_distance(phash, canonical_phash) <= phash_max_distance)
+
+    canonical_by_hash, canonical_phashes, unassigned, detached = {}, {}, [], []
+    for image_id, content_hash, phash, canonical_id in rows:
+        if canonical_id is not None and canonical_id in hashes and not same_group(image_id, canonical_id):
+            detached.append(image_id)
+            canonical_id = None
+        if canonical_id is None:
+            unassigned.append(image_id)
+            continue
+        if hashes[canonical_id][0] == content_hash:
+            canonical_by_hash[content_hash] = min(canonical_id, canonical_by_hash.get(content_hash, canonical_id))
+        if canonical_id == image_id and phash is not None:
+            canonical_phashes[image_id] = int(phash, 16)
+    if not unassigned:
+        return 0
+
+    # 近似重复时与各组canonical图片的感知哈希比较 (不做传递，避免分组逐步漂移)
+    group_ids = np.zeros(len(canonical_phashes) + len(unassigned), dtype=np.int64)
+    group_phashes = np.zeros(len(group_ids), dtype=np.uint64)
+    num_groups = len(canonical_phashes)
+    group_ids[:num_groups] = list(canonical_phashes)
+    group_phashes[:num_groups] = list(canonical_phashes.values())
+    updates = []
+    for image_id in unassigned:
+        content_hash, phash = hashes[image_id]
+        canonical_id = canonical_by_hash.get(content_hash)
+        if canonical_id is None and phash_max_distance is not None and phash is not None and num_groups:
+            distances = _hamming_distances(int(phash, 16), group_phashes[:num_groups])
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= phash_max_distance:
+                canonical_id = int(group_ids[nearest])
+        if canonical_id is None:
+            canonical_id = image_id
+            if phash is not None:
+                group_ids[num_groups], group_phashes[num_groups] = image_id, int(phash, 16)
+                num_groups += 1
+        canonical_by_hash.setdefault(content_hash, canonical_id)
+        updates.append((canonical_id, image_id))
+    with database.transaction(db_path) as conn:
+        # 拆出的图片原先共用其他图片的向量，需要按新分组重新生成或共用
+        conn.executemany("UPDATE images SET canonical_id = NULL, embedding_id = NULL WHERE id = ?",
+                         [(image_id,) for image_id in detached])
+        conn.executemany("UPDATE images SET canonical_id = ? WHERE id = ?", updates)
+    duplicates = sum(1 for canonical_id, image_id in updates if canonical_id != image_id)
+    if detached:
+        logger.info(f"已从不再满足去重规则的分组中拆出 {len(detached)} 张图片。")
+    logger.info(f"已为 {len(updates)} 张图片分配去重分组，其中 {duplicates} 张与已有图片重复。")
+    return len(updates)
+
+def prepare_images(db_path: str, num_workers: int = 8, phash_max_distance: Optional[int] = None):
+    """索引前的去重准备：补算哈希并分配 canonical_id，phash_max_distance 见 assign_canonical_ids。"""
+    backfill_hashes(db_path, num_workers)
+    assign_canonical_ids(db_path, phash_max_distance)
@@ -1,19 +1,22 @@
 import os
-import sqlite3
 import time
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 
 import requests
-from PIL import Image
 from loguru import logger
 from tqdm import tqdm
 
+from . import database
+from .image_io import StreamedImageWriter, InvalidImage, ImageTooLarge, check_content_length, image_path_for
+from .thumbnails import ThumbnailStore
+
 class Downloader:
     """
     负责从数据库中读取图片URL，下载图片，并更新数据库记录。
     """
-    def __init__(self, db_path: str, image_dir: str, max_workers: int = 10, timeout: int = 30, max_retries: int = 3):
+    def __init__(self, db_path: str, image_dir: str, max_workers: int = 10, timeout: int = 30, max_retries: int = 3,
+                 max_image_bytes: int = 20 * 1024 * 1024, thumbnail_store: ThumbnailStore = None):
         """
         初始化Downloader。
 
@@ -23,20 +26,23 @@ class Downloader:
             max_workers (int): 下载线程池的最大线程数。
             timeout (int): 下载请求超时时间。
             max_retries (int): 下载失败最大重试次数。
+            max_image_bytes (int): 单张图片的大小上限，超出视为失败。
+            thumbnail_store (ThumbnailStore, optional): 提供时在下载的同时生成展示用缩略图。
         """
         self.db_path = db_path
         self.image_dir = image_dir
         self.max_workers = max_workers
         self.timeout = timeout
         self.max_retries = max_retries
+        self.max_image_bytes = max_image_bytes
+        self.thumbnail_store = thumbnail_store
         os.makedirs(self.image_dir, exist_ok=True)
 
     def get_pending_images(self) -> List[Tuple]:
         """从数据库获取所有待下载的图片记录。"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, ad_id, image_url FROM images WHERE download_status = 'pending'")
-            return cursor.fetchall()
+        cursor = database.get_connection(self.db_path).cursor()
+        cursor.execute("SELECT id, ad_id, image_url FROM images WHERE download_status = 'pending'")
+        return cursor.fetchall()
 
     def download_image_task(self, image_data: Tuple):
         """
@@ -46,29 +52,29 @@ class Downloader:
             image_data (Tuple): 包含 (id, ad_id, image_url) 的元组。
         """
         image_id, ad_id, image_url = image_data
-        
+        local_path = image_path_for(self.image_dir, ad_id, image_id, image_url)
+
         for attempt in range(self.max_retries):
             try:
-                response = requests.get(image_url, timeout=self.timeout)
-                response.raise_for_status()
-                
-                # 生成本地文件路径
-                file_extension = os.path.splitext(image_url)[1] or '.jpg'
-                local_path = os.path.join(self.image_dir, f"{ad_id}_{image_id}{file_extension}")
-                
-                # 保存图片文件
-                with open(local_path, 'wb') as f:
-                    f.write(response.content)
-                
-                # 获取图片信息
-                with Image.open(local_path) as img:
-                    width, height = img.size
-                file_size = os.path.getsize(local_path)
-                
+                # 流式写入临时文件，同时在同一遍数据上解析尺寸、校验并生成缩略图
+                with requests.get(image_url, timeout=self.timeout, stream=True) as response:
+                    response.raise_for_status()
+                    check_content_length(response.headers, self.max_image_bytes)
+                    with StreamedImageWriter(local_path, self.max_image_bytes) as writer:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            writer.feed(chunk)
+                        info = writer.commit(self.thumbnail_store)
+
                 # 更新数据库记录
-                self.update_image_record(image_id, 'completed', local_path, width, height, file_size)
+                self.update_image_record(image_id, 'completed', local_path, info['width'], info['height'], info['file_size'],
+                                         info['content_hash'], info['phash'])
+                return
+
+            except (InvalidImage, ImageTooLarge) as e:
+                # 内容本身有问题，重试也无济于事
+                logger.error(f"图片无效，标记为失败: {image_url}, 错误: {e}")
+                self.update_image_record(image_id, 'failed')
                 return
-                
             except requests.RequestException as e:
                 logger.warning(f"下载失败 (第 {attempt + 1} 次): {image_url}, 错误: {e}")
                 time.sleep(2 ** attempt) # 指数退避
@@ -77,15 +83,15 @@ class Downloader:
         logger.error(f"下载失败，已达最大重试次数: {image_url}")
         self.update_image_record(image_id, 'failed')
 
-    def update_image_record(self, image_id: int, status: str, local_path: str = None, width: int = None, height: int = None, file_size: int = None):
-        """更新数据库中的图片记录。"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE images SET download_status=?, local_path=?, width=?, height=?, file_size=? WHERE id=?",
-                (status, local_path, width, height, file_size, image_id)
+    def update_image_record(self, image_id: int, status: str, local_path: str = None, width: int = None, height: int = None,
+                            file_size: int = None, content_hash: str = None, phash: str = None):
+        """更新数据库中的图片记录 (使用当前下载线程的长连接)。重新下载的图片需重新分配去重分组。"""
+        with database.transaction(self.db_path) as conn:
+            conn.execute(
+                "UPDATE images SET download_status=?, local_path=?, width=?, height=?, file_size=?, "
+                "content_hash=?, phash=?, canonical_id=NULL WHERE id=?",
+                (status, local_path, width, height, file_size, content_hash, phash, image_id)
             )
-            conn.commit()
 
     def run(self):
         """
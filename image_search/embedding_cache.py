@@ -0,0 +1,143 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from loguru import logger
+from typing import Dict, Optional
+
+def normalize_text(text: str) -> str:
+    """全角转半角、去除首尾空白、合并连续空白并转为小写。"""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+def image_digest(image) -> str:
+    """
+    计算图片文件内容的sha256。
+
+    Args:
+        image: 图片文件路径、bytes，或带有 getvalue()/read() 的文件对象 (如Streamlit上传的文件)。
+    """
+    if isinstance(image, (bytes, bytearray)):
+        data = bytes(image)
+    elif isinstance(image, (str, os.PathLike)):
+        with open(image, 'rb') as f:
+            data = f.read()
+    elif hasattr(image, 'getvalue'):
+        data = image.getvalue()
+    else:
+        position = image.tell()
+        data = image.read()
+        image.seek(position)
+    return hashlib.sha256(data).hexdigest()
+
+def query_key(kind: str, query) -> str:
+    """查询的内容键：文本为规范化后的文本，图片为内容哈希。"""
+    return normalize_text(query) if kind == 'text' else image_digest(query)
+
+class EmbeddingCache:
+    """
+    查询向量缓存：内存中的有界LRU，外加可选的SQLite磁盘层 (进程重启后仍然有效)。
+
+    文本以规范化后的文本为键，图片以文件内容的sha256为键，键中均包含模型名称，
+    更换模型后旧向量自然失效。
+    """
+    def __init__(self, model_name: str, max_entries: int = 2048, disk_path: str = None):
+        """
+        初始化EmbeddingCache。
+
+        Args:
+            model_name (str): 生成向量的模型名称，作为所有键的前缀。
+            max_entries (int): 内存中最多保留的向量数。
+            disk_path (str, optional): 磁盘缓存的SQLite文件路径，为None时只使用内存缓存。
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode = WAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._disk.commit()
+
+    def make_key(self, kind: str, content_key: str) -> str:
+        """由查询类型 ('text'/'image') 和内容键 (见 query_key) 组成缓存键。"""
+        return f"{self.model_name}:{kind}:{content_key}"
+
+    def text_key(self, text: str) -> str:
+        return self.make_key('text', normalize_text(text))
+
+    def image_key(self, image) -> str:
+        return self.make_key('image', image_digest(image))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        查询缓存，依次查找内存和磁盘，磁盘命中的向量会放回内存。
+
+        Returns:
+            Optional[np.ndarray]: 缓存的向量，未命中时返回None。
+        """
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._disk is not None:
+                row = self._disk.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32).reshape(1, -1)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: np.ndarray):
+        """写入缓存，同时写入内存和磁盘。"""
+        vector = np.ascontiguousarray(vector, dtype=np.float32).reshape(1, -1)
+        vector.setflags(write=False)  # 调用方共享同一数组，禁止原地修改
+        with self._lock:
+            self._remember(key, vector)
+            if self._disk is not None:
+                try:
+                    with self._disk:
+                        self._disk.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, vector.tobytes()))
+                except sqlite3.Error as e:
+                    logger.warning(f"写入磁盘向量缓存失败: {e}")
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空内存和磁盘缓存。"""
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                with self._disk:
+                    self._disk.execute("DELETE FROM embeddings")
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中计数与命中率。"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
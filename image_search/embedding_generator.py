@@ -1,22 +1,48 @@
-import torch
-import cn_clip.clip as clip
-from cn_clip.clip import load_from_name, available_models
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from typing import List
+from typing import List, Sequence, Tuple
 from loguru import logger
 
+from .inference_backends import ENCODER_TOWERS, INFERENCE_BACKENDS, OnnxTower, backend_within_tolerance, export_onnx, onnx_path, quantize_onnx
+
 class EmbeddingGenerator:
     """
     负责加载Chinese-CLIP模型并生成图片和文本的向量。
+    图片塔和文本塔按需分别加载：只做文本检索的进程不会加载视觉模型。
+    torch与cn_clip也只在第一次编码 (或 warmup) 时才导入，创建实例本身几乎没有开销。
     """
-    def __init__(self, model_name: str = "ViT-B-16"):
+    def __init__(self, model_name: str = "ViT-B-16", num_workers: int = 4, context_length: int = 52, backend: str = 'torch',
+                 onnx_dir: str = './models/onnx', drift_report: str = None, max_drift: float = 0.02,
+                 towers: Sequence[str] = ('image', 'text'), artifact_dir: str = './models/artifacts', lazy: bool = True,
+                 device: str = None):
         """
         初始化EmbeddingGenerator。
 
         Args:
             model_name (str): 要使用的Chinese-CLIP模型名称。
-            device (str): 运行模型的设备 ('cuda', 'mps' or 'cpu')。
+            num_workers (int): 批量编码时解码/预处理图片的线程数。
+            context_length (int): 文本编码的最大token长度(含[CLS]/[SEP])。
+            backend (str): 推理后端，见 inference_backends.INFERENCE_BACKENDS。非 'torch' 的后端只在CPU上运行。
+            onnx_dir (str): ONNX模型目录，文件不存在时自动导出。
+            drift_report (str, optional): 推理偏差报告路径。提供时，偏差超出max_drift (或未测量) 的后端
+                会回退为 'torch'，保证查询向量与现有索引一致。
+            max_drift (float): 允许的最大余弦偏差 (1 - 余弦相似度)。
+            towers (Sequence[str]): 允许加载的编码塔，纯文本部署可只保留 'text'。
+            artifact_dir (str): 预先序列化的编码塔目录 (见 model_loader)，首次使用时从checkpoint转换生成。
+            lazy (bool): 为True时各编码塔在第一次使用时才加载，否则在初始化时全部加载。
+            device (str, optional): 指定设备，默认自动选择 cuda > mps > cpu。
         """
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"不支持的推理后端: {backend}，可选: {INFERENCE_BACKENDS}")
+        unknown = set(towers) - set(ENCODER_TOWERS)
+        if unknown:
+            raise ValueError(f"未知的编码塔: {sorted(unknown)}，可选: {ENCODER_TOWERS}")
+        if drift_report and not backend_within_tolerance(drift_report, model_name, backend, max_drift):
+            logger.warning(f"推理后端 {backend} 未通过偏差检查，回退为fp32的PyTorch模型。")
+            backend = 'torch'
         # if device == "cuda" and not torch.cuda.is_available():
         #     if torch.backends.mps.is_available():
         #         logger.warning("CUDA不可用，自动切换到MPS。")
@@ -24,19 +50,132 @@ class EmbeddingGenerator:
         #     else:
         #         logger.warning("CUDA和MPS都不可用，自动切换到CPU。")
         #         device = "cpu"
-        self.device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
-        logger.info(f"正在加载模型 '{model_name}' 到设备 '{self.device}'...")
-        
-        # 加载模型和预处理器
-        self.model, self.preprocess = load_from_name(
-            model_name, 
-            device=self.device, 
-            download_root='./models'
-        )
-        self.model.eval()
-        logger.info("模型加载完成。")
-
-    def encode_image(self, image_path: str) -> torch.Tensor:
+        self._device = "cpu" if backend != 'torch' else device
+        self.backend = backend
+        self.model_name = model_name
+        self.num_workers = num_workers
+        self.context_length = context_length
+        self.onnx_dir = onnx_dir
+        self.artifact_dir = artifact_dir
+        self.towers = tuple(towers)
+        self._pool = None
+        self._encoders = {}
+        self._meta = None
+        self._preprocess = None
+        self._load_lock = threading.Lock()
+        if not lazy:
+            for tower in self.towers:
+                self._encoder(tower)
+
+    @property
+    def device(self) -> str:
+        """推理设备，未指定时在第一次使用时自动选择 cuda > mps > cpu (需要导入torch)。"""
+        if self._device is None:
+            import torch
+            self._device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+        return self._device
+
+    @property
+    def meta(self) -> dict:
+        """模型元数据 (向量维度、图片分辨率)，来自预先序列化的编码塔，无需加载模型。"""
+        if self._meta is None:
+            from . import model_loader
+            self._meta = model_loader.load_meta(self.model_name, self.artifact_dir)
+        return self._meta
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.meta['embedding_dim']
+
+    @property
+    def preprocess(self):
+        """图片预处理变换 (与 load_from_name 返回的一致)。"""
+        if self._preprocess is None:
+            from cn_clip.clip.utils import image_transform
+            self._preprocess = image_transform(self.meta['image_resolution'])
+        return self._preprocess
+
+    def _encoder(self, tower: str):
+        """返回指定编码塔，第一次调用时加载 (线程安全)。"""
+        encoder = self._encoders.get(tower)
+        if encoder is not None:
+            return encoder
+        if tower not in self.towers:
+            raise RuntimeError(f"编码塔 '{tower}' 未启用 (towers={self.towers})")
+        with self._load_lock:
+            if tower not in self._encoders:
+                logger.info(f"正在加载模型 '{self.model_name}' 的{tower}编码塔到设备 '{self.device}' (推理后端: {self.backend})...")
+                self._encoders[tower] = self._load_encoder(tower)
+                logger.info(f"{tower}编码塔加载完成。")
+        return self._encoders[tower]
+
+    def warmup(self, towers: Sequence[str] = None, background: bool = False):
+        """
+        预先导入依赖并加载编码塔，使第一次查询不必等待模型加载。
+
+        Args:
+            towers (Sequence[str], optional): 要加载的编码塔，默认为全部已启用的编码塔。
+            background (bool): 为True时在后台线程中加载并立即返回；加载期间到来的查询会等待加载完成。
+
+        Returns:
+            Optional[threading.Thread]: 后台加载线程，同步加载时返回None。
+        """
+        towers = [tower for tower in (towers or self.towers) if tower in self.towers]
+
+        def load():
+            for tower in towers:
+                try:
+                    self._encoder(tower)
+                except Exception as e:
+                    logger.error(f"预热{tower}编码塔失败: {e}")
+            if 'text' in towers:
+                import cn_clip.clip  # 分词器
+        if not background:
+            load()
+            return None
+        thread = threading.Thread(target=load, name="encoder-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def _load_encoder(self, tower: str):
+        """按推理后端加载一个编码塔。ONNX文件已存在时无需加载PyTorch模型。"""
+        from . import model_loader
+        if self.backend in ('onnx', 'onnx-int8'):
+            quantized = self.backend == 'onnx-int8'
+            path = onnx_path(self.onnx_dir, self.model_name, tower, quantized)
+            if not os.path.exists(path):
+                fp32_path = onnx_path(self.onnx_dir, self.model_name, tower)
+                if not os.path.exists(fp32_path):
+                    module = model_loader.load_tower(self.model_name, tower, self.artifact_dir, 'cpu')
+                    export_onnx(module, fp32_path, tower, self.context_length, self.meta['image_resolution'])
+                if quantized:
+                    quantize_onnx(fp32_path, path)
+            return OnnxTower(path, tower)
+        module = model_loader.load_tower(self.model_name, tower, self.artifact_dir, self.device)
+        if self.backend == 'torch-int8':
+            import torch
+            module = torch.quantization.quantize_dynamic(module.float(), {torch.nn.Linear}, dtype=torch.qint8)
+        return module
+
+    def _forward(self, tower: str, inputs: 'torch.Tensor') -> 'torch.Tensor':
+        """
+        执行图片塔或文本塔的前向计算并归一化。
+
+        Args:
+            tower (str): 'image' 或 'text'。
+            inputs (torch.Tensor): 预处理后的图片张量，或token id张量。
+
+        Returns:
+            torch.Tensor: 归一化后的特征。
+        """
+        import torch
+        encoder = self._encoder(tower)
+        with torch.no_grad():
+            features = encoder(inputs if isinstance(encoder, OnnxTower) else inputs.to(self.device))
+        features /= features.norm(dim=-1, keepdim=True)
+        return features
+
+    def encode_image(self, image_path: str) -> 'torch.Tensor':
         """
         为单个图片文件生成向量。
 
@@ -48,16 +187,13 @@ class EmbeddingGenerator:
         """
         try:
             image = Image.open(image_path).convert("RGB")
-            image_input = self.preprocess(image).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                image_features = self.model.encode_image(image_input) # 224x224x3 -> 512/786 vector (FAISS)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-            return image_features
+            image_input = self.preprocess(image).unsqueeze(0)
+            return self._forward('image', image_input) # 224x224x3 -> 512/786 vector (FAISS)
         except Exception as e:
             logger.error(f"处理图片失败: {image_path}, 错误: {e}")
             return None
 
-    def encode_text(self, text: str) -> torch.Tensor:
+    def encode_text(self, text: str) -> 'torch.Tensor':
         """
         为单个文本生成向量。
 
@@ -68,11 +204,171 @@ class EmbeddingGenerator:
             torch.Tensor: 生成的文本向量。
         """
         try:
-            text_input = clip.tokenize([text]).to(self.device)
-            with torch.no_grad():
-                text_features = self.model.encode_text(text_input)
-            text_features /= text_features.norm(dim=-1, keepdim=True)
-            return text_features
+            import cn_clip.clip as clip
+            text_input = clip.tokenize([text], context_length=self.context_length)
+            return self._forward('text', text_input)
         except Exception as e:
             logger.error(f"处理文本失败: {text}, 错误: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+    # ---- 批量编码 ----
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        """懒加载图片解码线程池，在多次批量调用之间复用。"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="image-decode")
+        return self._pool
+
+    def _load_image(self, image_path):
+        """解码并预处理单张图片，失败时返回None。"""
+        try:
+            with Image.open(image_path) as image:
+                return self.preprocess(image.convert("RGB"))
+        except Exception as e:
+            logger.error(f"处理图片失败: {image_path}, 错误: {e}")
+            return None
+
+    def preprocess_images(self, image_paths: List[str]) -> Tuple['torch.Tensor', np.ndarray]:
+        """
+        在线程池中并行解码并预处理一批图片。
+
+        Args:
+            image_paths (List[str]): 图片文件路径(或文件对象)列表。
+
+        Returns:
+            Tuple[torch.Tensor, np.ndarray]: 成功图片堆叠成的张量 (按输入顺序，跳过失败项)，
+            以及长度为len(image_paths)的布尔数组，True表示该项处理失败。
+        """
+        tensors = list(self._get_pool().map(self._load_image, image_paths))
+        failed = np.array([t is None for t in tensors], dtype=bool)
+        ok = [t for t in tensors if t is not None]
+        if not ok:
+            return None, failed
+        import torch
+        return torch.stack(ok), failed
+
+    def encode_image_tensors(self, image_input: 'torch.Tensor') -> np.ndarray:
+        """
+        对已预处理的图片张量做一次前向计算。
+
+        Args:
+            image_input (torch.Tensor): 形状为 (N, 3, H, W) 的图片张量。
+
+        Returns:
+            np.ndarray: 归一化后的 (N, dim) float32 向量矩阵。
+        """
+        return self._forward('image', image_input).float().cpu().numpy()
+
+    def encode_images(self, image_paths: List[str], batch_size: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量生成图片向量。解码/预处理在线程池中完成，模型按整批前向计算。
+
+        Args:
+            image_paths (List[str]): 图片文件路径列表。
+            batch_size (int): 每次前向计算的图片数量。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 形状为 (N, dim) 的连续float32矩阵，以及长度为N的失败掩码。
+            失败项对应的行全为0，单张图片出错不会中断整批处理。
+        """
+        embeddings = np.zeros((len(image_paths), self.embedding_dim), dtype=np.float32)
+        failed = np.ones(len(image_paths), dtype=bool)
+        for start in range(0, len(image_paths), batch_size):
+            batch_paths = image_paths[start:start + batch_size]
+            image_input, batch_failed = self.preprocess_images(batch_paths)
+            rows = start + np.flatnonzero(~batch_failed)
+            if image_input is None:
+                continue
+            try:
+                embeddings[rows] = self.encode_image_tensors(image_input)
+                failed[rows] = False
+            except Exception as e:
+                logger.error(f"批量处理图片失败 (第 {start} - {start + len(batch_paths)} 项), 错误: {e}")
+        return embeddings, failed
+
+    def _tokenize(self, text: str) -> List[int]:
+        """将文本转换为token id列表 ([CLS] ... [SEP])，超出context_length的部分被截断。"""
+        from cn_clip.clip import _tokenizer as tokenizer
+        ids = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text))[:self.context_length - 2]
+        return [tokenizer.vocab['[CLS]']] + ids + [tokenizer.vocab['[SEP]']]
+
+    def _encode_token_batch(self, token_lists: List[List[int]]) -> np.ndarray:
+        """将长度相近的一批token序列按批内最大长度补齐后编码。"""
+        import torch
+        from cn_clip.clip import _tokenizer
+        pad_index = _tokenizer.vocab['[PAD]']
+        max_len = max(len(tokens) for tokens in token_lists)
+        text_input = torch.full((len(token_lists), max_len), pad_index, dtype=torch.long)
+        for i, tokens in enumerate(token_lists):
+            text_input[i, :len(tokens)] = torch.tensor(tokens, dtype=torch.long)
+        return self._forward('text', text_input).float().cpu().numpy()
+
+    def tokenize_windows(self, text: str, overlap: int = 8) -> List[List[int]]:
+        """
+        将长文本切分为若干个token窗口，每个窗口各自带 [CLS]/[SEP] 且不超过context_length，
+        相邻窗口重叠overlap个token，避免一句话恰好被切断后两边都检索不到。
+
+        Args:
+            text (str): 输入文本。
+            overlap (int): 相邻窗口重叠的token数。
+
+        Returns:
+            List[List[int]]: 各窗口的token id列表，空文本返回空列表。
+        """
+        from cn_clip.clip import _tokenizer as tokenizer
+        ids = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text))
+        if not ids:
+            return []
+        width = self.context_length - 2
+        step = max(1, width - overlap)
+        starts = list(range(0, max(len(ids) - width, 0) + 1, step))
+        if starts[-1] + width < len(ids):
+            starts.append(len(ids) - width)  # 最后一个窗口与文本末尾对齐
+        cls_id, sep_id = tokenizer.vocab['[CLS]'], tokenizer.vocab['[SEP]']
+        return [[cls_id] + ids[start:start + width] + [sep_id] for start in starts]
+
+    def encode_token_lists(self, token_lists: List[List[int]], batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量编码已分词的文本。按token长度排序分桶，每批只补齐到批内最大长度，减少无效计算。
+
+        Args:
+            token_lists (List[List[int]]): 各文本的token id列表 (含[CLS]/[SEP])，None表示该项分词失败。
+            batch_size (int): 每次前向计算的文本数量。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 形状为 (N, dim) 的连续float32矩阵，以及长度为N的失败掩码。
+            失败项对应的行全为0。
+        """
+        embeddings = np.zeros((len(token_lists), self.embedding_dim), dtype=np.float32)
+        failed = np.ones(len(token_lists), dtype=bool)
+        # 按token长度排序分桶，使同一批内的补齐长度尽量一致
+        order = sorted((i for i, tokens in enumerate(token_lists) if tokens), key=lambda i: len(token_lists[i]))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            try:
+                embeddings[rows] = self._encode_token_batch([token_lists[i] for i in rows])
+                failed[rows] = False
+            except Exception as e:
+                logger.error(f"批量处理文本失败 (共 {len(rows)} 条), 错误: {e}")
+        return embeddings, failed
+
+    def encode_texts(self, texts: List[str], batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量生成文本向量，超出context_length的部分被截断 (长文本请使用 tokenize_windows 切分)。
+
+        Args:
+            texts (List[str]): 输入文本列表。
+            batch_size (int): 每次前向计算的文本数量。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 形状为 (N, dim) 的连续float32矩阵，以及长度为N的失败掩码。
+            失败项对应的行全为0。
+        """
+        token_lists = []
+        for text in texts:
+            try:
+                token_lists.append(self._tokenize(text))
+            except Exception as e:
+                logger.error(f"处理文本失败: {text}, 错误: {e}")
+                token_lists.append(None)
+        return self.encode_token_lists(token_lists, batch_size)
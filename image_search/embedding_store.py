@@ -0,0 +1,195 @@
+import os
+import numpy as np
+from loguru import logger
+from typing import Tuple
+
+class EmbeddingStore:
+    """
+    图片原始向量的磁盘存储，与Faiss索引放在一起。
+
+    向量保存为 (N, dim) float32 的 .npy 文件，id保存为升序排列的 int64 .npy 文件。
+    读取时使用内存映射，多个服务进程共享同一份页缓存而无需各自复制向量；
+    按id取向量只需一次 searchsorted 和一次 gather。
+    """
+    def __init__(self, vectors_path: str, ids_path: str = None):
+        """
+        初始化EmbeddingStore。
+
+        Args:
+            vectors_path (str): 向量 .npy 文件路径。
+            ids_path (str, optional): id .npy 文件路径，默认在向量文件名后加 '_ids'。
+        """
+        self.vectors_path = vectors_path
+        self.ids_path = ids_path or os.path.splitext(vectors_path)[0] + '_ids.npy'
+        self.vectors = None
+        self.ids = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.vectors_path) and os.path.exists(self.ids_path)
+
+    def load(self) -> bool:
+        """以只读内存映射方式加载向量，文件不存在时返回False。"""
+        if not self.exists():
+            self.vectors, self.ids = None, np.zeros(0, dtype=np.int64)
+            return False
+        self.vectors = np.load(self.vectors_path, mmap_mode='r')
+        self.ids = np.load(self.ids_path)
+        logger.info(f"向量存储加载完成，包含 {len(self.ids)} 个向量。")
+        return True
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """
+        将id转换为存储中的行号。
+
+        Returns:
+            np.ndarray: 与ids等长的行号数组，不存在的id为-1。
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        rows = np.searchsorted(self.ids, ids)
+        rows[rows >= len(self.ids)] = 0
+        return np.where(self.ids[rows] == ids, rows, -1)
+
+    def get(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按id批量取回向量。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (向量矩阵, 是否找到的布尔掩码)，未找到的行全为0。
+        """
+        rows = self.lookup(ids)
+        found = rows >= 0
+        vectors = np.zeros((len(rows), self.vectors.shape[1] if self.vectors is not None else 0), dtype=np.float32)
+        if found.any():
+            vectors[found] = self.vectors[rows[found]]
+        return vectors, found
+
+    def save(self, ids: np.ndarray, vectors: np.ndarray):
+        """按id排序后原子地写入全部向量，并重新加载内存映射。"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        self._write(ids[order], lambda start, end: vectors[order[start:end]], len(ids), vectors.shape[1])
+
+    def update(self, add_ids: np.ndarray = None, add_vectors: np.ndarray = None, remove_ids: np.ndarray = None):
+        """
+        增量更新：删除remove_ids，并插入或覆盖add_ids对应的向量。
+
+        Args:
+            add_ids (np.ndarray, optional): 要插入或覆盖的id。
+            add_vectors (np.ndarray, optional): 与add_ids对应的向量。
+            remove_ids (np.ndarray, optional): 要删除的id。
+        """
+        add_ids = np.asarray(add_ids if add_ids is not None else [], dtype=np.int64)
+        drop = np.concatenate([add_ids, np.asarray(remove_ids if remove_ids is not None else [], dtype=np.int64)])
+        keep = ~np.isin(self.ids, drop)
+        if not len(add_ids) and keep.all():
+            return
+        dim = add_vectors.shape[1] if len(add_ids) else self.vectors.shape[1]
+        old_vectors = self.vectors if self.vectors is not None else np.zeros((0, dim), dtype=np.float32)
+        old_rows = np.flatnonzero(keep)
+        ids = np.concatenate([self.ids[old_rows], add_ids])
+        order = np.argsort(ids, kind='stable')
+        n_old = len(old_rows)
+
+        def chunk(start, end):
+            positions = order[start:end]
+            out = np.empty((len(positions), dim), dtype=np.float32)
+            is_old = positions < n_old
+            out[is_old] = old_vectors[old_rows[positions[is_old]]]
+            if not is_old.all():
+                out[~is_old] = add_vectors[positions[~is_old] - n_old]
+            return out
+
+        self._write(ids[order], chunk, len(ids), dim)
+
+    def _write(self, ids: np.ndarray, get_chunk, count: int, dim: int, chunk_size: int = 65536):
+        """分块写入临时文件后原子替换，已映射旧文件的读者不受影响。"""
+        os.makedirs(os.path.dirname(self.vectors_path) or '.', exist_ok=True)
+        tmp_vectors = self.vectors_path + '.tmp.npy'
+        if count:
+            out = np.lib.format.open_memmap(tmp_vectors, mode='w+', dtype=np.float32, shape=(count, dim))
+            for start in range(0, count, chunk_size):
+                end = min(start + chunk_size, count)
+                out[start:end] = get_chunk(start, end)
+            out.flush()
+            del out
+        else:
+            np.save(tmp_vectors, np.zeros((0, dim), dtype=np.float32))
+        tmp_ids = self.ids_path + '.tmp.npy'
+        np.save(tmp_ids, ids)
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_ids, self.ids_path)
+        self.load()
+
+    def writer(self, dim: int, resume_count: int = 0) -> 'EmbeddingStoreWriter':
+        """创建一个流式追加写入器，用于全量构建。"""
+        return EmbeddingStoreWriter(self, dim, resume_count)
+
+class EmbeddingStoreWriter:
+    """
+    全量构建时按id升序流式追加向量，先写入原始二进制的临时文件，
+    finalize时再转换为 .npy。支持从断点处截断后继续写入。
+    """
+    def __init__(self, store: EmbeddingStore, dim: int, resume_count: int = 0):
+        self.store = store
+        self.vectors_partial = store.vectors_path + '.partial'
+        self.ids_partial = store.ids_path + '.partial'
+        self.dim = dim
+        os.makedirs(os.path.dirname(store.vectors_path) or '.', exist_ok=True)
+        if resume_count:
+            # 断点中记录的向量必须都还在临时文件里，否则最终的存储会缺少断点之前的向量
+            for path, size in ((self.vectors_partial, resume_count * dim * 4), (self.ids_partial, resume_count * 8)):
+                actual = os.path.getsize(path) if os.path.exists(path) else None
+                if actual is None or actual < size:
+                    state = "不存在" if actual is None else f"只有 {actual} 字节，少于断点所需的 {size} 字节"
+                    raise RuntimeError(f"向量存储的临时文件 {path} {state}，无法从断点 ({resume_count} 个向量) 继续构建，"
+                                       f"请运行 scripts/build_index.py --restart 重新构建。")
+        mode = 'r+b' if resume_count else 'w+b'
+        self._vectors_file = open(self.vectors_partial, mode)
+        self._ids_file = open(self.ids_partial, mode)
+        self.count = resume_count
+        if self.count:
+            # 丢弃断点之后写入的数据
+            self._vectors_file.truncate(self.count * self.dim * 4)
+            self._ids_file.truncate(self.count * 8)
+            self._vectors_file.seek(0, os.SEEK_END)
+            self._ids_file.seek(0, os.SEEK_END)
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        if not len(ids):
+            return
+        self._vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._ids_file.write(np.asarray(ids, dtype=np.int64).tobytes())
+        self.count += len(ids)
+
+    def flush(self):
+        """将已追加的数据落盘，保存断点前调用。"""
+        for f in (self._vectors_file, self._ids_file):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self._vectors_file.close()
+        self._ids_file.close()
+
+    def discard(self):
+        """删除临时文件。"""
+        self.close()
+        for path in (self.vectors_partial, self.ids_partial):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def finalize(self):
+        """将临时文件转换为最终的 .npy 存储并删除临时文件。"""
+        self.close()
+        ids = np.fromfile(self.ids_partial, dtype=np.int64)
+        dim = self.dim
+        raw = np.memmap(self.vectors_partial, dtype=np.float32, mode='r', shape=(len(ids), dim)) if len(ids) else np.zeros((0, dim), dtype=np.float32)
+        order = np.argsort(ids, kind='stable')
+        self.store._write(ids[order], lambda start, end: raw[order[start:end]], len(ids), dim)
+        del raw
+        self.discard()
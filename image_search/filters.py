@@ -0,0 +1,103 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 发布时间统一编码为整数 YYYYMMDD 以便做范围比较；库中多为 'YYYY-MM'，缺少的月/日在下界补00、上界补99
+_DATE_RE = re.compile(r'^\s*(\d{4})(?:\D+(\d{1,2}))?(?:\D+(\d{1,2}))?')
+# 一条广告的参赛类别以逗号分隔 (可能重复)
+_CATEGORY_SEP_RE = re.compile(r'[,，]')
+
+def publish_key(value, upper: bool = False) -> int:
+    """
+    将发布时间转换为可比较的整数 YYYYMMDD，无法解析时返回0。
+
+    Args:
+        value: 'YYYY'、'YYYY-MM'、'YYYY-MM-DD' (分隔符不限) 或日期对象。
+        upper (bool): 作为范围上界时缺少的月/日取最大值，使 '2023' 包含2023年全年。
+    """
+    if value is None:
+        return 0
+    if hasattr(value, 'year'):
+        return value.year * 10000 + getattr(value, 'month', 1) * 100 + getattr(value, 'day', 1)
+    match = _DATE_RE.match(str(value))
+    if match is None:
+        return 0
+    year, month, day = match.groups()
+    fill = 99 if upper else 0
+    return int(year) * 10000 + (int(month) if month else fill) * 100 + (int(day) if day else fill)
+
+def split_categories(value: Optional[str]) -> List[str]:
+    """将广告的参赛类别字符串拆分为去重后的类别列表。"""
+    if not value:
+        return []
+    return list(dict.fromkeys(part.strip() for part in _CATEGORY_SEP_RE.split(str(value)) if part.strip()))
+
+class SearchFilter:
+    """
+    搜索过滤条件，各条件之间为AND，未设置的条件不做限制。
+    编译为广告掩码的过程见 MetadataTables.ad_filter_mask，检索时以Faiss ID选择器的形式作用在索引内部。
+    """
+    def __init__(self, categories: Iterable[str] = None, min_score: float = None, max_score: float = None,
+                 published_from=None, published_to=None):
+        """
+        初始化SearchFilter。
+
+        Args:
+            categories (Iterable[str], optional): 参赛类别，命中任一即可；类别名为库中类别的子串即视为命中，
+                如 '短视频类' 同时匹配 '创意单元-视频组-短视频类' 与 '创意单元-视频组-短视频类（铜）'。
+            min_score (float, optional): 应数评分下限 (含)。
+            max_score (float, optional): 应数评分上限 (含)。
+            published_from (optional): 发布时间下限 (含)，如 '2022' 或 '2022-06'。
+            published_to (optional): 发布时间上限 (含)，'2023' 表示到2023年底。
+        """
+        if isinstance(categories, str):
+            categories = [categories]
+        self.categories = tuple(sorted({c.strip() for c in categories or () if c and c.strip()}))
+        self.min_score = None if min_score is None else float(min_score)
+        self.max_score = None if max_score is None else float(max_score)
+        self.published_from = published_from
+        self.published_to = published_to
+        self.publish_range = (publish_key(published_from) if published_from is not None else None,
+                              publish_key(published_to, upper=True) if published_to is not None else None)
+        for bound, value in zip(self.publish_range, (published_from, published_to)):
+            if bound == 0:
+                raise ValueError(f"无法解析的发布时间: {value}")
+
+    def is_empty(self) -> bool:
+        """是否没有任何过滤条件。"""
+        return not self.categories and self.min_score is None and self.max_score is None and self.publish_range == (None, None)
+
+    def key(self) -> Tuple:
+        """规范化的过滤条件，用作缓存键。"""
+        return (self.categories, self.min_score, self.max_score) + self.publish_range
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional['SearchFilter']:
+        """
+        由请求参数构建过滤条件，没有任何条件时返回None。
+
+        Args:
+            data (Dict[str, Any], optional): 键为 categories (列表或逗号分隔的字符串)、
+                min_score、max_score、published_from、published_to，空值视为未设置。
+
+        Raises:
+            ValueError: 参数无法解析。
+        """
+        if not data:
+            return None
+        if not isinstance(data, dict):
+            raise ValueError("filters必须是JSON对象")
+        unknown = set(data) - {'categories', 'min_score', 'max_score', 'published_from', 'published_to'}
+        if unknown:
+            raise ValueError(f"不支持的过滤条件: {sorted(unknown)}")
+        values = {key: value for key, value in data.items() if value not in (None, '', [])}
+        categories = values.pop('categories', None)
+        if isinstance(categories, str):
+            categories = split_categories(categories)
+        try:
+            search_filter = cls(categories=categories, **values)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"过滤条件无效: {e}") from e
+        return None if search_filter.is_empty() else search_filter
+
+    def __repr__(self):
+        return f"SearchFilter{self.key()}"
@@ -0,0 +1,134 @@
+import os
+import hashlib
+from PIL import ImageFile
+from typing import Any, Dict
+
+from .dedup import dhash_file
+from .thumbnails import ThumbnailStore
+
+class InvalidImage(ValueError):
+    """响应内容不是可解码的图片 (损坏、截断或根本不是图片)。"""
+
+class ImageTooLarge(ValueError):
+    """响应内容超过允许的大小。"""
+
+class StreamedImageWriter:
+    """
+    将下载中的图片分块写入临时文件，同时把每一块喂给PIL的增量解析器。
+
+    写盘、读取尺寸、完整解码校验、计算内容哈希以及生成缩略图都基于同一份流入的数据；
+    感知哈希与补算时一致，由 dedup.dhash_file 对写好的文件以draft模式小尺寸解码计算。提交时临时文件原子地重命名为最终路径，
+    校验失败或超出大小时删除临时文件，最终路径上不会出现不完整的图片。
+
+    Example:
+        with StreamedImageWriter(local_path, max_bytes) as writer:
+            for chunk in response.iter_content(65536):
+                writer.feed(chunk)
+            info = writer.commit(thumbnail_store)
+    """
+    def __init__(self, final_path: str, max_bytes: int = 20 * 1024 * 1024):
+        """
+        初始化StreamedImageWriter。
+
+        Args:
+            final_path (str): 图片的最终保存路径。
+            max_bytes (int): 允许的最大字节数，超出时抛出 ImageTooLarge。
+        """
+        self.final_path = final_path
+        self.max_bytes = max_bytes
+        self.tmp_path = final_path + '.part'
+        self.bytes_written = 0
+        os.makedirs(os.path.dirname(final_path) or '.', exist_ok=True)
+        self._file = open(self.tmp_path, 'wb')
+        self._parser = ImageFile.Parser()
+        self._sha256 = hashlib.sha256()
+        self._parse_error = None
+
+    @property
+    def size(self):
+        """解析到文件头后即可得到的 (宽, 高)，尚未解析到时为None。"""
+        image = self._parser.image
+        return image.size if image is not None else None
+
+    def feed(self, chunk: bytes):
+        """写入一块数据。"""
+        if not chunk:
+            return
+        self.bytes_written += len(chunk)
+        if self.bytes_written > self.max_bytes:
+            raise ImageTooLarge(f"图片超过大小上限 {self.max_bytes} 字节")
+        self._file.write(chunk)
+        self._sha256.update(chunk)
+        if self._parse_error is None:
+            try:
+                self._parser.feed(chunk)
+            except Exception as e:
+                # 记录错误但继续接收数据，提交时统一判定为无效图片
+                self._parse_error = e
+
+    def commit(self, thumbnail_store: ThumbnailStore = None) -> Dict[str, Any]:
+        """
+        完成解码校验，生成缩略图，并将临时文件重命名为最终路径。
+
+        Args:
+            thumbnail_store (ThumbnailStore, optional): 缩略图存储，提供时同时生成缩略图。
+
+        Returns:
+            Dict[str, Any]: {'width', 'height', 'file_size', 'format', 'content_hash', 'phash', 'thumbnails'}。
+
+        Raises:
+            InvalidImage: 内容为空、无法识别或解码失败。
+        """
+        self._file.close()
+        if self._parse_error is not None:
+            raise InvalidImage(f"图片解析失败: {self._parse_error}")
+        if not self.bytes_written:
+            raise InvalidImage("响应内容为空")
+        try:
+            image = self._parser.close()  # 完整解码，截断或损坏的数据在这里报错
+        except Exception as e:
+            raise InvalidImage(f"图片解码失败: {e}")
+        try:
+            phash = dhash_file(self.tmp_path)
+        except Exception as e:
+            raise InvalidImage(f"图片解码失败: {e}")
+        thumbnails = thumbnail_store.save(self.final_path, image) if thumbnail_store is not None else {}
+        os.replace(self.tmp_path, self.final_path)
+        return {
+            'width': image.width,
+            'height': image.height,
+            'file_size': self.bytes_written,
+            'format': image.format,
+            'content_hash': self._sha256.hexdigest(),
+            'phash': phash,
+            'thumbnails': thumbnails,
+        }
+
+    def abort(self):
+        """放弃写入并删除临时文件。"""
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None or os.path.exists(self.tmp_path):
+            self.abort()
+        return False
+
+def check_content_length(headers, max_bytes: int):
+    """根据 Content-Length 提前拒绝过大的响应，避免下载后再丢弃。"""
+    length = headers.get('Content-Length')
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ImageTooLarge(f"Content-Length {length} 超过大小上限 {max_bytes} 字节")
+
+def image_path_for(image_dir: str, ad_id: int, image_id: int, image_url: str) -> str:
+    """图片的本地保存路径：<image_dir>/<ad_id>_<image_id><扩展名>。"""
+    path = image_url.split('?', 1)[0].split('#', 1)[0]
+    file_extension = os.path.splitext(path)[1] or '.jpg'
+    return os.path.join(image_dir, f"{ad_id}_{image_id}{file_extension}")
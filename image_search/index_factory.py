@@ -0,0 +1,402 @@
+import time
+import faiss
+import numpy as np
+from loguru import logger
+from typing import Dict, Any, Tuple
+
+# 各后端的默认参数，可通过 config.INDEX_PARAMS 覆盖
+DEFAULT_INDEX_PARAMS = {
+    'hnsw_m': 32,             # HNSW每个节点的邻居数
+    'ef_construction': 200,   # HNSW构建时的搜索宽度
+    'ef_search': 128,         # HNSW查询时的搜索宽度，越大召回越高、延迟越高
+    'nlist': 1024,            # IVF聚类中心数量
+    'nprobe': 16,             # IVF查询时访问的聚类数量
+    'encoding': 'float32',    # 索引中向量的存储编码，见 VECTOR_ENCODINGS
+    'pq_m': 64,               # PQ子空间数量 (每个向量 pq_m 字节)，需整除向量维度
+    'pca_dim': 0,             # 大于0时先用PCA降到该维度再编码
+    'rerank_factor': 4,       # 压缩索引多取 rerank_factor 倍的候选，再用原始向量精确重排
+}
+
+INDEX_BACKENDS = ('flat', 'hnsw', 'ivf')
+
+# 索引中向量的存储编码 (512维时每个向量的大小)：
+# - float32: 原始向量，2048字节
+# - fp16:    半精度，1024字节，几乎无损
+# - sq8:     每维8bit标量量化，512字节
+# - pq:      乘积量化，pq_m字节
+# 非float32编码或启用PCA时为有损压缩，检索结果会用磁盘上的原始向量 (EmbeddingStore) 重排。
+VECTOR_ENCODINGS = ('float32', 'fp16', 'sq8', 'pq')
+
+def _merge_params(params: Dict[str, Any] = None) -> Dict[str, Any]:
+    merged = dict(DEFAULT_INDEX_PARAMS)
+    merged.update(params or {})
+    return merged
+
+def is_compressed(params: Dict[str, Any] = None) -> bool:
+    """索引是否为有损压缩 (需要用原始向量重排)。"""
+    params = _merge_params(params)
+    return params['encoding'] != 'float32' or params['pca_dim'] > 0
+
+def _sq_type(encoding: str):
+    return faiss.ScalarQuantizer.QT_fp16 if encoding == 'fp16' else faiss.ScalarQuantizer.QT_8bit
+
+def _pq_nbits(num_vectors: int = None) -> int:
+    # 每个PQ码本有 2^nbits 个中心，数据较少时减小nbits，保证每个中心至少有39个训练样本
+    if not num_vectors:
+        return 8
+    return int(max(1, min(8, np.floor(np.log2(max(2, num_vectors // 39))))))
+
+def create_index(dim: int, backend: str = 'flat', params: Dict[str, Any] = None, num_vectors: int = None):
+    """
+    创建一个使用内积打分、支持显式id的空索引。向量已归一化，内积即余弦相似度，分数越大越相似。
+
+    Args:
+        dim (int): 向量维度。
+        backend (str): 'flat' (暴力扫描)、'hnsw' 或 'ivf'。
+        params (Dict[str, Any], optional): 后端参数，见 DEFAULT_INDEX_PARAMS。
+        num_vectors (int, optional): 预计的向量数量，用于在数据较少时自动缩小IVF的nlist和PQ码本大小。
+
+    Returns:
+        faiss.Index: 空索引。IVF索引、sq8/pq编码及PCA需要先调用 train_index 训练。
+    """
+    params = _merge_params(params)
+    encoding, pca_dim = params['encoding'], params['pca_dim']
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"不支持的向量编码: {encoding}，可选: {VECTOR_ENCODINGS}")
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"不支持的索引后端: {backend}，可选: {INDEX_BACKENDS}")
+    if pca_dim > dim:
+        raise ValueError(f"pca_dim ({pca_dim}) 不能大于向量维度 ({dim})")
+    if pca_dim > 0 and num_vectors is not None and num_vectors < pca_dim:
+        # PCA至少需要与输出维度相当的样本数
+        logger.warning(f"向量数 ({num_vectors}) 少于pca_dim ({pca_dim})，本次不做PCA降维。")
+        pca_dim = 0
+    code_dim = pca_dim if pca_dim > 0 else dim
+    if encoding == 'pq' and code_dim % params['pq_m']:
+        raise ValueError(f"pq_m ({params['pq_m']}) 必须整除向量维度 ({code_dim})")
+    metric = faiss.METRIC_INNER_PRODUCT
+    nbits = _pq_nbits(num_vectors)
+
+    if backend == 'flat':
+        if encoding == 'float32':
+            index = faiss.IndexFlatIP(code_dim)
+        elif encoding == 'pq':
+            index = faiss.IndexPQ(code_dim, params['pq_m'], nbits, metric)
+        else:
+            index = faiss.IndexScalarQuantizer(code_dim, _sq_type(encoding), metric)
+    elif backend == 'hnsw':
+        if encoding == 'float32':
+            index = faiss.IndexHNSWFlat(code_dim, params['hnsw_m'], metric)
+        elif encoding == 'pq':
+            index = faiss.IndexHNSWPQ(code_dim, params['pq_m'], params['hnsw_m'], nbits, metric)
+        else:
+            index = faiss.IndexHNSWSQ(code_dim, _sq_type(encoding), params['hnsw_m'], metric)
+        index.hnsw.efConstruction = params['ef_construction']
+        index.hnsw.efSearch = params['ef_search']
+    else:
+        nlist = params['nlist']
+        if num_vectors:
+            # 经验值：nlist约为4*sqrt(N)，且每个聚类至少有39个训练样本
+            nlist = max(1, min(nlist, int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+        quantizer = faiss.IndexFlatIP(code_dim)
+        if encoding == 'float32':
+            index = faiss.IndexIVFFlat(quantizer, code_dim, nlist, metric)
+        elif encoding == 'pq':
+            index = faiss.IndexIVFPQ(quantizer, code_dim, nlist, params['pq_m'], nbits, metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, code_dim, nlist, _sq_type(encoding), metric)
+        index.nprobe = params['nprobe']
+        # IVF原生支持add_with_ids/remove_ids，哈希直接映射用于按id取回向量
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    if pca_dim > 0:
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dim, pca_dim), index)
+    # IVF使用原生id，其余后端用IDMap2提供显式id
+    return index if backend == 'ivf' else faiss.IndexIDMap2(index)
+
+def _unwrap(index):
+    """去掉IDMap与PCA预变换，返回实际存储向量的索引。"""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def _pretransform_of(index):
+    """返回带PCA预变换的那一层索引，没有时返回None。"""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index if isinstance(index, faiss.IndexPreTransform) else None
+
+def training_size(index) -> int:
+    """返回训练该索引建议使用的样本数，无需训练时返回0。"""
+    if index.is_trained:
+        return 0
+    inner = _unwrap(index)
+    size = 0
+    if isinstance(inner, faiss.IndexIVF):
+        size = inner.nlist * 39
+    pq = getattr(inner, 'pq', None)
+    if pq is not None:
+        size = max(size, pq.ksub * 39)
+    if _pretransform_of(index) is not None:
+        size = max(size, index.d * 4)
+    # 仅sq8标量量化需要训练时，只需统计各维的取值范围
+    return size or 1000
+
+def train_index(index, vectors: np.ndarray):
+    """在给定向量上训练索引 (IVF、sq8/pq编码及PCA需要)。"""
+    if index.is_trained:
+        return
+    logger.info(f"正在使用 {len(vectors)} 个向量训练索引...")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    pretransform = _pretransform_of(index)
+    if pretransform is None:
+        index.train(vectors)
+        return
+    # PCAMatrix会减去均值，使降维后的内积多出与均值相关的偏置项；
+    # 训练后去掉偏置只保留投影 (降维后的内积近似原内积)，再用投影后的向量训练内层索引
+    pca = faiss.downcast_VectorTransform(pretransform.chain.at(0))
+    pca.train(vectors)
+    faiss.copy_array_to_vector(np.zeros(pca.d_out, dtype=np.float32), pca.b)
+    inner = faiss.downcast_index(pretransform.index)
+    inner.train(pca.apply(vectors))
+    pretransform.is_trained = inner.is_trained
+    index.is_trained = inner.is_trained
+
+def apply_search_params(index, params: Dict[str, Any] = None):
+    """将efSearch/nprobe等查询参数应用到索引 (包括从文件加载的索引)。"""
+    params = _merge_params(params)
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = params['ef_search']
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = params['nprobe']
+
+def list_ids(index) -> np.ndarray:
+    """返回索引中全部向量的id (不取出向量本身)。"""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexIVF):
+        from faiss.contrib.inspect_tools import get_invlist
+        ids = np.concatenate([get_invlist(inner.invlists, l)[0] for l in range(inner.nlist)] or [np.zeros(0, dtype=np.int64)])
+        return ids.astype(np.int64)
+    # 旧版无显式id的索引，id即位置
+    return np.arange(index.ntotal, dtype=np.int64)
+
+def read_index(path: str, mmap: bool = False) -> Tuple[Any, bool]:
+    """
+    从文件读取索引。
+
+    Args:
+        path (str): 索引文件路径。
+        mmap (bool): 为True时以内存映射方式打开，向量数据在检索访问时才按页读入，
+            加载耗时与索引大小基本无关，且同一台机器上的多个进程共享页缓存。
+            当前faiss版本不支持时回退为完整读取。
+
+    Returns:
+        Tuple[faiss.Index, bool]: (索引, 是否为内存映射)。内存映射的索引是只读的，修改前需完整重新读取。
+    """
+    if mmap:
+        for flag_name in ('IO_FLAG_MMAP_IFC', 'IO_FLAG_MMAP'):
+            flag = getattr(faiss, flag_name, None)
+            if flag is None:
+                continue
+            try:
+                return faiss.read_index(path, flag | getattr(faiss, 'IO_FLAG_READ_ONLY', 0)), True
+            except RuntimeError as e:
+                logger.debug(f"以 {flag_name} 打开索引 {path} 失败: {e}")
+        logger.warning(f"当前faiss不支持以内存映射方式打开索引 {path}，改为完整读取。")
+    return faiss.read_index(path), False
+
+def extract_vectors(index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    取出索引中存储的全部向量及其id。压缩索引返回的是解码后的近似向量，应优先使用 EmbeddingStore 中的原始向量。
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (ids, vectors)。
+    """
+    ids = list_ids(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return ids, faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    if isinstance(_unwrap(index), faiss.IndexIVF):
+        return ids, index.reconstruct_batch(ids)
+    return ids, index.reconstruct_n(0, index.ntotal)
+
+def build_index(ids: np.ndarray, vectors: np.ndarray, dim: int, backend: str = 'flat', params: Dict[str, Any] = None):
+    """用给定向量训练并构建一个完整的索引。"""
+    index = create_index(dim, backend, params, num_vectors=len(vectors))
+    if len(vectors):
+        train_index(index, vectors)
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    return index
+
+def remove_ids(index, ids: np.ndarray, dim: int, params: Dict[str, Any] = None, source: Tuple[np.ndarray, np.ndarray] = None):
+    """
+    从索引中删除指定id。HNSW不支持删除，此时用剩余向量重建索引。
+
+    Args:
+        source (Tuple[np.ndarray, np.ndarray], optional): 重建HNSW时使用的 (ids, 原始向量)，
+            默认从索引中取出 (压缩索引为有损的解码向量)。
+
+    Returns:
+        Tuple[faiss.Index, int]: (删除后的索引，可能是新对象, 删除的向量数)。
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if not isinstance(_unwrap(index), faiss.IndexHNSW):
+        return index, index.remove_ids(ids)
+
+    index_ids = list_ids(index)
+    remaining = index_ids[~np.isin(index_ids, ids)]
+    if source is not None and np.isin(remaining, source[0]).all():
+        all_ids, vectors = np.asarray(source[0], dtype=np.int64), source[1]
+        removed = len(index_ids) - len(remaining)
+        if not removed:
+            return index, 0
+        keep = np.isin(all_ids, remaining)
+        logger.info(f"HNSW索引不支持删除，正在用剩余 {int(keep.sum())} 个原始向量重建...")
+        return build_index(all_ids[keep], np.asarray(vectors)[keep], dim, 'hnsw', params), removed
+
+    all_ids, vectors = extract_vectors(index)
+    keep = ~np.isin(all_ids, ids)
+    removed = int((~keep).sum())
+    if not removed:
+        return index, 0
+    logger.info(f"HNSW索引不支持删除，正在用剩余 {int(keep.sum())} 个向量重建...")
+    return build_index(all_ids[keep], vectors[keep], dim, 'hnsw', params), removed
+
+class FilteredSearchParams:
+    """
+    带ID选择器的Faiss检索参数。Faiss只保存选择器和位图的指针，
+    这里持有全部相关对象的引用，保证它们在检索期间不被回收。
+    """
+    def __init__(self, params, refs):
+        self.params = params
+        self._refs = refs
+
+def supports_selector(index) -> bool:
+    """索引能否在检索时应用ID选择器 (PQ编码的flat索引不支持)。"""
+    return not isinstance(_unwrap(index), faiss.IndexPQ)
+
+def position_groups(index, id_groups=None):
+    """
+    IDMap索引内部每个位置所属的分组，供 filtered_search_params 使用，索引变化后需重新计算。
+
+    Args:
+        index: Faiss索引。
+        id_groups (optional): 将向量id映射为分组号的函数 (如段落id -> 广告id)，默认分组即向量id。
+
+    Returns:
+        faiss.Int64Vector: 按位置排列的分组号；IVF等使用原生id的索引返回None (选择器直接作用于向量id)。
+    """
+    if not isinstance(index, faiss.IndexIDMap):
+        return None
+    if id_groups is None:
+        return index.id_map
+    groups = faiss.Int64Vector()
+    faiss.copy_array_to_vector(np.ascontiguousarray(id_groups(list_ids(index)), dtype=np.int64), groups)
+    return groups
+
+def _selector_params(index, selector):
+    """为实际存储向量的索引创建带选择器的参数，沿用索引当前的efSearch/nprobe。"""
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+def filtered_search_params(index, mask: np.ndarray, groups=None) -> FilteredSearchParams:
+    """
+    创建只检索指定向量的参数，过滤在索引内部进行 (HNSW遍历图时跳过、IVF扫描倒排表时跳过)，
+    不需要先多取结果再过滤。
+
+    Args:
+        index: Faiss索引，须满足 supports_selector。
+        mask (np.ndarray): 按分组号下标的布尔数组，True表示保留。
+        groups: position_groups 的返回值；为None时mask按向量id下标。
+
+    Returns:
+        FilteredSearchParams: 其params传给 index.search 的params参数。
+    """
+    bitmap = np.packbits(np.asarray(mask, dtype=bool), bitorder='little')
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    refs = [bitmap, selector]
+    if groups is not None:
+        # IDMap检索时选择器收到的是内部位置；预先按位置换算为分组后，IDMap不会再做id转换
+        selector = faiss.IDSelectorTranslated(groups, selector)
+        refs += [groups, selector]
+    pretransform = _pretransform_of(index)
+    params = _selector_params(_unwrap(index), selector)
+    if pretransform is not None:
+        # PCA预变换层只把index_params传给内层索引，两层都需要设置选择器
+        refs.append(params)
+        params = faiss.SearchParametersPreTransform(sel=selector, index_params=params)
+    return FilteredSearchParams(params, refs)
+
+def search_and_rerank(index, queries: np.ndarray, k: int, get_vectors, rerank_factor: int = 4,
+                      params: FilteredSearchParams = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    先在 (压缩) 索引中检索 k * rerank_factor 个候选，再用原始向量精确计算内积重排，返回前k个。
+
+    Args:
+        index: Faiss索引。
+        queries (np.ndarray): (N, dim) 查询向量。
+        k (int): 返回的结果数。
+        get_vectors: 按id取原始向量的函数，返回 (向量矩阵, 是否找到的布尔掩码)，如 EmbeddingStore.get。
+        rerank_factor (int): 候选数量相对k的倍数。
+        params (FilteredSearchParams, optional): 只在部分向量中检索，见 filtered_search_params。
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: 与 index.search 相同格式的 (分数, id)，不足k个时以 -inf/-1 填充。
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    _, candidates = index.search(queries, k * max(1, rerank_factor), params=params.params if params is not None else None)
+    vectors, found = get_vectors(candidates.ravel())
+    vectors = vectors.reshape(candidates.shape[0], candidates.shape[1], -1)
+    scores = np.einsum('qcd,qd->qc', vectors, queries)
+    # 原始向量缺失的候选 (不应出现) 排在最后
+    scores = np.where(found.reshape(candidates.shape) & (candidates >= 0), scores, -np.inf).astype(np.float32)
+    order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    top_ids = np.where(np.isfinite(top_scores), np.take_along_axis(candidates, order, axis=1), -1)
+    return top_scores, top_ids
+
+def bytes_per_vector(index) -> float:
+    """索引序列化后平均每个向量占用的字节数 (含图结构、id映射等开销)，近似其常驻内存。"""
+    if not index.ntotal:
+        return 0.0
+    return len(faiss.serialize_index(index)) / index.ntotal
+
+def benchmark_index(index, reference_index, queries: np.ndarray, k: int = 10, search_fn=None) -> Dict[str, float]:
+    """
+    对比参考索引 (通常是IndexFlat精确检索) 评估索引的召回率与单条查询延迟。
+
+    Args:
+        index: 待评估的索引。
+        reference_index: 提供真实近邻的参考索引。
+        queries (np.ndarray): 查询向量矩阵。
+        k (int): 评估recall@k的k值。
+        search_fn (optional): 自定义检索函数 search_fn(queries, k) -> (分数, id)，如带重排的检索，默认为 index.search。
+
+    Returns:
+        Dict[str, float]: recall@k、p50/p99延迟(毫秒)以及单线程QPS。
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    search_fn = search_fn or index.search
+    _, truth = reference_index.search(queries, k)
+    _, found = search_fn(queries, k)
+    hits = [len(set(t[t >= 0]) & set(f[f >= 0])) / max(1, int((t >= 0).sum())) for t, f in zip(truth, found)]
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search_fn(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.array(latencies)
+    return {
+        f'recall@{k}': float(np.mean(hits)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'qps': float(1000 / latencies.mean()) if latencies.mean() > 0 else float('inf'),
+    }
@@ -0,0 +1,103 @@
+import os
+import json
+from loguru import logger
+from typing import Optional
+
+# 可选的推理后端：
+# - torch:      原始PyTorch模型 (CPU上为fp32，有GPU时使用GPU)
+# - torch-int8: PyTorch动态量化，Linear层权重为int8，仅CPU
+# - onnx:       导出为ONNX后由onnxruntime执行 (fp32)，仅CPU
+# - onnx-int8:  ONNX模型再做动态int8量化，仅CPU
+INFERENCE_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+# CN-CLIP的两个编码塔，可分别加载
+ENCODER_TOWERS = ('image', 'text')
+
+def onnx_path(onnx_dir: str, model_name: str, tower: str, quantized: bool = False) -> str:
+    """返回某个模型图片塔/文本塔的ONNX文件路径。"""
+    suffix = '.int8.onnx' if quantized else '.onnx'
+    return os.path.join(onnx_dir, f"{model_name}.{tower}{suffix}")
+
+def export_onnx(module: 'torch.nn.Module', path: str, tower: str, context_length: int = 52, image_size: int = 224, opset: int = 14) -> str:
+    """
+    将一个编码塔 (见 model_loader) 导出为ONNX，batch维与文本长度维为动态维度。
+
+    Args:
+        module (torch.nn.Module): CPU上的fp32编码塔。
+        path (str): 输出路径。
+        tower (str): 'image' 或 'text'，同时作为ONNX输入名。
+        context_length (int): 文本最大token长度，用于构造导出样例。
+        image_size (int): 图片输入边长。
+        opset (int): ONNX opset版本。
+    """
+    import torch
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if tower == 'image':
+        dummy, dynamic_axes = torch.randn(1, 3, image_size, image_size), {'image': {0: 'batch'}}
+    else:
+        dummy, dynamic_axes = torch.ones(1, context_length, dtype=torch.long), {'text': {0: 'batch', 1: 'length'}}
+    dynamic_axes['features'] = {0: 'batch'}
+    logger.info(f"正在导出{tower}编码塔: {path}")
+    with torch.no_grad():
+        torch.onnx.export(module.float().cpu().eval(), (dummy,), path, input_names=[tower], output_names=['features'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    return path
+
+def quantize_onnx(src: str, dst: str) -> str:
+    """对已导出的fp32 ONNX模型做动态int8量化 (权重int8，激活在运行时量化)。"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    logger.info(f"正在量化: {src} -> {dst}")
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    return dst
+
+class OnnxTower:
+    """用onnxruntime在CPU上执行一个导出的编码塔。"""
+    def __init__(self, path: str, tower: str, num_threads: int = 0):
+        """
+        初始化OnnxTower。
+
+        Args:
+            path (str): ONNX模型路径。
+            tower (str): 'image' 或 'text' (即ONNX输入名)。
+            num_threads (int): 单个算子内部的线程数，0表示由onnxruntime决定。
+        """
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.tower = tower
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, inputs: 'torch.Tensor') -> 'torch.Tensor':
+        """执行一次前向计算，返回未归一化的特征。"""
+        import torch
+        return torch.from_numpy(self.session.run(None, {self.tower: inputs.cpu().numpy()})[0])
+
+def load_drift_report(report_path: str) -> Optional[dict]:
+    """读取 scripts/benchmark_inference.py 生成的偏差报告，不存在时返回None。"""
+    if not report_path or not os.path.exists(report_path):
+        return None
+    with open(report_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def backend_within_tolerance(report_path: str, model_name: str, backend: str, max_drift: float) -> bool:
+    """
+    判断某个后端生成的向量与fp32向量的偏差是否在容许范围内，即能否继续使用fp32向量构建的现有索引。
+    没有该模型和后端的测量结果时视为不满足。
+    """
+    if backend == 'torch':
+        return True
+    report = load_drift_report(report_path)
+    if not report or report.get('model_name') != model_name:
+        logger.warning(f"未找到模型 {model_name} 的推理偏差报告 ({report_path})，请先运行 scripts/benchmark_inference.py。")
+        return False
+    result = report.get('backends', {}).get(backend)
+    if result is None:
+        logger.warning(f"偏差报告中没有后端 {backend} 的测量结果，请先运行 scripts/benchmark_inference.py。")
+        return False
+    drift = max(result['image_p99_drift'], result['text_p99_drift'])
+    if drift > max_drift:
+        logger.warning(f"后端 {backend} 与fp32向量的偏差 {drift:.4f} 超过容许值 {max_drift}。")
+        return False
+    return True
@@ -0,0 +1,132 @@
+import re
+import sqlite3
+import numpy as np
+from itertools import islice
+from loguru import logger
+from typing import Dict, List, Sequence, Tuple
+
+# 全文索引表与参与索引的广告字段 (顺序即FTS5的列顺序)
+FTS_TABLE = 'ad_fts'
+FTS_COLUMNS = ('title', 'creative', 'insight', 'background')
+# bm25() 的列权重：标题命中比正文命中更重要
+FTS_COLUMN_WEIGHTS = (4.0, 1.0, 1.0, 1.0)
+
+# FTS5自带的unicode61分词器把连续的汉字视为一个词，trigram分词器又匹配不了两个字的品牌名；
+# 这里在写入和查询前把汉字切成重叠的二元组 (单个汉字保留为一元)，再交给unicode61按空格分词
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_RE = re.compile(f'[{_CJK}]')
+_RUN_RE = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+')
+
+def _is_cjk(run: str) -> bool:
+    return _CJK_RE.match(run) is not None
+
+def _run_tokens(run: str) -> List[str]:
+    if not _is_cjk(run):
+        return [run.lower()]
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+def segment(text: str) -> str:
+    """将文本切分为以空格分隔的词：汉字为重叠二元组，其他文字按单词切分并转为小写。"""
+    if not text:
+        return ''
+    return ' '.join(token for run in _RUN_RE.findall(text) for token in _run_tokens(run))
+
+def match_query(text: str) -> str:
+    """
+    将用户查询转换为FTS5的MATCH表达式，查询为空 (没有可检索的字词) 时返回空字符串。
+
+    每段连续的汉字既作为整体短语 (完整出现时得分更高)，其二元组也分别作为查询词，
+    各项之间为OR，由BM25按命中的多少与稀有程度排序；单个汉字用前缀查询匹配以它开头的二元组。
+    """
+    terms = []
+    for run in _RUN_RE.findall(text or ''):
+        tokens = _run_tokens(run)
+        if _is_cjk(run) and len(run) == 1:
+            terms.append(f'"{run}"*')
+            continue
+        if len(tokens) > 1:
+            terms.append('"' + ' '.join(tokens) + '"')
+        terms.extend(f'"{token}"' for token in tokens)
+    return ' OR '.join(dict.fromkeys(terms))
+
+def fts_available(conn: sqlite3.Connection) -> bool:
+    """当前SQLite是否编译了FTS5。"""
+    return any(row[0] == 'ENABLE_FTS5' for row in conn.execute("PRAGMA compile_options"))
+
+def has_index(conn: sqlite3.Connection) -> bool:
+    """数据库中是否存在全文索引表。"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).fetchone() is not None
+
+def create_index(cursor: sqlite3.Cursor):
+    """创建全文索引表并为已有的全部广告建立索引，SQLite未编译FTS5时跳过。"""
+    if not fts_available(cursor.connection):
+        logger.warning("当前SQLite未编译FTS5，跳过全文索引，混合检索将只使用向量检索。")
+        return
+    cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({', '.join(FTS_COLUMNS)}, tokenize = 'unicode61')")
+    cursor.execute(f"SELECT id, {', '.join(FTS_COLUMNS)} FROM advertisements")
+    index_ads(cursor.connection, cursor.fetchall())
+
+def index_ads(conn: sqlite3.Connection, rows: Sequence[Tuple]):
+    """
+    写入 (或覆盖) 若干广告的全文索引，调用方负责事务。
+
+    Args:
+        conn (sqlite3.Connection): 数据库连接。
+        rows (Sequence[Tuple]): (ad_id, title, creative, insight, background)。
+    """
+    if not rows:
+        return
+    conn.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", [(row[0],) for row in rows])
+    conn.executemany(
+        f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) VALUES (?{', ?' * len(FTS_COLUMNS)})",
+        [(row[0], *(segment(value) for value in row[1:])) for row in rows]
+    )
+
+def search(conn: sqlite3.Connection, text: str, limit: int, ad_mask: np.ndarray = None) -> Tuple[List[int], Dict[int, float]]:
+    """
+    BM25关键词检索。
+
+    Args:
+        conn (sqlite3.Connection): 数据库连接。
+        text (str): 查询文本。
+        limit (int): 最多返回的广告数。
+        ad_mask (np.ndarray, optional): 按ad_id下标的布尔掩码，只返回其中为True的广告
+            (按相关度顺序逐行读取直到凑满limit个，而不是先取limit个再过滤)。
+
+    Returns:
+        Tuple[List[int], Dict[int, float]]: 按相关度降序的广告id，以及 {ad_id: bm25分数} (越大越相关)。
+    """
+    query = match_query(text)
+    if not query:
+        return [], {}
+    weights = ', '.join(str(weight) for weight in FTS_COLUMN_WEIGHTS)
+    # 按内置的rank列排序时FTS5只需维护前limit个结果；bm25越小越相关，取负后与向量分数方向一致
+    sql = f"SELECT rowid, -rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? AND rank MATCH 'bm25({weights})' ORDER BY rank"
+    if ad_mask is None:
+        rows = conn.execute(sql + " LIMIT ?", (query, limit)).fetchall()
+    else:
+        cursor = conn.execute(sql, (query,))
+        rows = list(islice((row for row in cursor if row[0] < len(ad_mask) and ad_mask[row[0]]), limit))
+        cursor.close()
+    return [row[0] for row in rows], {row[0]: row[1] for row in rows}
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], top_k: int, k: int = 60) -> Tuple[List[int], Dict[int, float]]:
+    """
+    倒数排名融合 (RRF)：每个结果的分数为各路排名的 1 / (k + rank) 之和，rank从1开始。
+
+    Args:
+        rankings: 每一路检索按相关度降序的id列表。
+        top_k (int): 返回的结果数。
+        k (int): 平滑常数，越大各路排名靠后的结果影响越大。
+
+    Returns:
+        Tuple[List[int], Dict[int, float]]: 按融合分数降序的id (分数相同时按在rankings中首次出现的先后)，以及 {id: 融合分数}。
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores, key=lambda item: -scores[item])[:top_k]
+    return fused, scores
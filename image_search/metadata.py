@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+import numpy as np
+from loguru import logger
+from typing import Dict, Tuple
+
+from . import database
+from .filters import SearchFilter, publish_key, split_categories
+
+class MetadataTables:
+    """
+    某一时刻的元数据快照。重新加载时整体替换，查询期间不会看到新旧混合的数组。
+
+    - embedding_id -> ad_id 的CSR布局 (去重后一个图片向量可能被多个广告共用)；
+    - ad_id -> 图片行 的CSR布局 (ad_indptr + 各行的embedding_id/路径下标)；
+    - 去重后的路径表与广告标题/正文表；
+    - 过滤用的评分、发布时间 (YYYYMMDD整数) 数组，以及每个参赛类别一个按ad_id下标的位图。
+    """
+    def __init__(self, version: int = 0):
+        self.version = version
+        self.emb_indptr = np.zeros(1, dtype=np.int64)
+        self.emb_ad_ids = np.zeros(0, dtype=np.int64)
+        self.emb_owner_ids = np.zeros(0, dtype=np.int64)
+        self.ad_indptr = np.zeros(1, dtype=np.int64)
+        self.image_embedding_ids = np.zeros(0, dtype=np.int64)
+        self.image_path_idx = np.zeros(0, dtype=np.int32)
+        self.paths = np.zeros(0, dtype=object)
+        self.ad_exists = np.zeros(0, dtype=bool)
+        self.ad_titles = np.zeros(0, dtype=object)
+        self.ad_texts = np.zeros(0, dtype=object)
+        self.ad_scores = np.zeros(0, dtype=np.float32)
+        self.ad_publish = np.zeros(0, dtype=np.int32)
+        # 类别名 -> 以little-endian位序打包的广告位图 (np.packbits)
+        self.category_bitmaps: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_rows(cls, ads, images, version: int) -> 'MetadataTables':
+        """
+        由数据库查询结果构建快照。
+
+        Args:
+            ads: (id, title, creative, score, publish_time, category) 行。
+            images: 按 (ad_id, id) 排序的 (ad_id, local_path, embedding_id) 行，每个 (ad_id, embedding_id) 只出现一次。
+            version (int): 快照版本号。
+        """
+        tables = cls(version)
+        # 广告表：以ad_id为下标
+        max_ad_id = max([row[0] for row in ads] + [row[0] for row in images] + [0])
+        tables.ad_exists = np.zeros(max_ad_id + 1, dtype=bool)
+        tables.ad_titles = np.empty(max_ad_id + 1, dtype=object)
+        tables.ad_texts = np.empty(max_ad_id + 1, dtype=object)
+        tables.ad_scores = np.full(max_ad_id + 1, np.nan, dtype=np.float32)
+        tables.ad_publish = np.zeros(max_ad_id + 1, dtype=np.int32)
+        category_ads: Dict[str, list] = {}
+        for ad_id, title, creative, score, publish_time, category in ads:
+            tables.ad_exists[ad_id] = True
+            tables.ad_titles[ad_id] = title
+            tables.ad_texts[ad_id] = creative
+            if score is not None:
+                tables.ad_scores[ad_id] = score
+            tables.ad_publish[ad_id] = publish_key(publish_time)
+            for name in split_categories(category):
+                category_ads.setdefault(name, []).append(ad_id)
+        for name, ad_ids in category_ads.items():
+            members = np.zeros(max_ad_id + 1, dtype=bool)
+            members[ad_ids] = True
+            tables.category_bitmaps[name] = np.packbits(members, bitorder='little')
+
+        # 图片表：按ad_id排序后构成CSR布局，路径去重后以下标引用
+        image_ad_ids = np.array([row[0] for row in images], dtype=np.int64)
+        tables.image_embedding_ids = np.array([row[2] for row in images], dtype=np.int64)
+        if images:
+            paths, path_idx = np.unique(np.array([str(row[1]) for row in images]), return_inverse=True)
+            tables.paths, tables.image_path_idx = paths.astype(object), path_idx.ravel().astype(np.int32)
+        tables.ad_indptr = np.zeros(max_ad_id + 2, dtype=np.int64)
+        np.add.at(tables.ad_indptr, image_ad_ids + 1, 1)
+        np.cumsum(tables.ad_indptr, out=tables.ad_indptr)
+
+        # 向量 -> 广告：按embedding_id排序后构成CSR布局
+        size = int(tables.image_embedding_ids.max()) + 1 if images else 0
+        order = np.lexsort((image_ad_ids, tables.image_embedding_ids))
+        tables.emb_ad_ids = image_ad_ids[order]
+        tables.emb_owner_ids = tables.image_embedding_ids[order]
+        tables.emb_indptr = np.zeros(size + 1, dtype=np.int64)
+        np.add.at(tables.emb_indptr, tables.image_embedding_ids + 1, 1)
+        np.cumsum(tables.emb_indptr, out=tables.emb_indptr)
+        return tables
+
+    def ads_for_embeddings(self, embedding_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        将图片向量id展开为使用该图片的全部广告。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (每个广告对应的输入下标, 广告id)，按输入顺序展开，
+            不存在的向量id被跳过。
+        """
+        embedding_ids = np.asarray(embedding_ids, dtype=np.int64)
+        valid = (embedding_ids >= 0) & (embedding_ids + 1 < len(self.emb_indptr))
+        starts = np.zeros(len(embedding_ids), dtype=np.int64)
+        ends = np.zeros(len(embedding_ids), dtype=np.int64)
+        starts[valid] = self.emb_indptr[embedding_ids[valid]]
+        ends[valid] = self.emb_indptr[embedding_ids[valid] + 1]
+        counts = ends - starts
+        offsets = np.cumsum(counts) - counts
+        rows = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        return np.repeat(np.arange(len(embedding_ids)), counts), self.emb_ad_ids[rows]
+
+    def has_ads(self, ad_ids: np.ndarray) -> np.ndarray:
+        """返回每个广告id是否存在的布尔数组。"""
+        ad_ids = np.asarray(ad_ids, dtype=np.int64)
+        valid = (ad_ids >= 0) & (ad_ids < len(self.ad_exists))
+        exists = np.zeros(len(ad_ids), dtype=bool)
+        exists[valid] = self.ad_exists[ad_ids[valid]]
+        return exists
+
+    def ad_filter_mask(self, search_filter: SearchFilter) -> np.ndarray:
+        """
+        将过滤条件编译为按ad_id下标的布尔掩码 (只包含存在的广告)。
+        类别条件为相应类别位图的按位或，评分与发布时间为对整列的一次向量化比较。
+        """
+        mask = self.ad_exists.copy()
+        if search_filter.categories:
+            bitmaps = [bitmap for name, bitmap in self.category_bitmaps.items()
+                       if any(wanted in name for wanted in search_filter.categories)]
+            if not bitmaps:
+                return np.zeros_like(mask)
+            mask &= np.unpackbits(np.bitwise_or.reduce(bitmaps), count=len(mask), bitorder='little').astype(bool)
+        # 评分为NaN、发布时间为0 (缺失) 的广告不满足任何范围条件
+        if search_filter.min_score is not None:
+            mask &= self.ad_scores >= search_filter.min_score
+        if search_filter.max_score is not None:
+            mask &= self.ad_scores <= search_filter.max_score
+        published_from, published_to = search_filter.publish_range
+        if published_from is not None:
+            mask &= self.ad_publish >= published_from
+        if published_to is not None:
+            mask &= (self.ad_publish <= published_to) & (self.ad_publish > 0)
+        return mask
+
+    def embedding_filter_mask(self, ad_mask: np.ndarray) -> np.ndarray:
+        """按embedding_id下标的布尔掩码：至少被一个满足条件的广告使用的图片向量。"""
+        mask = np.zeros(len(self.emb_indptr) - 1, dtype=bool)
+        mask[self.emb_owner_ids[ad_mask[self.emb_ad_ids]]] = True
+        return mask
+
+    def images_for_ads(self, ad_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        取出一组广告的全部已索引图片。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: (每个广告的图片数, 按广告顺序拼接的embedding_id,
+            对应的路径下标)。
+        """
+        ad_ids = np.asarray(ad_ids, dtype=np.int64)
+        valid = (ad_ids >= 0) & (ad_ids + 1 < len(self.ad_indptr))
+        starts = np.zeros(len(ad_ids), dtype=np.int64)
+        ends = np.zeros(len(ad_ids), dtype=np.int64)
+        starts[valid] = self.ad_indptr[ad_ids[valid]]
+        ends[valid] = self.ad_indptr[ad_ids[valid] + 1]
+        counts = ends - starts
+        # 向量化展开各区间 [start, end)
+        offsets = np.cumsum(counts) - counts
+        rows = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        return counts, self.image_embedding_ids[rows], self.image_path_idx[rows]
+
+class MetadataStore:
+    """
+    将检索所需的元数据一次性加载为紧凑的NumPy数组 (见 MetadataTables)，查询时用数组下标代替SQLite往返。
+    数据库文件发生变化时 (按文件修改时间和大小判断) 自动重新加载。
+    """
+    def __init__(self, db_path: str, check_interval: float = 1.0):
+        """
+        初始化MetadataStore。
+
+        Args:
+            db_path (str): SQLite数据库路径。
+            check_interval (float): 两次检查数据库是否变化的最小间隔 (秒)。
+        """
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._last_check = 0.0
+        self.tables = MetadataTables()
+
+    @property
+    def version(self) -> int:
+        return self.tables.version
+
+    def _db_signature(self):
+        """数据库及其WAL文件的 (修改时间, 大小)，任一变化即视为数据已更新。"""
+        signature = []
+        for path in (self.db_path, self.db_path + '-wal'):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh_if_changed(self) -> MetadataTables:
+        """数据库有变化时重新加载，返回当前快照。检查本身只是一次stat调用，且有最小间隔。"""
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            if self._db_signature() != self._signature:
+                self.reload()
+        return self.tables
+
+    def reload(self):
+        """从数据库重新加载全部元数据，并整体替换当前快照。"""
+        with self._lock:
+            signature = self._db_signature()
+            version = self.tables.version + 1
+            if not os.path.exists(self.db_path):
+                self.tables = MetadataTables(version)
+                self._signature = signature
+                return
+            start = time.perf_counter()
+            cursor = database.get_connection(self.db_path).cursor()
+            cursor.execute("SELECT id, title, creative, score, publish_time, category FROM advertisements")
+            ads = cursor.fetchall()
+            # 同一广告内的重复图片共用一个向量，只保留最早的一行 (SQLite中MIN()聚合时裸列取自该行)
+            cursor.execute(
+                "SELECT ad_id, local_path, embedding_id, MIN(id) AS first_id FROM images "
+                "WHERE download_status = 'completed' AND embedding_id IS NOT NULL AND ad_id IS NOT NULL "
+                "GROUP BY ad_id, embedding_id ORDER BY ad_id, first_id"
+            )
+            images = cursor.fetchall()
+            self.tables = MetadataTables.from_rows(ads, images, version)
+            self._signature = signature
+            logger.info(f"元数据加载完成：{len(ads)} 条广告，{len(images)} 张已索引图片，耗时 {(time.perf_counter() - start) * 1000:.1f} ms。")
@@ -0,0 +1,232 @@
+import json
+import time
+import threading
+from collections import deque
+from loguru import logger
+from typing import Any, Dict, List
+
+import numpy as np
+
+# 导出的分位数
+QUANTILES = (0.5, 0.95, 0.99)
+
+class LatencyWindow:
+    """
+    最近 size 个耗时样本 (毫秒) 的环形缓冲区，用于计算滚动分位数；
+    同时累计全部样本的数量与总和，供Prometheus的 _count/_sum 使用。
+    """
+    def __init__(self, size: int = 2048):
+        self._values = np.zeros(max(int(size), 1), dtype=np.float64)
+        self._next = 0
+        self._filled = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float, n: int = 1):
+        """记录n个耗时相同的样本 (批量搜索中同一批的查询共享一次耗时)。"""
+        size = len(self._values)
+        slots = (self._next + np.arange(min(n, size))) % size
+        self._values[slots] = value
+        self._next = (self._next + n) % size
+        self._filled = min(self._filled + n, size)
+        self.count += n
+        self.sum += value * n
+
+    def quantiles(self, qs=QUANTILES) -> List[float]:
+        if not self._filled:
+            return [0.0] * len(qs)
+        return np.quantile(self._values[:self._filled], qs).tolist()
+
+class _Stage:
+    """QueryTrace.stage 返回的计时上下文，同名阶段的耗时累加。"""
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: 'QueryTrace', name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stages = self.trace.stages
+        stages[self.name] = stages.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+class QueryTrace:
+    """一次搜索调用 (或一批查询) 的各阶段耗时，finish时汇总到SearchMetrics。"""
+    __slots__ = ('metrics', 'mode', 'query', 'num_queries', 'stages', 'start')
+
+    def __init__(self, metrics: 'SearchMetrics', mode: str, query: Any, num_queries: int = 1):
+        self.metrics = metrics
+        self.mode = mode
+        self.query = query
+        self.num_queries = num_queries
+        self.stages: Dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def finish(self):
+        self.metrics._record(self, time.perf_counter() - self.start)
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _NullTrace:
+    """未启用统计时使用的空实现，每个阶段只有一次方法调用的开销。"""
+    __slots__ = ()
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def finish(self):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+def describe_query(query: Any, max_chars: int = 200) -> str:
+    """慢查询日志中的查询描述：文本截断显示，上传的文件对象显示文件名。"""
+    if isinstance(query, str):
+        return query if len(query) <= max_chars else query[:max_chars] + '...'
+    if isinstance(query, (list, tuple)):
+        shown = [describe_query(q, 50) for q in query[:3]]
+        more = f" 等{len(query)}个" if len(query) > 3 else ""
+        return f"[{', '.join(shown)}]{more}"
+    name = getattr(query, 'name', None)
+    return f"<{type(query).__name__} {name}>" if name else f"<{type(query).__name__}>"
+
+class SearchMetrics:
+    """
+    搜索耗时统计：每次搜索按阶段计时，按搜索模式维护各阶段与总耗时的滚动p50/p95/p99，
+    超过阈值的查询连同阶段耗时写入慢查询日志，并可导出为Prometheus文本格式。
+
+    未启用时 trace() 返回空实现，搜索路径上只剩几次空方法调用。
+    """
+    def __init__(self, enabled: bool = True, window: int = 2048, slow_query_ms: float = 500.0,
+                 slow_log_path: str = None, max_slow_queries: int = 100):
+        """
+        初始化SearchMetrics。
+
+        Args:
+            enabled (bool): 是否启用统计。
+            window (int): 每个模式/阶段保留的最近样本数，分位数基于这些样本计算。
+            slow_query_ms (float): 慢查询阈值 (毫秒)，<=0 表示不记录慢查询。
+            slow_log_path (str, optional): 慢查询日志文件 (每行一个JSON)，为None时只输出到日志。
+            max_slow_queries (int): 内存中保留的最近慢查询条数。
+        """
+        self.enabled = enabled
+        self.window = window
+        self.slow_query_ms = slow_query_ms
+        self.slow_log_path = slow_log_path
+        self._windows: Dict[tuple, LatencyWindow] = {}
+        self._slow_counts: Dict[str, int] = {}
+        self.slow_queries = deque(maxlen=max_slow_queries)
+        self._lock = threading.Lock()
+
+    def trace(self, mode: str, query: Any = None, num_queries: int = 1):
+        """开始一次搜索的计时，调用方在结束时调用返回对象的 finish()。"""
+        if not self.enabled:
+            return NULL_TRACE
+        return QueryTrace(self, mode, query, num_queries)
+
+    def _window(self, mode: str, stage: str) -> LatencyWindow:
+        window = self._windows.get((mode, stage))
+        if window is None:
+            window = self._windows[(mode, stage)] = LatencyWindow(self.window)
+        return window
+
+    def _record(self, trace: QueryTrace, elapsed: float):
+        total_ms = elapsed * 1000
+        stages_ms = {name: seconds * 1000 for name, seconds in trace.stages.items()}
+        slow = self.slow_query_ms > 0 and total_ms >= self.slow_query_ms
+        with self._lock:
+            self._window(trace.mode, 'total').add(total_ms, trace.num_queries)
+            for name, ms in stages_ms.items():
+                self._window(trace.mode, name).add(ms, trace.num_queries)
+            if slow:
+                self._slow_counts[trace.mode] = self._slow_counts.get(trace.mode, 0) + 1
+        if slow:
+            self._log_slow_query(trace, total_ms, stages_ms)
+
+    def _log_slow_query(self, trace: QueryTrace, total_ms: float, stages_ms: Dict[str, float]):
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'mode': trace.mode,
+            'query': describe_query(trace.query),
+            'num_queries': trace.num_queries,
+            'total_ms': round(total_ms, 3),
+            'stages_ms': {name: round(ms, 3) for name, ms in stages_ms.items()},
+        }
+        self.slow_queries.append(entry)
+        breakdown = ", ".join(f"{name}={ms:.1f}ms" for name, ms in stages_ms.items())
+        logger.warning(f"慢查询 [{trace.mode}] {total_ms:.1f}ms ({breakdown}) query={entry['query']}")
+        if self.slow_log_path:
+            try:
+                with open(self.slow_log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            except OSError as e:
+                logger.error(f"写入慢查询日志失败: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        返回各模式的统计：{mode: {'count', 'slow', 'total': {p50,p95,p99,mean}, 'stages': {stage: {...}}}}，
+        以及最近的慢查询列表。
+        """
+        modes: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for (mode, stage), window in self._windows.items():
+                p50, p95, p99 = window.quantiles()
+                summary = {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                           'mean_ms': window.sum / window.count if window.count else 0.0}
+                entry = modes.setdefault(mode, {'count': 0, 'slow': self._slow_counts.get(mode, 0), 'stages': {}})
+                if stage == 'total':
+                    entry['count'] = window.count
+                    entry['total'] = summary
+                else:
+                    entry['stages'][stage] = summary
+            slow_queries = list(self.slow_queries)
+        return {'enabled': self.enabled, 'modes': modes, 'slow_queries': slow_queries}
+
+    def to_prometheus(self, prefix: str = 'image_search') -> str:
+        """导出为Prometheus文本格式 (summary类型，分位数基于滚动窗口)。"""
+        name = f"{prefix}_search_latency_ms"
+        lines = [
+            f"# HELP {name} Search latency per mode and stage in milliseconds (rolling window quantiles).",
+            f"# TYPE {name} summary",
+        ]
+        with self._lock:
+            items = sorted(self._windows.items())
+            slow_counts = dict(self._slow_counts)
+            totals = {mode: window.count for (mode, stage), window in items if stage == 'total'}
+            for (mode, stage), window in items:
+                labels = f'mode="{mode}",stage="{stage}"'
+                for q, value in zip(QUANTILES, window.quantiles()):
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.6g}')
+                lines.append(f"{name}_sum{{{labels}}} {window.sum:.6g}")
+                lines.append(f"{name}_count{{{labels}}} {window.count}")
+        lines.append(f"# HELP {prefix}_search_queries_total Number of search queries per mode.")
+        lines.append(f"# TYPE {prefix}_search_queries_total counter")
+        for mode, count in sorted(totals.items()):
+            lines.append(f'{prefix}_search_queries_total{{mode="{mode}"}} {count}')
+        lines.append(f"# HELP {prefix}_slow_queries_total Number of search calls slower than the slow query threshold.")
+        lines.append(f"# TYPE {prefix}_slow_queries_total counter")
+        for mode in sorted(totals):
+            lines.append(f'{prefix}_slow_queries_total{{mode="{mode}"}} {slow_counts.get(mode, 0)}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """清空全部统计。"""
+        with self._lock:
+            self._windows.clear()
+            self._slow_counts.clear()
+            self.slow_queries.clear()
@@ -0,0 +1,100 @@
+import time
+import asyncio
+from concurrent.futures import Executor
+from loguru import logger
+from typing import Any, Callable, Dict, List
+
+class MicroBatcher:
+    """
+    动态微批处理：在一个很短的时间窗口内到达的请求合并为一批，交给 process_fn 一次处理。
+
+    第一个请求到达后最多再等待 max_wait_ms 毫秒，或凑满 max_batch_size 个请求后立即处理。
+    负载低时单个请求几乎不增加延迟，负载高时批次自然变大，吞吐随之提高。
+    """
+    def __init__(self, process_fn: Callable[[List[Any]], List[Any]], executor: Executor,
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, name: str = "batcher"):
+        """
+        初始化MicroBatcher。
+
+        Args:
+            process_fn (Callable[[List[Any]], List[Any]]): 同步的批处理函数，输入和输出一一对应。
+            executor (Executor): 运行process_fn的线程池。模型推理不是线程安全的，应使用单线程的执行器。
+            max_batch_size (int): 每批最多合并的请求数。
+            max_wait_ms (float): 第一个请求到达后最多等待的毫秒数。
+            name (str): 日志与统计中使用的名称。
+        """
+        self.process_fn = process_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = None
+        self._worker = None
+        self.batches = 0
+        self.requests = 0
+
+    def start(self):
+        """在当前事件循环中启动后台批处理任务。"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, item: Any) -> Any:
+        """提交一个请求并等待其所在批次处理完成，返回该请求对应的结果。"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        """取出一批请求：阻塞等待第一个，之后在时间窗口内尽量多取。"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # 等待期间已断开的请求无需处理
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_fn, [item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"{self.name} 批处理失败 ({len(batch)} 个请求): {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'avg_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+        }
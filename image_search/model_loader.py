@@ -0,0 +1,101 @@
+import os
+import json
+import torch
+from loguru import logger
+from typing import Dict
+
+from .inference_backends import ENCODER_TOWERS
+
+class ImageEncoder(torch.nn.Module):
+    """CN-CLIP的图片塔 (与 CLIP.encode_image 等价)，可单独序列化和加载。"""
+    def __init__(self, visual):
+        super().__init__()
+        self.visual = visual
+
+    def forward(self, image):
+        return self.visual(image.type(self.visual.conv1.weight.dtype))
+
+class TextEncoder(torch.nn.Module):
+    """CN-CLIP的文本塔 (与 CLIP.encode_text 等价)，可单独序列化和加载。"""
+    def __init__(self, bert, text_projection, pad_index: int):
+        super().__init__()
+        self.bert = bert
+        self.text_projection = text_projection
+        self.pad_index = pad_index
+
+    def forward(self, text):
+        dtype = self.text_projection.dtype
+        attn_mask = text.ne(self.pad_index).type(dtype)
+        x = self.bert(text, attention_mask=attn_mask)[0].type(dtype)
+        return x[:, 0, :] @ self.text_projection
+
+def artifact_paths(artifact_dir: str, model_name: str) -> Dict[str, str]:
+    """返回某个模型各编码塔的序列化文件路径，以及记录向量维度等信息的元数据文件路径。"""
+    base = os.path.join(artifact_dir, model_name)
+    return {'image': base + '.image.pt', 'text': base + '.text.pt', 'meta': base + '.meta.json'}
+
+def convert_checkpoint(model_name: str, artifact_dir: str, download_root: str = './models') -> dict:
+    """
+    从CN-CLIP原始checkpoint加载完整模型 (一次性的转换开销)，拆分为图片塔和文本塔分别序列化。
+    之后的冷启动直接反序列化所需的编码塔，跳过checkpoint解析与权重转换。
+
+    Returns:
+        dict: 元数据 {'model_name', 'embedding_dim', 'image_resolution'}。
+    """
+    from cn_clip.clip import load_from_name
+    from cn_clip.clip import _tokenizer
+
+    logger.info(f"正在从checkpoint转换模型 '{model_name}'，生成可直接加载的编码塔文件...")
+    model, _ = load_from_name(model_name, device='cpu', download_root=download_root)
+    model = model.float().eval()
+    paths = artifact_paths(artifact_dir, model_name)
+    os.makedirs(artifact_dir, exist_ok=True)
+    towers = {
+        'image': ImageEncoder(model.visual),
+        'text': TextEncoder(model.bert, model.text_projection, _tokenizer.vocab['[PAD]']),
+    }
+    for tower, module in towers.items():
+        torch.save(module, paths[tower] + '.tmp')
+        os.replace(paths[tower] + '.tmp', paths[tower])
+    meta = {
+        'model_name': model_name,
+        'embedding_dim': int(model.text_projection.shape[1]),
+        'image_resolution': int(model.visual.input_resolution),
+    }
+    with open(paths['meta'], 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return meta
+
+def load_meta(model_name: str, artifact_dir: str, download_root: str = './models') -> dict:
+    """读取模型元数据，尚未转换时先转换。"""
+    paths = artifact_paths(artifact_dir, model_name)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return convert_checkpoint(model_name, artifact_dir, download_root)
+    with open(paths['meta'], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_tower(model_name: str, tower: str, artifact_dir: str, device: str = 'cpu', download_root: str = './models') -> torch.nn.Module:
+    """
+    只加载一个编码塔。
+
+    Args:
+        model_name (str): CN-CLIP模型名称。
+        tower (str): 'image' 或 'text'。
+        artifact_dir (str): 序列化编码塔的目录，文件不存在时从checkpoint转换生成。
+        device (str): 加载到的设备，CUDA上与 load_from_name 一致使用fp16。
+        download_root (str): checkpoint下载目录。
+
+    Returns:
+        torch.nn.Module: forward即为对应的encode函数 (输出未归一化)。
+    """
+    if tower not in ENCODER_TOWERS:
+        raise ValueError(f"tower必须是 {ENCODER_TOWERS} 之一")
+    load_meta(model_name, artifact_dir, download_root)
+    path = artifact_paths(artifact_dir, model_name)[tower]
+    try:
+        module = torch.load(path, map_location=device, weights_only=False)
+    except TypeError:  # 旧版PyTorch没有weights_only参数
+        module = torch.load(path, map_location=device)
+    if device == 'cuda':
+        module = module.half()
+    return module.eval()
@@ -0,0 +1,88 @@
+import numpy as np
+from loguru import logger
+from typing import Dict, List, Sequence, Tuple
+
+# 段落id = ad_id * PASSAGE_STRIDE + 段落序号，由段落id整除即可还原广告id，无需额外的映射表
+PASSAGE_STRIDE = 1024
+
+def passage_ids_of(ad_id: int, count: int) -> np.ndarray:
+    """返回某个广告前count个段落的id。"""
+    return ad_id * PASSAGE_STRIDE + np.arange(count, dtype=np.int64)
+
+def passage_ad_ids(passage_ids: np.ndarray) -> np.ndarray:
+    """将段落id还原为广告id，-1 (结果不足) 保持为-1。"""
+    passage_ids = np.asarray(passage_ids, dtype=np.int64)
+    return np.where(passage_ids >= 0, passage_ids // PASSAGE_STRIDE, -1)
+
+def select_passages_of_ads(passage_ids: np.ndarray, ad_ids: Sequence[int]) -> np.ndarray:
+    """从段落id中挑出属于给定广告的那些 (用于删除变更广告的全部旧段落)。"""
+    passage_ids = np.asarray(passage_ids, dtype=np.int64)
+    return passage_ids[np.isin(passage_ad_ids(passage_ids), np.asarray(ad_ids, dtype=np.int64))]
+
+def split_ad(embedder, fields: Sequence[str], overlap: int = 8, max_passages: int = 64) -> List[List[int]]:
+    """
+    将一条广告的各文本字段 (标题、背景、洞察、创意) 分别切分为token窗口。
+    字段之间不拼接，每个窗口只包含一个字段的内容，短字段 (如标题) 自成一段。
+
+    Args:
+        embedder: 提供 tokenize_windows 的向量生成器。
+        fields (Sequence[str]): 文本字段，空字段被跳过。
+        overlap (int): 相邻窗口重叠的token数。
+        max_passages (int): 每条广告最多保留的段落数，不超过 PASSAGE_STRIDE。
+
+    Returns:
+        List[List[int]]: 各段落的token id列表。
+    """
+    windows = []
+    for field in fields:
+        if field:
+            windows.extend(embedder.tokenize_windows(field, overlap))
+    return windows[:min(max_passages, PASSAGE_STRIDE)]
+
+def encode_ad_passages(embedder, rows: Sequence[Tuple], batch_size: int = 64, overlap: int = 8,
+                       max_passages: int = 64) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    将一批广告切分为段落并批量编码。所有广告的段落合并后一起按长度分桶编码，
+    段落数再多也只是更多的整批前向计算。
+
+    Args:
+        embedder: 向量生成器。
+        rows (Sequence[Tuple]): (ad_id, title, background, insight, creative) 行。
+        batch_size (int): 每次前向计算的段落数量。
+        overlap (int): 相邻窗口重叠的token数。
+        max_passages (int): 每条广告最多保留的段落数。
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (段落向量, 段落id, 至少有一个段落编码成功的广告id)。
+    """
+    token_lists, passage_ids = [], []
+    for ad_id, *fields in rows:
+        try:
+            windows = split_ad(embedder, fields, overlap, max_passages)
+        except Exception as e:
+            logger.error(f"切分广告文本失败: {ad_id}, 错误: {e}")
+            continue
+        token_lists.extend(windows)
+        passage_ids.append(passage_ids_of(ad_id, len(windows)))
+    passage_ids = np.concatenate(passage_ids) if passage_ids else np.zeros(0, dtype=np.int64)
+    if not token_lists:
+        return np.zeros((0, embedder.embedding_dim), dtype=np.float32), passage_ids, np.zeros(0, dtype=np.int64)
+    embeddings, failed = embedder.encode_token_lists(token_lists, batch_size=batch_size)
+    passage_ids = passage_ids[~failed]
+    return embeddings[~failed], passage_ids, np.unique(passage_ad_ids(passage_ids))
+
+def best_passage_per_ad(distances: np.ndarray, passage_ids: np.ndarray, top_k: int) -> Tuple[List[int], Dict[int, float]]:
+    """
+    将一个查询的段落检索结果 (已按分数降序) 聚合为广告，每个广告取其最佳段落的分数。
+
+    Returns:
+        Tuple[List[int], Dict[int, float]]: (按分数降序的前top_k个广告id, {ad_id: score})。
+    """
+    valid = passage_ids >= 0
+    ad_ids, scores = passage_ad_ids(passage_ids[valid]), distances[valid]
+    # 每个广告首次出现的位置即其最佳段落，按该位置排序保持分数降序
+    unique_ad_ids, first = np.unique(ad_ids, return_index=True)
+    order = np.argsort(first)
+    sorted_ad_ids = unique_ad_ids[order].tolist()
+    ad_scores = dict(zip(sorted_ad_ids, scores[first[order]].tolist()))
+    return sorted_ad_ids[:top_k], ad_scores
@@ -0,0 +1,67 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+class ResultCache:
+    """
+    搜索结果缓存：有界LRU，每条结果带过期时间。
+
+    键中包含索引和元数据的版本号，索引或数据库变化后旧结果不会再被命中，
+    SearchEngine在索引变化时也会主动清空缓存以释放内存。
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        """
+        初始化ResultCache。
+
+        Args:
+            max_entries (int): 最多缓存的结果数。
+            ttl (float): 结果的有效期 (秒)，<=0 表示不过期。
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """返回缓存结果的副本，未命中或已过期时返回None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and time.monotonic() > entry[0]:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        # 返回副本，调用方修改结果不会影响缓存
+        return copy.deepcopy(value)
+
+    def put(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self.ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中计数与命中率。"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
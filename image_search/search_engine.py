@@ -1,17 +1,58 @@
 import faiss
 import numpy as np
 import os
-import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Union
 
+from . import database, dedup, index_factory, lexical, passages
+from .embedding_cache import EmbeddingCache, query_key
 from .embedding_generator import EmbeddingGenerator
+from .embedding_store import EmbeddingStore
+from .filters import SearchFilter
+from .metadata import MetadataStore
+from .metrics import NULL_TRACE, SearchMetrics
+from .result_cache import ResultCache
+from .thumbnails import ThumbnailStore
+
+# 混合检索：BM25关键词检索与文本段落向量检索并行执行，按倒数排名融合
+HYBRID_MODE = 'hybrid'
+
+# 精确检索允许的图片向量时每次从向量存储中取出的行数
+_EXACT_SEARCH_CHUNK = 65536
+
+class _FilterPlan:
+    """
+    一个过滤条件针对某个索引编译后的检索计划，按 (条件, 元数据版本, 索引版本) 缓存复用。
+
+    - ad_mask: 按ad_id下标的广告掩码；
+    - params: 传给Faiss的带ID选择器的检索参数 (过滤在索引内部进行)；
+    - exact_ids / vectors: 允许的图片向量很少 (或索引不支持选择器) 时，改为在这些向量中精确检索，
+      向量较少时其原始向量也缓存在计划中；
+    - empty: 没有满足条件的数据，直接返回空结果。
+    """
+    __slots__ = ('index', 'ad_mask', 'params', 'exact_ids', 'vectors', 'empty')
+
+    def __init__(self, index, ad_mask: np.ndarray, params=None, exact_ids: np.ndarray = None, vectors=None, empty: bool = False):
+        self.index = index
+        self.ad_mask = ad_mask
+        self.params = params
+        self.exact_ids = exact_ids
+        self.vectors = vectors
+        self.empty = empty
 
 class SearchEngine:
     """
     负责管理Faiss向量索引，包括构建、保存、加载和搜索。
     """
-    def __init__(self, embedding_generator: EmbeddingGenerator, embedding_dim: int, db_path: str, image_index_path: str, text_index_path: str):
+    def __init__(self, embedding_generator: EmbeddingGenerator, embedding_dim: int, db_path: str, image_index_path: str, text_index_path: str,
+                 index_backend: str = 'flat', index_params: Dict[str, Any] = None, embedding_cache: EmbeddingCache = None,
+                 result_cache: ResultCache = None, thumbnail_store: ThumbnailStore = None,
+                 passage_overlap: int = 8, max_passages_per_ad: int = 64, mmap_indexes: bool = False,
+                 metrics: SearchMetrics = None, rrf_k: int = 60, filter_exact_threshold: int = 2048,
+                 phash_max_distance: int = None):
         """
         初始化SearchEngine。
 
@@ -20,40 +61,129 @@ class SearchEngine:
             embedding_dim (int): 向量维度。
             db_path (str): SQLite数据库路径。
             image_index_path (str): 图片Faiss索引文件路径。
-            text_index_path (str): 文本Faiss索引文件路径。
+            text_index_path (str): 文本段落Faiss索引文件路径。
+            index_backend (str): 图片索引后端，'flat'、'hnsw' 或 'ivf'。
+            index_params (Dict[str, Any], optional): 后端参数 (hnsw_m/ef_search/nlist/nprobe等)，
+                以及图片向量的压缩编码 (encoding/pq_m/pca_dim/rerank_factor)，见 index_factory.DEFAULT_INDEX_PARAMS。
+            embedding_cache (EmbeddingCache, optional): 查询向量缓存，重复的查询不再调用模型。
+            result_cache (ResultCache, optional): 搜索结果缓存，按索引版本自动失效。
+            thumbnail_store (ThumbnailStore, optional): 缩略图存储，提供时结果中附带缩略图路径。
+            passage_overlap (int): 广告文本切分为段落时相邻窗口重叠的token数。
+            max_passages_per_ad (int): 每条广告最多索引的段落数。
+            mmap_indexes (bool): 以内存映射方式打开索引文件，缩短冷启动时间；增删向量前会先完整读取。
+            metrics (SearchMetrics, optional): 搜索耗时统计，提供时每次搜索按阶段计时。
+            rrf_k (int): 混合检索倒数排名融合的平滑常数。
+            filter_exact_threshold (int): 过滤后剩余的图片向量不超过该数量时，直接在这些向量中精确检索
+                (HNSW在高选择性过滤下召回率下降，而少量向量的暴力检索本身就很快)。
+            phash_max_distance (int, optional): 图片去重时近似重复允许的dHash汉明距离，为None时只合并完全相同的文件
+                (见 dedup.assign_canonical_ids)。
         """
         self.embedder = embedding_generator
         self.db_path = db_path
         self.image_index_path = image_index_path
         self.text_index_path = text_index_path
         self.embedding_dim = embedding_dim
+        self.index_backend = index_backend
+        self.index_params = index_params or {}
+        self.embedding_cache = embedding_cache
+        self.result_cache = result_cache
+        self.thumbnail_store = thumbnail_store
+        self.passage_overlap = passage_overlap
+        self.max_passages_per_ad = max_passages_per_ad
+        self.mmap_indexes = mmap_indexes
+        self.metrics = metrics
+        self.rrf_k = rrf_k
+        self.filter_exact_threshold = filter_exact_threshold
+        self.phash_max_distance = phash_max_distance
+        # 编译好的过滤计划 (LRU) 与索引内部位置到分组的映射，索引变化时清空
+        self._filter_plans = OrderedDict()
+        self._position_groups = {}
+        # 文本索引中平均每条广告的段落数，决定文本检索取多少个段落，索引变化时重新统计
+        self._passages_per_ad = None
+        self._filter_lock = threading.Lock()
+        # 混合检索中执行BM25查询的线程，首次使用时创建
+        self._lexical_executor = None
+        # 以内存映射方式打开 (只读) 的索引类型
+        self._mmapped = set()
+        # 索引每次变化 (加载、重建、增删向量) 时递增，作为结果缓存键的一部分
+        self.index_version = 0
 
         # 初始化空的索引
         self.image_index = None
         self.text_index = None
+        # 图片原始向量以内存映射的 .npy 文件保存在索引旁，用于挑选代表图片，以及压缩索引的精确重排
+        self.image_store = EmbeddingStore(os.path.splitext(image_index_path)[0] + '.npy')
+        # 检索用的元数据常驻内存，数据库变化时自动重新加载
+        self.metadata = MetadataStore(db_path)
+        self.metadata.reload()
         
         # 加载索引
         self.load_indexes()
 
-    def build_index(self, embeddings: np.ndarray, index_type: str):
+    def create_index(self, index_type: str = 'image', num_vectors: int = None):
         """
-        使用给定的向量构建或更新一个Faiss索引。
+        创建一个空的Faiss索引，供分块流式添加向量使用。
+        索引使用显式id (图片索引为images.id，文本索引为段落id，见 passages 模块)，
+        以便增量添加和删除。图片索引使用配置的后端与压缩编码，文本索引数据量小，始终使用未压缩的精确检索。
 
         Args:
-            embeddings (np.ndarray): 用于构建索引的向量数组。
-            index_type (str): 'image' 或 'text'，指定要构建的索引类型。
+            index_type (str): 'image' 或 'text'。
+            num_vectors (int, optional): 预计的向量数量，用于确定IVF的聚类数。
         """
-        index = faiss.IndexFlatL2(self.embedding_dim)
-        index.add(embeddings)
+        backend = self.index_backend if index_type == 'image' else 'flat'
+        return index_factory.create_index(self.embedding_dim, backend, self._params_for(index_type), num_vectors)
 
+    def _params_for(self, index_type: str) -> Dict[str, Any]:
+        """索引参数：压缩编码只用于图片索引。"""
+        if index_type == 'image':
+            return self.index_params
+        return dict(self.index_params, encoding='float32', pca_dim=0)
+
+    def set_index(self, index, index_type: str):
+        """
+        替换当前使用的图片或文本索引。
+
+        Args:
+            index: 已构建好的Faiss索引。
+            index_type (str): 'image' 或 'text'，指定要替换的索引类型。
+        """
         if index_type == 'image':
             self.image_index = index
+            self._mmapped.discard('image')
             logger.info(f"图片索引构建完成，共添加 {self.image_index.ntotal} 个向量。")
         elif index_type == 'text':
             self.text_index = index
+            self._mmapped.discard('text')
             logger.info(f"文本索引构建完成，共添加 {self.text_index.ntotal} 个向量。")
         else:
             raise ValueError("index_type必须是 'image' 或 'text'")
+        self._bump_index_version()
+
+    def build_index(self, embeddings: np.ndarray, ids: np.ndarray, index_type: str):
+        """
+        使用给定的向量构建或更新一个Faiss索引。
+
+        Args:
+            embeddings (np.ndarray): 用于构建索引的向量数组。
+            ids (np.ndarray): 与向量一一对应的id (images.id 或段落id)。
+            index_type (str): 'image' 或 'text'，指定要构建的索引类型。
+        """
+        backend = self.index_backend if index_type == 'image' else 'flat'
+        index = index_factory.build_index(ids, embeddings, self.embedding_dim, backend, self._params_for(index_type))
+        if index_type == 'image':
+            self.image_store.save(ids, embeddings)
+        self.set_index(index, index_type)
+
+    def rebuild_index(self, index_type: str = 'image'):
+        """
+        使用索引中已存储的向量按当前配置的后端重新训练并构建索引，无需重新生成向量。
+        用于切换后端或在数据量变化较大后重新训练IVF聚类中心。
+        """
+        if index_type == 'image' and len(self.image_store):
+            ids, vectors = self.image_store.ids, self.image_store.vectors
+        else:
+            ids, vectors = index_factory.extract_vectors(self._get_index(index_type))
+        self.build_index(vectors, ids, index_type)
 
     def save_indexes(self):
         """将当前的图片和文本索引保存到文件。"""
@@ -61,127 +191,781 @@ class SearchEngine:
         os.makedirs(os.path.dirname(self.text_index_path), exist_ok=True)
         
         logger.info(f"正在保存图片索引到: {self.image_index_path}")
-        faiss.write_index(self.image_index, self.image_index_path)
+        self._save_index('image')
         
         logger.info(f"正在保存文本索引到: {self.text_index_path}")
-        faiss.write_index(self.text_index, self.text_index_path)
+        self._save_index('text')
         logger.info("索引保存完成。")
 
     def load_indexes(self):
         """从文件加载图片和文本索引。"""
         if os.path.exists(self.image_index_path):
             logger.info(f"正在从 {self.image_index_path} 加载图片索引...")
-            self.image_index = faiss.read_index(self.image_index_path)
+            self.image_index = self._read_index('image', self.image_index_path)
+            index_factory.apply_search_params(self.image_index, self.index_params)
             logger.info(f"图片索引加载完成，包含 {self.image_index.ntotal} 个向量。")
+            self._check_index_format(self.image_index, self.image_index_path)
         else:
             logger.warning(f"图片索引文件未找到: {self.image_index_path}")
+
+        if not self.image_store.load():
+            logger.warning(f"图片向量存储未找到: {self.image_store.vectors_path}，将无法按相似度挑选代表图片。")
             
         if os.path.exists(self.text_index_path):
             logger.info(f"正在从 {self.text_index_path} 加载文本索引...")
-            self.text_index = faiss.read_index(self.text_index_path)
+            self.text_index = self._read_index('text', self.text_index_path)
             logger.info(f"文本索引加载完成，包含 {self.text_index.ntotal} 个向量。")
+            self._check_index_format(self.text_index, self.text_index_path)
         else:
             logger.warning(f"文本索引文件未找到: {self.text_index_path}")
+        self._bump_index_version()
+
+    def _read_index(self, index_type: str, path: str):
+        index, mmapped = index_factory.read_index(path, self.mmap_indexes)
+        if mmapped:
+            self._mmapped.add(index_type)
+        else:
+            self._mmapped.discard(index_type)
+        return index
+
+    def _bump_index_version(self):
+        """索引内容发生变化：递增版本号，并清空已失效的结果缓存。"""
+        self.index_version += 1
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        with self._filter_lock:
+            self._filter_plans.clear()
+            self._position_groups.clear()
+            self._passages_per_ad = None
+
+    @staticmethod
+    def _check_index_format(index, path):
+        """旧版索引按位置编号，无法与数据库id对应，提示重建。"""
+        if not hasattr(index, 'id_map'):
+            logger.warning(f"索引 {path} 不包含显式id，结果可能与数据库不一致，请运行 scripts/build_index.py --restart 重建。")
+
+    # ---- 增量更新 ----
+
+    def _get_index(self, index_type: str):
+        """返回指定类型的索引，不存在时创建一个空索引。"""
+        if index_type not in ('image', 'text'):
+            raise ValueError("index_type必须是 'image' 或 'text'")
+        index = self.image_index if index_type == 'image' else self.text_index
+        if index is None:
+            index = self.create_index(index_type)
+            self._replace_index(index_type, index)
+        return index
+
+    def _writable_index(self, index_type: str):
+        """返回可原地修改的索引：内存映射的索引是只读的，先从文件完整读取一份替换它。"""
+        if index_type in self._mmapped:
+            path = self.image_index_path if index_type == 'image' else self.text_index_path
+            logger.info(f"{index_type}索引以内存映射方式打开，修改前完整读取: {path}")
+            index = faiss.read_index(path)
+            if index_type == 'image':
+                index_factory.apply_search_params(index, self.index_params)
+            self._replace_index(index_type, index)
+        return self._get_index(index_type)
+
+    def _replace_index(self, index_type: str, index):
+        self._mmapped.discard(index_type)
+        if index_type == 'image':
+            self.image_index = index
+        else:
+            self.text_index = index
+        self._bump_index_version()
+
+    def _index_ids_for(self, index_type: str, ids) -> np.ndarray:
+        """图片索引的向量id即传入的id；文本索引中一条广告对应多个段落，展开为其全部段落id。"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if index_type == 'image' or not len(ids):
+            return ids
+        return passages.select_passages_of_ads(index_factory.list_ids(self._get_index('text')), ids)
+
+    def _remove_from_index(self, index_type: str, ids: np.ndarray) -> int:
+        """删除向量；HNSW不支持原地删除，会替换为重建后的索引。"""
+        # HNSW需重建时优先使用磁盘上的原始向量，避免压缩索引解码误差的累积
+        source = (self.image_store.ids, self.image_store.vectors) if index_type == 'image' and len(self.image_store) else None
+        index, removed = index_factory.remove_ids(self._writable_index(index_type), ids, self.embedding_dim,
+                                                  self._params_for(index_type), source)
+        self._replace_index(index_type, index)
+        return removed
+
+    def _add_to_index(self, index_type: str, embeddings: np.ndarray, ids: np.ndarray):
+        """添加向量；尚未训练的IVF索引先用本批向量训练。"""
+        if len(ids):
+            index = self._writable_index(index_type)
+            index_factory.train_index(index, embeddings)
+            index.add_with_ids(embeddings, ids)
+            self._bump_index_version()
+
+    def _save_index(self, index_type: str):
+        """只保存发生变化的那一个索引。先写临时文件再替换，不会破坏其他进程正在内存映射的旧文件。"""
+        index, path = (self.image_index, self.image_index_path) if index_type == 'image' else (self.text_index, self.text_index_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        faiss.write_index(index, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def remove_ids(self, ids: List[int], index_type: str = 'image', persist: bool = True) -> int:
+        """
+        从索引中删除指定id的向量，并清除数据库中对应的向量标记。
+
+        Args:
+            ids (List[int]): 要删除的图片向量id (即canonical图片的images.id，共用该向量的重复图片一并清除标记)
+                或 advertisements.id (文本索引)。
+            index_type (str): 'image' 或 'text'。
+            persist (bool): 是否立即将索引写回文件。
+
+        Returns:
+            int: 实际删除的向量数量。
+        """
+        if not len(ids):
+            return 0
+        removed = self._remove_from_index(index_type, self._index_ids_for(index_type, ids))
+        if index_type == 'image':
+            self.image_store.update(remove_ids=ids)
+            sql = "UPDATE images SET embedding_id = NULL WHERE embedding_id = ?"
+        else:
+            sql = "UPDATE advertisements SET text_embedding_id = NULL WHERE id = ?"
+        with database.transaction(self.db_path) as conn:
+            conn.executemany(sql, [(int(i),) for i in ids])
+        if persist:
+            self._save_index(index_type)
+        self.metadata.reload()
+        logger.info(f"已从{index_type}索引中删除 {removed} 个向量。")
+        return removed
+
+    def tombstone_failed_images(self, persist: bool = True) -> int:
+        """
+        清除下载失败图片的向量标记，并将不再被任何已下载图片使用的向量从图片索引中移除
+        (重复图片中只要还有一份可用，共用的向量就保留)。
+        """
+        with database.transaction(self.db_path) as conn:
+            cursor = conn.execute("SELECT DISTINCT embedding_id FROM images WHERE download_status = 'failed' AND embedding_id IS NOT NULL")
+            candidates = [row[0] for row in cursor.fetchall()]
+            if not candidates:
+                return 0
+            conn.execute("UPDATE images SET embedding_id = NULL, canonical_id = NULL WHERE download_status = 'failed' AND embedding_id IS NOT NULL")
+            cursor = conn.execute(
+                f"SELECT DISTINCT embedding_id FROM images WHERE embedding_id IN ({','.join('?' for _ in candidates)})", candidates
+            )
+            in_use = {row[0] for row in cursor.fetchall()}
+        orphaned = [i for i in candidates if i not in in_use]
+        if not orphaned:
+            self.metadata.reload()
+            return 0
+        return self.remove_ids(orphaned, 'image', persist=persist)
+
+    def add_images(self, image_ids: List[int] = None, batch_size: int = 32, persist: bool = True) -> int:
+        """
+        只为新增或变更的图片 (已下载但embedding_id为空) 生成向量并加入图片索引。
+        先对图片去重 (见 dedup 模块)：与已索引图片重复的直接共用其向量，
+        每组新的重复图片只编码canonical图片一次。无法解码的图片会被标记为下载失败，不再重复尝试。
+
+        Args:
+            image_ids (List[int], optional): 仅处理这些images.id；为None时处理全部待索引图片。
+            batch_size (int): 批量编码大小。
+            persist (bool): 是否立即将索引写回文件。
+
+        Returns:
+            int: 新加入索引的向量数量。
+        """
+        if image_ids is not None and not image_ids:
+            return 0
+        dedup.prepare_images(self.db_path, phash_max_distance=self.phash_max_distance)
+        with database.transaction(self.db_path) as conn:
+            # canonical图片已在索引中的新图片直接共用其向量
+            shared = conn.execute(
+                "UPDATE images SET embedding_id = canonical_id "
+                "WHERE download_status = 'completed' AND embedding_id IS NULL AND canonical_id IS NOT NULL AND id != canonical_id "
+                "AND canonical_id IN (SELECT embedding_id FROM images WHERE embedding_id IS NOT NULL)"
+            ).rowcount
+
+        query = ("SELECT id, local_path FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL "
+                 "AND embedding_id IS NULL AND id = canonical_id")
+        params = ()
+        if image_ids is not None:
+            query += f" AND id IN (SELECT canonical_id FROM images WHERE id IN ({','.join('?' for _ in image_ids)}))"
+            params = tuple(image_ids)
+        cursor = database.get_connection(self.db_path).cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        if not rows:
+            if shared:
+                self.metadata.reload()
+            return 0
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        embeddings, failed = self.embedder.encode_images([row[1] for row in rows], batch_size=batch_size)
+        self._remove_from_index('image', ids)  # 变更过的图片先删除旧向量
+        self._add_to_index('image', embeddings[~failed], ids[~failed])
+        self.image_store.update(ids[~failed], embeddings[~failed], remove_ids=ids)
+        with database.transaction(self.db_path) as conn:
+            # 整组重复图片共用canonical图片的向量
+            conn.executemany("UPDATE images SET embedding_id = canonical_id WHERE canonical_id = ? AND download_status = 'completed'",
+                             [(int(i),) for i in ids[~failed]])
+            conn.executemany("UPDATE images SET download_status = 'failed', embedding_id = NULL WHERE id = ?", [(int(i),) for i in ids[failed]])
+            # 组内其余图片重新分组，下次更新时另选canonical
+            conn.executemany("UPDATE images SET canonical_id = NULL WHERE canonical_id = ?", [(int(i),) for i in ids[failed]])
+        if persist:
+            self._save_index('image')
+        self.metadata.reload()
+        logger.info(f"图片索引增量更新完成：新增 {int((~failed).sum())} 个向量，{shared} 张重复图片共用已有向量，"
+                    f"{int(failed.sum())} 张图片无法处理。")
+        return int((~failed).sum())
+
+    def add_ads(self, ad_ids: List[int] = None, batch_size: int = 32, persist: bool = True) -> int:
+        """
+        只为新增或变更的广告 (text_embedding_id为空) 切分段落、生成文本向量并加入文本索引。
+
+        Args:
+            ad_ids (List[int], optional): 仅处理这些advertisements.id；为None时处理全部待索引广告。
+            batch_size (int): 批量编码大小。
+            persist (bool): 是否立即将索引写回文件。
+
+        Returns:
+            int: 新加入索引的段落向量数量。
+        """
+        query = "SELECT id, title, background, insight, creative FROM advertisements WHERE text_embedding_id IS NULL"
+        params = ()
+        if ad_ids is not None:
+            if not ad_ids:
+                return 0
+            query += f" AND id IN ({','.join('?' for _ in ad_ids)})"
+            params = tuple(ad_ids)
+        cursor = database.get_connection(self.db_path).cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        embeddings, passage_ids, ok_ids = passages.encode_ad_passages(
+            self.embedder, rows, batch_size, self.passage_overlap, self.max_passages_per_ad
+        )
+        self._remove_from_index('text', self._index_ids_for('text', ids))  # 变更过的广告先删除全部旧段落
+        self._add_to_index('text', embeddings, passage_ids)
+        with database.transaction(self.db_path) as conn:
+            conn.executemany("UPDATE advertisements SET text_embedding_id = id WHERE id = ?", [(int(i),) for i in ok_ids])
+        if persist:
+            self._save_index('text')
+        self.metadata.reload()
+        logger.info(f"文本索引增量更新完成：{len(ok_ids)} 条广告，新增 {len(passage_ids)} 个段落向量。")
+        return len(passage_ids)
     
-    def _search(self, index, query_embedding, top_k):
-        """通用搜索函数"""
+    def _search(self, index, query_embedding, top_k, params=None):
+        """通用搜索函数，params为 index_factory.FilteredSearchParams 时只在允许的向量中检索。"""
         if index is None:
             logger.error("索引未加载，无法执行搜索。")
             return np.array([]), np.array([])
-        return index.search(query_embedding, top_k)
-
-    def _get_image_details_for_ads(self, ad_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
-        if not ad_ids: return {}
-        image_details_map = {ad_id: [] for ad_id in ad_ids}
-        placeholders = ','.join('?' for _ in ad_ids)
-        query = f"SELECT ad_id, local_path, embedding_id FROM images WHERE ad_id IN ({placeholders}) AND download_status = 'completed' AND embedding_id IS NOT NULL"
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, tuple(ad_ids))
-            for ad_id, path, emb_id in cursor.fetchall():
-                image_details_map[ad_id].append({"path": path, "embedding_id": emb_id})
-        return image_details_map
-
-    def _fetch_text_ad_results(self, ad_ids: List[int], scores_map: Dict[int, float]) -> List[Dict[str, Any]]:
+        return index.search(query_embedding, top_k, params=params.params if params is not None else None)
+
+    def _search_images(self, query_embedding, top_k, plan: _FilterPlan = None):
+        """检索图片索引。压缩索引多取候选，再用向量存储中的原始向量精确重排。"""
+        if plan is not None and plan.exact_ids is not None:
+            return self._exact_image_search(query_embedding, plan, top_k)
+        index, params = (self.image_index, None) if plan is None else (plan.index, plan.params)
+        if index is None or not index_factory.is_compressed(self.index_params) or not len(self.image_store):
+            return self._search(index, query_embedding, top_k, params)
+        rerank_factor = self.index_params.get('rerank_factor', index_factory.DEFAULT_INDEX_PARAMS['rerank_factor'])
+        return index_factory.search_and_rerank(index, query_embedding, top_k, self.image_store.get, rerank_factor, params)
+
+    def _exact_image_search(self, query_embedding, plan: _FilterPlan, top_k):
+        """用原始向量在过滤后允许的图片向量中精确检索，返回与 index.search 相同格式的 (分数, id)。"""
+        queries = np.atleast_2d(np.asarray(query_embedding, dtype=np.float32))
+        top_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        top_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(plan.exact_ids), _EXACT_SEARCH_CHUNK):
+            ids = plan.exact_ids[start:start + _EXACT_SEARCH_CHUNK]
+            vectors, found = plan.vectors if plan.vectors is not None else self.image_store.get(ids)
+            scores = np.where(found, queries @ vectors.T, -np.inf).astype(np.float32)
+            # 与之前各块的前top_k个合并，只保留合并后的前top_k个
+            scores = np.concatenate([top_scores, scores], axis=1)
+            candidates = np.concatenate([top_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+            top_scores = np.take_along_axis(scores, order, axis=1)
+            top_ids = np.take_along_axis(candidates, order, axis=1)
+        pad = top_k - top_scores.shape[1]
+        if pad > 0:
+            top_scores = np.pad(top_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            top_ids = np.pad(top_ids, ((0, 0), (0, pad)), constant_values=-1)
+        return top_scores, np.where(np.isfinite(top_scores), top_ids, -1)
+
+    @staticmethod
+    def _as_filter(filters: Union[SearchFilter, Dict[str, Any], None]) -> Optional[SearchFilter]:
+        """接受SearchFilter或等价的字典 (见 SearchFilter.from_dict)，没有条件时返回None。"""
+        if filters is None or isinstance(filters, SearchFilter):
+            return None if filters is None or filters.is_empty() else filters
+        return SearchFilter.from_dict(filters)
+
+    def _filter_plan(self, search_filter: Optional[SearchFilter], target: str, metadata) -> Optional[_FilterPlan]:
+        """
+        返回过滤条件针对目标索引的检索计划，同一条件在元数据与索引不变时只编译一次。
+
+        Args:
+            search_filter (SearchFilter, optional): 过滤条件，为None时返回None。
+            target (str): 'image' 或 'text'。
+            metadata (MetadataTables): 元数据快照。
+        """
+        if search_filter is None:
+            return None
+        key = (search_filter.key(), target, metadata.version, self.index_version)
+        with self._filter_lock:
+            plan = self._filter_plans.get(key)
+            if plan is not None:
+                self._filter_plans.move_to_end(key)
+                return plan
+        plan = self._compile_filter_plan(search_filter, target, metadata)
+        with self._filter_lock:
+            self._filter_plans[key] = plan
+            while len(self._filter_plans) > 64:
+                self._filter_plans.popitem(last=False)
+        return plan
+
+    def _groups_for(self, index_type: str, index):
+        """索引内部位置 -> 过滤分组 (图片索引为向量id，文本索引为段落所属的广告id)，每个索引版本计算一次。"""
+        with self._filter_lock:
+            if index_type not in self._position_groups:
+                id_groups = passages.passage_ad_ids if index_type == 'text' else None
+                self._position_groups[index_type] = index_factory.position_groups(index, id_groups)
+            return self._position_groups[index_type]
+
+    def _compile_filter_plan(self, search_filter: SearchFilter, target: str, metadata) -> _FilterPlan:
+        ad_mask = metadata.ad_filter_mask(search_filter)
+        if target == 'text':
+            index = self.text_index
+            if index is None or not ad_mask.any():
+                return _FilterPlan(index, ad_mask, empty=True)
+            groups = self._groups_for('text', index)
+            # 旧版无显式id的文本索引无法换算到广告，只能在聚合时过滤
+            params = index_factory.filtered_search_params(index, ad_mask, groups) if groups is not None else None
+            return _FilterPlan(index, ad_mask, params)
+
+        index = self.image_index
+        emb_mask = metadata.embedding_filter_mask(ad_mask)
+        allowed = int(emb_mask.sum())
+        if index is None or not allowed:
+            return _FilterPlan(index, ad_mask, empty=True)
+        supported = index_factory.supports_selector(index)
+        if len(self.image_store) and (allowed <= self.filter_exact_threshold or not supported):
+            exact_ids = np.flatnonzero(emb_mask)
+            # 少量向量直接缓存在计划中，每次查询只剩一次矩阵乘法
+            vectors = self.image_store.get(exact_ids) if allowed <= self.filter_exact_threshold else None
+            return _FilterPlan(index, ad_mask, exact_ids=exact_ids, vectors=vectors)
+        if not supported:
+            logger.warning("当前图片索引不支持ID选择器且缺少原始向量存储，过滤条件只能在检索后应用，结果可能少于top_k。")
+            return _FilterPlan(index, ad_mask)
+        return _FilterPlan(index, ad_mask, index_factory.filtered_search_params(index, emb_mask, self._groups_for('image', index)))
+
+    def _fetch_text_ad_results(self, ad_ids: List[int], scores_map: Dict[int, float], metadata) -> List[Dict[str, Any]]:
         if not ad_ids: return []
-        placeholders = ','.join('?' for _ in ad_ids)
-        ads_query = f"SELECT id, title, creative FROM advertisements WHERE id IN ({placeholders})"
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(ads_query, tuple(ad_ids))
-            ad_data_map = {row[0]: {'title': row[1], 'text': row[2]} for row in cursor.fetchall()}
+        exists = metadata.has_ads(ad_ids)
         return [{
             "ad_id": ad_id, "score": scores_map.get(ad_id, 0),
-            "title": ad_data_map[ad_id]['title'], "text": ad_data_map[ad_id]['text']
-        } for ad_id in ad_ids if ad_id in ad_data_map]
-
-    def _finalize_results(self, ad_ids, ad_scores, query_embedding):
-        results_with_text = self._fetch_text_ad_results(ad_ids, ad_scores)
-        image_details_map = self._get_image_details_for_ads(ad_ids)
-        for result in results_with_text:
-            ad_id = result["ad_id"]
-            ad_images = image_details_map.get(ad_id, [])
-            if not ad_images:
+            "title": metadata.ad_titles[ad_id], "text": metadata.ad_texts[ad_id]
+        } for ad_id, ok in zip(ad_ids, exists) if ok]
+
+    def _best_image_per_ad(self, embedding_ids: np.ndarray, counts: np.ndarray, query_embedding) -> np.ndarray:
+        """
+        为每个广告挑选与查询最相似的图片。
+        所有广告的图片向量通过一次gather从向量存储中取出，向量化地一次打分。
+
+        Args:
+            embedding_ids (np.ndarray): 按广告顺序拼接的图片向量id。
+            counts (np.ndarray): 每个广告的图片数量。
+            query_embedding: 查询向量 (1, dim)，或每个广告各自对应的查询向量 (len(counts), dim)。
+
+        Returns:
+            np.ndarray: 每个广告最佳图片在其图片列表中的下标，无图片的广告为-1。
+        """
+        if not len(embedding_ids):
+            return np.full(len(counts), -1)
+        groups = np.repeat(np.arange(len(counts)), counts)
+        if len(self.image_store):
+            vectors, found = self.image_store.get(embedding_ids)
+            queries = np.atleast_2d(np.asarray(query_embedding, dtype=np.float32))
+            if len(queries) == 1:
+                similarities = vectors @ queries[0]
+            else:
+                similarities = np.einsum('ij,ij->i', vectors, queries[groups])
+            similarities = np.where(found, similarities, -np.inf)
+        else:
+            similarities = np.zeros(len(embedding_ids), dtype=np.float32)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        # 组内按相似度降序的稳定排序，每组第一个即为最佳图片 (并列时取靠前者)
+        order = np.lexsort((-similarities, groups))
+        best = np.full(len(counts), -1)
+        has_images = counts > 0
+        best[has_images] = order[starts[has_images]] - starts[has_images]
+        return best
+
+    def _finalize_results(self, ad_ids, ad_scores, query_embedding, metadata, trace=NULL_TRACE):
+        return self._finalize_batch([ad_ids], [ad_scores], query_embedding, metadata, trace)[0]
+
+    def _finalize_batch(self, ad_id_lists, ad_score_maps, query_embeddings, metadata, trace=NULL_TRACE):
+        """
+        为一批查询组装结果：所有查询命中的广告一起展开图片并挑选代表图片。
+
+        Args:
+            ad_id_lists: 每个查询按分数降序的广告id列表。
+            ad_score_maps: 每个查询的 {ad_id: score}。
+            query_embeddings: 与查询一一对应的 (N, dim) 查询向量。
+            metadata (MetadataTables): 元数据快照。
+            trace (QueryTrace, optional): 本次搜索的计时，记录 metadata/representative/assemble 三个阶段。
+
+        Returns:
+            List[List[Dict[str, Any]]]: 每个查询的结果列表。启用缩略图时每条结果还包含
+            representative_thumbnail (最大一档) 与 other_thumbnails (最小一档)，与原图路径一一对应。
+        """
+        with trace.stage('metadata'):
+            per_query = [self._fetch_text_ad_results(ad_ids, ad_scores, metadata) for ad_ids, ad_scores in zip(ad_id_lists, ad_score_maps)]
+            flat = [result for results in per_query for result in results]
+            counts, embedding_ids, path_idx = metadata.images_for_ads([result["ad_id"] for result in flat])
+        with trace.stage('representative'):
+            owners = np.repeat(np.arange(len(per_query)), [len(results) for results in per_query])
+            queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+            best_indices = self._best_image_per_ad(embedding_ids, counts, queries[owners] if len(queries) > 1 else queries)
+        with trace.stage('assemble'):
+            self._assemble_results(flat, counts, best_indices, metadata.paths[path_idx])
+        return per_query
+
+    def _assemble_results(self, flat, counts, best_indices, paths):
+        """按挑选出的代表图片为每条结果填入图片路径 (以及缩略图路径)。"""
+        offsets = np.cumsum(counts) - counts
+        for result, offset, count, best_image_idx in zip(flat, offsets, counts, best_indices):
+            if best_image_idx < 0:
                 result["representative_image"] = None
                 result["other_images"] = []
+                if self.thumbnail_store is not None:
+                    result["representative_thumbnail"] = None
+                    result["other_thumbnails"] = []
                 continue
-            emb_ids = [img['embedding_id'] for img in ad_images]
-            image_embeddings = np.array([self.image_index.reconstruct(int(eid)) for eid in emb_ids])
-            similarities = np.dot(image_embeddings, query_embedding.flatten())
-            best_image_idx = np.argmax(similarities)
-            result["representative_image"] = ad_images[best_image_idx]["path"]
-            result["other_images"] = [img["path"] for i, img in enumerate(ad_images) if i != best_image_idx]
-        return results_with_text
-
-    def _search_image_index_and_process(self, query_embedding, top_k):
-        distances, ids = self._search(self.image_index, query_embedding, top_k * 5)
+            ad_paths = paths[offset:offset + count].tolist()
+            result["representative_image"] = ad_paths.pop(best_image_idx)
+            result["other_images"] = ad_paths
+            if self.thumbnail_store is not None:
+                # 只计算路径，不访问文件系统；缺失的缩略图由展示端按需补生成
+                sizes = self.thumbnail_store.sizes
+                result["representative_thumbnail"] = self.thumbnail_store.path_for(result["representative_image"], sizes[-1])
+                result["other_thumbnails"] = [self.thumbnail_store.path_for(path, sizes[0]) for path in ad_paths]
+
+    def _search_image_index_and_process(self, query_embedding, top_k, metadata, trace=NULL_TRACE, plan: _FilterPlan = None):
+        # 索引使用内积打分，分数越大越相似，结果已按分数降序排列
+        with trace.stage('index_search'):
+            distances, ids = self._search_images(query_embedding, top_k * 5, plan)
         if not ids.size: return [], {}
-        embedding_ids = [int(i) for i in ids[0]]
-        placeholders = ','.join('?' for _ in embedding_ids)
-        query = f"SELECT embedding_id, ad_id FROM images WHERE embedding_id IN ({placeholders})"
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, tuple(embedding_ids))
-            image_to_ad_map = dict(cursor.fetchall())
-        ad_scores = {}
-        for emb_id, score in zip(embedding_ids, distances[0]):
-            ad_id = image_to_ad_map.get(emb_id)
-            if ad_id and (ad_id not in ad_scores or score > ad_scores[ad_id]):
-                ad_scores[ad_id] = score
-        sorted_ad_ids = sorted(ad_scores, key=ad_scores.get, reverse=True)
+        with trace.stage('aggregate'):
+            return self._image_hits_to_ads(distances[0], ids[0], top_k, metadata, plan)
+
+    def _image_hits_to_ads(self, distances, ids, top_k, metadata, plan: _FilterPlan = None):
+        """
+        将一个查询的图片检索结果 (已按分数降序) 聚合为广告，每个广告取其最高分。
+        重复图片在索引中只有一个向量，这里展开为使用它的全部广告，因而不再占用多个检索名额；
+        有过滤条件时去掉共用同一图片但不满足条件的广告。
+        """
+        hit_idx, ad_ids = metadata.ads_for_embeddings(ids)
+        if plan is not None:
+            keep = plan.ad_mask[ad_ids]
+            hit_idx, ad_ids = hit_idx[keep], ad_ids[keep]
+        scores = distances[hit_idx]
+        # 每个广告首次出现的位置即其最高分，按该位置排序保持分数降序
+        unique_ad_ids, first = np.unique(ad_ids, return_index=True)
+        order = np.argsort(first)
+        sorted_ad_ids = unique_ad_ids[order].tolist()
+        ad_scores = dict(zip(sorted_ad_ids, scores[first[order]].tolist()))
         return sorted_ad_ids[:top_k], ad_scores
 
-    def _search_text_index_and_process(self, query_embedding, top_k):
-        distances, ids = self._search(self.text_index, query_embedding, top_k)
-        if not ids.size: return [], {}
-        ad_ids = [int(i) + 1 for i in ids[0]]
-        ad_scores = {int(i) + 1: s for i, s in zip(ids[0], distances[0])}
+    def _search_text_index_and_process(self, query_embedding, top_k, trace=NULL_TRACE, plan: _FilterPlan = None):
+        return self._search_text_ads(query_embedding, top_k, trace, plan)[0]
+
+    def _search_text(self, query_embedding, top_k, plan: _FilterPlan = None):
+        if plan is None:
+            return self._search(self.text_index, query_embedding, top_k)
+        return self._search(plan.index, query_embedding, top_k, plan.params)
+
+    def _text_passages_per_ad(self, index) -> int:
+        """文本检索时为每个需要的广告取的段落数：索引中平均每条广告的段落数 (向上取整，至少5，至多max_passages_per_ad)。"""
+        if self._passages_per_ad is None:
+            num_ads = len(np.unique(passages.passage_ad_ids(index_factory.list_ids(index)))) if index.ntotal else 0
+            average = -(-index.ntotal // num_ads) if num_ads else 1
+            self._passages_per_ad = int(min(self.max_passages_per_ad, max(5, average)))
+        return self._passages_per_ad
+
+    def _search_text_ads(self, query_matrix, num_ads, trace=NULL_TRACE, plan: _FilterPlan = None):
+        """
+        检索文本索引并按广告聚合，返回每个查询的 (广告id列表, {ad_id: score})，每个查询最多num_ads个广告。
+
+        一条广告有多个段落，按平均每条广告的段落数多取段落；少数段落很多的广告占满候选、
+        聚合后不足num_ads个广告时，只对这些查询加大段落数重新检索，直到凑满或取完整个索引。
+        """
+        index = self.text_index if plan is None else plan.index
+        if index is None:
+            logger.error("索引未加载，无法执行搜索。")
+            return [([], {})] * len(query_matrix)
+        k = min(index.ntotal, num_ads * self._text_passages_per_ad(index))
+        hits = [([], {})] * len(query_matrix)
+        rows = np.arange(len(query_matrix))
+        while len(rows) and k > 0:
+            with trace.stage('index_search'):
+                distances, ids = self._search_text(np.ascontiguousarray(query_matrix[rows]), k, plan)
+            short = []
+            with trace.stage('aggregate'):
+                for row, row_distances, row_ids in zip(rows, distances, ids):
+                    hits[row] = self._text_hits_to_ads(row_distances, row_ids, num_ads, plan)
+                    # 结果已填满k个段落 (末位不是-1) 说明索引中还有更多段落
+                    if len(hits[row][0]) < num_ads and row_ids[-1] >= 0:
+                        short.append(row)
+            if k >= index.ntotal:
+                break
+            rows, k = np.array(short, dtype=np.int64), min(index.ntotal, k * 4)
+        return hits
+
+    @staticmethod
+    def _text_hits_to_ads(distances, ids, top_k, plan: _FilterPlan = None):
+        # 文本索引的id为段落id，每个广告取最佳段落的分数，-1表示结果不足
+        ad_ids, ad_scores = passages.best_passage_per_ad(distances, ids, top_k)
+        if plan is not None:
+            # 选择器已在索引内部过滤；这里只为无法使用选择器的旧版索引兜底
+            ad_ids = [ad_id for ad_id in ad_ids if ad_id < len(plan.ad_mask) and plan.ad_mask[ad_id]]
         return ad_ids, ad_scores
 
-    def image_to_image_search(self, image_path: str, top_k: int = 10):
-        query_embedding = self.embedder.encode_image(image_path)
-        if query_embedding is None: return []
-        query_embedding_np = query_embedding.cpu().numpy()
-        top_ad_ids, ad_scores = self._search_image_index_and_process(query_embedding_np, top_k)
-        return self._finalize_results(top_ad_ids, ad_scores, query_embedding_np)
-
-    def text_to_image_search(self, text: str, top_k: int = 10):
-        query_embedding = self.embedder.encode_text(text)
-        if query_embedding is None: return []
-        query_embedding_np = query_embedding.cpu().numpy()
-        top_ad_ids, ad_scores = self._search_image_index_and_process(query_embedding_np, top_k)
-        return self._finalize_results(top_ad_ids, ad_scores, query_embedding_np)
-
-    def image_to_text_search(self, image_path: str, top_k: int = 10):
-        query_embedding = self.embedder.encode_image(image_path)
-        if query_embedding is None: return []
-        query_embedding_np = query_embedding.cpu().numpy()
-        top_ad_ids, ad_scores = self._search_text_index_and_process(query_embedding_np, top_k)
-        return self._finalize_results(top_ad_ids, ad_scores, query_embedding_np)
-
-    def text_to_text_search(self, text: str, top_k: int = 10):
-        query_embedding = self.embedder.encode_text(text)
-        if query_embedding is None: return []
-        query_embedding_np = query_embedding.cpu().numpy()
-        top_ad_ids, ad_scores = self._search_text_index_and_process(query_embedding_np, top_k)
-        return self._finalize_results(top_ad_ids, ad_scores, query_embedding_np) 
\ No newline at end of file
+    def _encode_query(self, kind: str, query, content_key: str = None):
+        """
+        生成查询向量，启用缓存时先查缓存，命中则跳过模型计算。
+
+        Args:
+            kind (str): 'text' 或 'image'。
+            query: 文本，或图片文件路径/上传的文件对象。
+            content_key (str, optional): 已计算好的查询内容键 (见 embedding_cache.query_key)。
+
+        Returns:
+            np.ndarray: (1, dim) 的float32向量，生成失败时返回None。
+        """
+        encode_fn = self.embedder.encode_text if kind == 'text' else self.embedder.encode_image
+        key = None
+        if self.embedding_cache is not None:
+            key = self.embedding_cache.make_key(kind, content_key or query_key(kind, query))
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached
+        query_embedding = encode_fn(query)
+        if query_embedding is None:
+            return None
+        query_embedding_np = query_embedding.cpu().numpy().astype(np.float32)
+        if key is not None:
+            self.embedding_cache.put(key, query_embedding_np)
+        return query_embedding_np
+
+    def encode_text_query(self, text: str):
+        """生成文本查询向量 (带缓存)。"""
+        return self._encode_query('text', text)
+
+    def encode_image_query(self, image):
+        """生成图片查询向量 (带缓存)，image可以是文件路径或上传的文件对象。"""
+        return self._encode_query('image', image)
+
+    def _trace(self, mode: str, query, num_queries: int = 1):
+        """开始一次搜索的分阶段计时，未配置统计时返回空实现。"""
+        if self.metrics is None:
+            return NULL_TRACE
+        return self.metrics.trace(mode, query, num_queries)
+
+    def _run_search(self, mode: str, query, top_k: int, filters=None):
+        """
+        四种搜索模式的公共流程：查结果缓存 -> 生成查询向量 -> 检索对应索引 -> 组装结果。
+
+        Args:
+            mode (str): 'image_to_image'、'text_to_image'、'image_to_text' 或 'text_to_text'。
+            query: 文本，或图片文件路径/上传的文件对象。
+            top_k (int): 返回的广告数量。
+            filters (SearchFilter | dict, optional): 过滤条件，在索引检索过程中应用。
+        """
+        search_filter = self._as_filter(filters)
+        trace = self._trace(mode, query)
+        try:
+            kind, target = mode.split('_to_')
+            with trace.stage('cache_lookup'):
+                content_key = None
+                if self.embedding_cache is not None or self.result_cache is not None:
+                    content_key = query_key(kind, query)
+                metadata = self.metadata.refresh_if_changed()
+                cache_key = None
+                if self.result_cache is not None:
+                    cache_key = (mode, content_key, top_k, self.index_version, metadata.version, self._filter_key(search_filter))
+                    cached = self.result_cache.get(cache_key)
+                    if cached is not None:
+                        return cached
+            with trace.stage('filter'):
+                plan = self._filter_plan(search_filter, target, metadata)
+            if plan is not None and plan.empty:
+                return []
+
+            with trace.stage('encode'):
+                query_embedding_np = self._encode_query(kind, query, content_key)
+            if query_embedding_np is None: return []
+            if target == 'image':
+                top_ad_ids, ad_scores = self._search_image_index_and_process(query_embedding_np, top_k, metadata, trace, plan)
+            else:
+                top_ad_ids, ad_scores = self._search_text_index_and_process(query_embedding_np, top_k, trace, plan)
+            results = self._finalize_results(top_ad_ids, ad_scores, query_embedding_np, metadata, trace)
+            if cache_key is not None:
+                self.result_cache.put(cache_key, results)
+            return results
+        finally:
+            trace.finish()
+
+    @staticmethod
+    def _filter_key(search_filter: Optional[SearchFilter]):
+        return None if search_filter is None else search_filter.key()
+
+    def image_to_image_search(self, image_path: str, top_k: int = 10, filters=None):
+        return self._run_search('image_to_image', image_path, top_k, filters)
+
+    def text_to_image_search(self, text: str, top_k: int = 10, filters=None):
+        return self._run_search('text_to_image', text, top_k, filters)
+
+    def image_to_text_search(self, image_path: str, top_k: int = 10, filters=None):
+        return self._run_search('image_to_text', image_path, top_k, filters)
+
+    def text_to_text_search(self, text: str, top_k: int = 10, filters=None):
+        return self._run_search('text_to_text', text, top_k, filters)
+
+    def hybrid_search(self, text: str, top_k: int = 10, filters=None):
+        """关键词 (BM25) 与文本向量的混合检索，品牌名、活动标题等精确查询的效果好于纯向量检索。"""
+        return self.batch_search([text], mode=HYBRID_MODE, top_k=top_k, filters=filters)[0]
+
+    def _lexical_pool(self) -> ThreadPoolExecutor:
+        if self._lexical_executor is None:
+            self._lexical_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lexical")
+        return self._lexical_executor
+
+    def _lexical_hits(self, texts: List[str], limit: int, trace, plan: _FilterPlan = None):
+        """在工作线程中逐条执行BM25检索 (使用该线程自己的数据库连接)。"""
+        with trace.stage('lexical'):
+            conn = database.get_connection(self.db_path)
+            if not lexical.has_index(conn):
+                return [([], {})] * len(texts)
+            ad_mask = plan.ad_mask if plan is not None else None
+            return [lexical.search(conn, text, limit, ad_mask) for text in texts]
+
+    def batch_search(self, queries: List[Any], mode: str = 'text_to_image', top_k: int = 10, batch_size: int = 64,
+                     filters=None) -> List[List[Dict[str, Any]]]:
+        """
+        批量搜索，用于离线任务。查询向量按批生成，每种索引只做一次多行检索，
+        元数据与代表图片为整批查询一起解析。
+
+        Args:
+            queries (List[Any]): 文本列表 (text_to_*) 或图片文件路径列表 (image_to_*)。
+            mode (str): 'image_to_image'、'text_to_image'、'image_to_text'、'text_to_text' 或 'hybrid'。
+            top_k (int): 每个查询返回的广告数量。
+            batch_size (int): 生成查询向量时每次前向计算的数量。
+            filters (SearchFilter | dict, optional): 整批查询共用的过滤条件，在索引检索过程中应用。
+
+        Returns:
+            List[List[Dict[str, Any]]]: 与queries一一对应的结果列表，向量生成失败的查询结果为空列表。
+        """
+        if mode == HYBRID_MODE:
+            kind, target = 'text', 'text'
+        else:
+            kind, _, target = mode.partition('_to_')
+        if kind not in ('text', 'image') or target not in ('text', 'image'):
+            raise ValueError(f"不支持的搜索模式: {mode}")
+        search_filter = self._as_filter(filters)
+        # 整批计时一次，各模式的分位数中每个查询都计入这一批的耗时
+        trace = self._trace(mode, queries, len(queries))
+        try:
+            return self._run_batch(queries, mode, kind, target, top_k, batch_size, trace, search_filter)
+        finally:
+            trace.finish()
+
+    def _run_batch(self, queries, mode, kind, target, top_k, batch_size, trace, search_filter=None):
+        """batch_search 的实现，各阶段耗时记录到trace。"""
+        filter_key = self._filter_key(search_filter)
+        with trace.stage('cache_lookup'):
+            metadata = self.metadata.refresh_if_changed()
+            results = [None] * len(queries)
+            content_keys = [None] * len(queries)
+            if self.embedding_cache is not None or self.result_cache is not None:
+                content_keys = [query_key(kind, query) for query in queries]
+
+            # 1. 结果缓存
+            pending = list(range(len(queries)))
+            if self.result_cache is not None:
+                pending = []
+                for i, content_key in enumerate(content_keys):
+                    cached = self.result_cache.get((mode, content_key, top_k, self.index_version, metadata.version, filter_key))
+                    if cached is None:
+                        pending.append(i)
+                    else:
+                        results[i] = cached
+
+        with trace.stage('filter'):
+            plan = self._filter_plan(search_filter, target, metadata)
+        if plan is not None and plan.empty:
+            for i in pending:
+                results[i] = []
+            return results
+
+        # 混合检索：BM25在工作线程中与查询向量生成、向量检索并行执行，每一路多取候选用于融合
+        hybrid = mode == HYBRID_MODE
+        candidates = top_k * 5 if hybrid else top_k
+        lexical_future = None
+        if hybrid and pending:
+            lexical_future = self._lexical_pool().submit(self._lexical_hits, [queries[i] for i in pending], candidates, trace, plan)
+
+        # 2. 查询向量：先查向量缓存，未命中的按批生成
+        with trace.stage('encode'):
+            embeddings = np.zeros((len(pending), self.embedding_dim), dtype=np.float32)
+            failed = np.zeros(len(pending), dtype=bool)
+            to_encode = []
+            for row, i in enumerate(pending):
+                cached = None
+                if self.embedding_cache is not None:
+                    cached = self.embedding_cache.get(self.embedding_cache.make_key(kind, content_keys[i]))
+                if cached is None:
+                    to_encode.append(row)
+                else:
+                    embeddings[row] = cached[0]
+            if to_encode:
+                encode_fn = self.embedder.encode_texts if kind == 'text' else self.embedder.encode_images
+                encoded, encode_failed = encode_fn([queries[pending[row]] for row in to_encode], batch_size=batch_size)
+                embeddings[to_encode] = encoded
+                failed[to_encode] = encode_failed
+                if self.embedding_cache is not None:
+                    for row, vector, bad in zip(to_encode, encoded, encode_failed):
+                        if not bad:
+                            self.embedding_cache.put(self.embedding_cache.make_key(kind, content_keys[pending[row]]), vector)
+        for row in np.flatnonzero(failed):
+            results[pending[row]] = []
+
+        # 3. 一次多行检索，再整批组装结果
+        rows = np.flatnonzero(~failed)
+        hits = []
+        if len(rows):
+            query_matrix = np.ascontiguousarray(embeddings[rows])
+            if target == 'image':
+                with trace.stage('index_search'):
+                    distances, ids = self._search_images(query_matrix, top_k * 5, plan)
+                with trace.stage('aggregate'):
+                    hits = [self._image_hits_to_ads(d, i, top_k, metadata, plan) for d, i in zip(distances, ids)] if ids.size else [([], {})] * len(rows)
+            else:
+                hits = self._search_text_ads(query_matrix, candidates, trace, plan)
+        if lexical_future is not None:
+            lexical_hits = lexical_future.result()
+            with trace.stage('fusion'):
+                # 关键词结果排在前面：融合分数相同时精确命中的广告优先；
+                # 查询向量生成失败的查询只使用关键词结果，而不是返回空列表
+                vector_hits = dict(zip(rows.tolist(), hits))
+                rows = np.arange(len(pending))
+                hits = [lexical.reciprocal_rank_fusion(
+                            [lexical_hits[row][0]] + ([vector_hits[row][0]] if row in vector_hits else []), top_k, self.rrf_k)
+                        for row in rows]
+        if len(rows):
+            batch_results = self._finalize_batch([h[0] for h in hits], [h[1] for h in hits], embeddings[rows], metadata, trace)
+            for row, query_results in zip(rows, batch_results):
+                i = pending[row]
+                results[i] = query_results
+                # 只有关键词结果的查询不缓存，查询向量下次可能生成成功
+                if self.result_cache is not None and not failed[row]:
+                    self.result_cache.put((mode, content_keys[i], top_k, self.index_version, metadata.version, filter_key), query_results)
+        return results
@@ -0,0 +1,174 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from loguru import logger
+from typing import Any, List, Optional, Tuple
+
+from .filters import SearchFilter
+from .micro_batcher import MicroBatcher
+from .search_engine import HYBRID_MODE, SearchEngine
+from .startup import StartupTimer
+
+SEARCH_MODES = ('text_to_image', 'text_to_text', 'image_to_image', 'image_to_text', HYBRID_MODE)
+# 图片模式通过URL参数传入的过滤条件
+FILTER_PARAMS = ('categories', 'min_score', 'max_score', 'published_from', 'published_to')
+
+class SearchService:
+    """
+    基于asyncio的HTTP搜索服务。每种搜索模式一个 MicroBatcher，
+    同一时间窗口内的请求合并为一次 SearchEngine.batch_search (一次批量编码 + 一次多行Faiss检索)。
+    """
+    def __init__(self, search_engine: SearchEngine, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 default_top_k: int = 10, max_top_k: int = 50, startup_timer: StartupTimer = None):
+        """
+        初始化SearchService。
+
+        Args:
+            search_engine (SearchEngine): 搜索引擎实例。
+            max_batch_size (int): 每批最多合并的请求数。
+            max_wait_ms (float): 第一个请求到达后最多等待合并的毫秒数。
+            default_top_k (int): 请求未指定top_k时的默认值。
+            max_top_k (int): 允许的最大top_k。
+            startup_timer (StartupTimer, optional): 启动计时，提供时记录第一次查询返回的时间并在 /stats 中返回。
+        """
+        self.search_engine = search_engine
+        self.startup_timer = startup_timer
+        self.default_top_k = default_top_k
+        self.max_top_k = max_top_k
+        # 模型推理与索引访问都在同一个工作线程中串行执行，事件循环只负责收发请求
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.batchers = {
+            mode: MicroBatcher(self._make_process_fn(mode), self.executor, max_batch_size, max_wait_ms, name=mode)
+            for mode in SEARCH_MODES
+        }
+
+    def _make_process_fn(self, mode: str):
+        def process(items: List[Tuple[Any, int, Optional[SearchFilter]]]):
+            # 同一批请求的top_k可能不同：按最大值检索后再各自截断；过滤条件不同的请求分组检索
+            groups = {}
+            for i, (_, _, search_filter) in enumerate(items):
+                groups.setdefault(search_filter.key() if search_filter is not None else None, []).append(i)
+            results = [None] * len(items)
+            for indices in groups.values():
+                top_k = max(items[i][1] for i in indices)
+                group_results = self.search_engine.batch_search([items[i][0] for i in indices], mode=mode, top_k=top_k,
+                                                                filters=items[indices[0]][2])
+                for i, query_results in zip(indices, group_results):
+                    results[i] = query_results[:items[i][1]]
+            return results
+        return process
+
+    def _parse_top_k(self, value) -> int:
+        try:
+            top_k = int(value) if value is not None else self.default_top_k
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text="top_k必须是整数")
+        return max(1, min(top_k, self.max_top_k))
+
+    @staticmethod
+    def _parse_filters(value) -> Optional[SearchFilter]:
+        try:
+            return SearchFilter.from_dict(value)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+    async def _read_query(self, request: web.Request, mode: str):
+        """
+        解析请求中的查询。
+
+        文本模式 (含hybrid)：JSON请求体 {"query": "...", "top_k": 10, "filters": {...}}。
+        图片模式：multipart表单中的 image 字段，或直接以图片字节作为请求体；top_k与过滤条件通过URL参数传入。
+        过滤条件见 SearchFilter.from_dict，如 {"categories": ["影视"], "min_score": 8, "published_from": "2022"}。
+
+        Returns:
+            Tuple[Any, int, Optional[SearchFilter]]: (查询, top_k, 过滤条件)。
+        """
+        if not mode.startswith('image'):
+            try:
+                body = await request.json()
+            except ValueError:
+                raise web.HTTPBadRequest(text="请求体必须是JSON")
+            query = (body.get('query') or '').strip() if isinstance(body, dict) else ''
+            if not query:
+                raise web.HTTPBadRequest(text="缺少query字段")
+            return query, self._parse_top_k(body.get('top_k', request.query.get('top_k'))), self._parse_filters(body.get('filters'))
+
+        if request.content_type.startswith('multipart/'):
+            data = None
+            async for part in await request.multipart():
+                if part.name == 'image':
+                    data = await part.read()
+                    break
+        else:
+            data = await request.read()
+        if not data:
+            raise web.HTTPBadRequest(text="缺少图片数据")
+        filters = self._parse_filters({name: request.query[name] for name in FILTER_PARAMS if name in request.query})
+        return io.BytesIO(data), self._parse_top_k(request.query.get('top_k')), filters
+
+    async def handle_search(self, request: web.Request) -> web.Response:
+        mode = request.match_info['mode']
+        if mode not in self.batchers:
+            raise web.HTTPNotFound(text=f"不支持的搜索模式: {mode}")
+        query, top_k, filters = await self._read_query(request, mode)
+        results = await self.batchers[mode].submit((query, top_k, filters))
+        if self.startup_timer is not None:
+            self.startup_timer.mark_first_query()
+        return web.json_response({'mode': mode, 'top_k': top_k, 'results': results})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        engine = self.search_engine
+        return web.json_response({
+            'status': 'ok',
+            'image_vectors': engine.image_index.ntotal if engine.image_index is not None else 0,
+            'text_vectors': engine.text_index.ntotal if engine.text_index is not None else 0,
+        })
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        engine = self.search_engine
+        stats = {'batchers': {mode: batcher.stats() for mode, batcher in self.batchers.items()}}
+        if engine.embedding_cache is not None:
+            stats['embedding_cache'] = engine.embedding_cache.stats()
+        if engine.result_cache is not None:
+            stats['result_cache'] = engine.result_cache.stats()
+        if self.startup_timer is not None:
+            stats['startup'] = self.startup_timer.summary()
+        if engine.metrics is not None:
+            stats['latency'] = engine.metrics.snapshot()
+        return web.json_response(stats)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        metrics = self.search_engine.metrics
+        if metrics is None:
+            raise web.HTTPNotFound(text="未启用搜索耗时统计")
+        return web.Response(body=metrics.to_prometheus().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def _on_startup(self, app: web.Application):
+        for batcher in self.batchers.values():
+            batcher.start()
+        logger.info("搜索服务已启动。")
+
+    async def _on_cleanup(self, app: web.Application):
+        for batcher in self.batchers.values():
+            await batcher.stop()
+        self.executor.shutdown(wait=True)
+
+    def create_app(self) -> web.Application:
+        """
+        创建aiohttp应用。
+
+        路由：
+            POST /search/{mode}  mode为 text_to_image / text_to_text / image_to_image / image_to_text / hybrid
+            GET  /health
+            GET  /stats          微批处理、缓存与搜索耗时统计
+            GET  /metrics        Prometheus文本格式的各模式/阶段耗时分位数
+        """
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_post('/search/{mode}', self.handle_search)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_get('/stats', self.handle_stats)
+        app.router.add_get('/metrics', self.handle_metrics)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
@@ -0,0 +1,69 @@
+import time
+import threading
+from contextlib import contextmanager
+from loguru import logger
+from typing import Dict, Optional
+
+# 启动模式：
+# - lazy:  以内存映射方式打开索引，模型在后台线程中加载，进程启动后即可开始接收请求
+#          (模型加载完成前到来的查询会等待加载完成)
+# - eager: 启动时完整读取索引并同步加载全部编码塔，第一次查询无额外等待
+STARTUP_MODES = ('lazy', 'eager')
+
+class StartupTimer:
+    """
+    记录进程启动各阶段的耗时，以及从启动到第一次查询返回的时间。
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.first_query_s: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个启动阶段的耗时，同名阶段的耗时累加。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def elapsed(self) -> float:
+        """从计时开始到现在的秒数。"""
+        return time.perf_counter() - self.start
+
+    def mark_first_query(self) -> bool:
+        """
+        记录第一次查询返回的时间，只有第一次调用生效。
+
+        Returns:
+            bool: 本次调用是否为第一次查询。
+        """
+        if self.first_query_s is not None:
+            return False
+        with self._lock:
+            if self.first_query_s is not None:
+                return False
+            self.first_query_s = self.elapsed()
+        logger.info(f"启动后第一次查询完成，距启动 {self.first_query_s:.3f}s。")
+        return True
+
+    def summary(self) -> Dict[str, object]:
+        """返回各阶段耗时 (秒)、总耗时与首次查询时间。"""
+        with self._lock:
+            return {
+                'stages': dict(self.stages),
+                'ready_s': sum(self.stages.values()),
+                'first_query_s': self.first_query_s,
+            }
+
+    def report(self, title: str = "启动耗时"):
+        """将各阶段耗时输出到日志。"""
+        summary = self.summary()
+        lines = [f"  {name:<16}{seconds * 1000:>10.1f} ms" for name, seconds in summary['stages'].items()]
+        lines.append(f"  {'total':<16}{summary['ready_s'] * 1000:>10.1f} ms")
+        logger.info(f"{title}:\n" + "\n".join(lines))
+        return summary
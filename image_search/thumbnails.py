@@ -0,0 +1,96 @@
+import os
+import hashlib
+from PIL import Image
+from loguru import logger
+from typing import Dict, Optional, Sequence
+
+class ThumbnailStore:
+    """
+    展示用缩略图的存储。每张原图按长边尺寸生成若干档WebP缩略图，
+    文件名由原图路径的哈希得出，无需在数据库中记录。
+
+    缩略图在下载时 (见 StreamedImageWriter) 或由 scripts/build_thumbnails.py 预先生成，
+    展示时按需要的尺寸取最接近的一档；缺失时才从原图补生成。
+    """
+    def __init__(self, root_dir: str, sizes: Sequence[int] = (256,), quality: int = 80):
+        """
+        初始化ThumbnailStore。
+
+        Args:
+            root_dir (str): 缩略图根目录。
+            sizes (Sequence[int]): 生成的缩略图长边尺寸 (像素)。
+            quality (int): WebP压缩质量。
+        """
+        self.root_dir = root_dir
+        self.sizes = tuple(sorted(sizes))
+        self.quality = quality
+
+    def bucket(self, size: int) -> int:
+        """返回不小于size的最小一档尺寸，超过最大档时返回最大档。"""
+        for bucket in self.sizes:
+            if bucket >= size:
+                return bucket
+        return self.sizes[-1]
+
+    def path_for(self, image_path: str, size: int) -> str:
+        """返回原图在指定尺寸下的缩略图路径 (不检查文件是否存在)。"""
+        digest = hashlib.sha1(os.path.abspath(image_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.root_dir, str(self.bucket(size)), digest[:2], f"{digest}.webp")
+
+    def save(self, image_path: str, image: Image.Image) -> Dict[int, str]:
+        """
+        由已解码的图片生成全部尺寸的缩略图。
+
+        Args:
+            image_path (str): 原图路径，用于确定缩略图文件名。
+            image (Image.Image): 已解码的原图。
+
+        Returns:
+            Dict[int, str]: {尺寸: 缩略图路径}。
+        """
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        paths = {}
+        # 从大到小依次缩放，每次在上一级结果上缩小，减少重采样的计算量
+        current = image
+        for size in sorted(self.sizes, reverse=True):
+            path = self.path_for(image_path, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if max(current.size) > size:
+                current = current.copy()
+                current.thumbnail((size, size), Image.LANCZOS)
+            tmp_path = path + '.tmp'
+            current.save(tmp_path, 'WEBP', quality=self.quality, method=4)
+            os.replace(tmp_path, path)
+            paths[size] = path
+        return paths
+
+    def generate(self, image_path: str) -> Optional[Dict[int, str]]:
+        """
+        从原图文件生成全部档位的缩略图。
+
+        Returns:
+            Optional[Dict[int, str]]: {尺寸: 缩略图路径}，原图不存在或无法解码时返回None。
+        """
+        try:
+            with Image.open(image_path) as image:
+                # JPEG可在解码时直接按1/2~1/8缩小，大幅减少大海报的解码时间
+                image.draft('RGB', (self.sizes[-1], self.sizes[-1]))
+                image.load()
+                return self.save(image_path, image)
+        except Exception as e:
+            logger.warning(f"生成缩略图失败: {image_path}, 错误: {e}")
+            return None
+
+    def ensure(self, image_path: str, size: int) -> Optional[str]:
+        """
+        返回原图在指定尺寸档位的缩略图路径，缺失时从原图生成。
+
+        Returns:
+            Optional[str]: 缩略图路径，原图不存在或无法解码时返回None。
+        """
+        path = self.path_for(image_path, size)
+        if os.path.exists(path):
+            return path
+        paths = self.generate(image_path)
+        return paths[self.bucket(size)] if paths else None
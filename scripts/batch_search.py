@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import argparse
+from tqdm import tqdm
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search.embedding_generator import EmbeddingGenerator
+from image_search.search_engine import SearchEngine
+from config import (
+    DATABASE_PATH,
+    IMAGE_INDEX_PATH,
+    TEXT_INDEX_PATH,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
+    CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
+    EMBEDDING_DIM,
+    ENCODE_BATCH_SIZE,
+    ENCODE_NUM_WORKERS,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    DEFAULT_TOP_K,
+    setup_logging
+)
+
+SEARCH_MODES = ('text_to_image', 'text_to_text', 'image_to_image', 'image_to_text')
+
+def iter_query_chunks(path, chunk_size):
+    """逐行读取查询文件 (每行一个查询文本或图片路径，跳过空行)，按块返回。"""
+    chunk = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            query = line.strip()
+            if not query:
+                continue
+            chunk.append(query)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def main():
+    """
+    批量搜索：
+    1. 初始化模块。
+    2. 按块读取查询文件，每块调用一次 SearchEngine.batch_search。
+    3. 每个查询输出一行JSON ({"query": ..., "results": [...]})，边搜索边写出。
+    """
+    parser = argparse.ArgumentParser(description="从文件批量读取查询并以JSONL格式输出搜索结果")
+    parser.add_argument("input", help="查询文件，每行一个查询文本 (text_to_*) 或图片路径 (image_to_*)")
+    parser.add_argument("--mode", choices=SEARCH_MODES, default="text_to_image", help="搜索模式")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="每个查询返回的广告数量")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="每次batch_search处理的查询数")
+    parser.add_argument("--output", help="输出的JSONL文件路径，默认输出到标准输出")
+    args = parser.parse_args()
+
+    setup_logging()
+
+    # 1. 初始化
+    embedder = EmbeddingGenerator(
+        model_name=CLIP_MODEL_NAME, num_workers=ENCODE_NUM_WORKERS,
+        backend=INFERENCE_BACKEND, onnx_dir=ONNX_MODEL_DIR,
+        drift_report=INFERENCE_DRIFT_REPORT, max_drift=INFERENCE_MAX_DRIFT,
+        towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR
+    )
+    search_engine = SearchEngine(
+        embedding_generator=embedder,
+        embedding_dim=EMBEDDING_DIM,
+        db_path=DATABASE_PATH,
+        image_index_path=IMAGE_INDEX_PATH,
+        text_index_path=TEXT_INDEX_PATH,
+        index_backend=INDEX_BACKEND,
+        index_params=INDEX_PARAMS,
+        passage_overlap=TEXT_PASSAGE_OVERLAP,
+        max_passages_per_ad=MAX_PASSAGES_PER_AD
+    )
+
+    # 2. 分块搜索并流式写出
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for queries in tqdm(iter_query_chunks(args.input, args.chunk_size), desc="批量搜索", unit="块", disable=out is sys.stdout):
+            results = search_engine.batch_search(queries, mode=args.mode, top_k=args.top_k, batch_size=ENCODE_BATCH_SIZE)
+            for query, query_results in zip(queries, results):
+                out.write(json.dumps({"query": query, "results": query_results}, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
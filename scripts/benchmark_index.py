@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search import index_factory
+from image_search.embedding_store import EmbeddingStore
+from config import (
+    IMAGE_INDEX_PATH,
+    INDEX_PARAMS,
+    setup_logging
+)
+
+def load_vectors(index_path):
+    """优先读取索引旁的原始向量存储；不存在时从索引中取出 (压缩索引为解码后的近似向量)。"""
+    store = EmbeddingStore(os.path.splitext(index_path)[0] + '.npy')
+    if store.load():
+        return store.ids, np.asarray(store.vectors)
+    return index_factory.extract_vectors(faiss.read_index(index_path))
+
+def make_lookup(ids, vectors):
+    """构造与 EmbeddingStore.get 相同接口的按id取原始向量函数。"""
+    order = np.argsort(ids)
+    sorted_ids = ids[order]
+
+    def get(query_ids):
+        pos = np.searchsorted(sorted_ids, query_ids).clip(0, len(sorted_ids) - 1)
+        found = sorted_ids[pos] == query_ids
+        return np.where(found[:, None], vectors[order[pos]], 0).astype(np.float32), found
+    return get
+
+def main():
+    """
+    对比不同索引后端与向量压缩编码的召回率、延迟和内存：
+    1. 读取图片的原始向量。
+    2. 以精确内积检索 (IndexFlatIP) 为基准，构建并评估HNSW/IVF在不同efSearch/nprobe下的表现。
+    3. 评估fp16/sq8/pq编码 (可叠加PCA降维) 的每向量内存，以及精确重排前后的召回率。
+    4. 输出recall@k、p50/p99延迟与每向量字节数。
+    """
+    parser = argparse.ArgumentParser(description="ANN索引后端召回率/延迟基准测试")
+    parser.add_argument("--index", default=IMAGE_INDEX_PATH, help="提供向量的索引文件")
+    parser.add_argument("--backends", nargs="+", default=["hnsw", "ivf"], choices=index_factory.INDEX_BACKENDS)
+    parser.add_argument("--ef-search", nargs="+", type=int, default=[16, 32, 64, 128, 256])
+    parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--encodings", nargs="*", default=["fp16", "sq8", "pq"], choices=index_factory.VECTOR_ENCODINGS,
+                        help="评估的向量压缩编码")
+    parser.add_argument("--pca-dims", nargs="+", type=int, default=[0, 256], help="PCA降维后的维度，0表示不降维")
+    parser.add_argument("--compression-backend", default="flat", choices=index_factory.INDEX_BACKENDS, help="评估压缩编码时使用的后端")
+    parser.add_argument("--num-queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    args = parser.parse_args()
+
+    logger = setup_logging()
+
+    ids, vectors = load_vectors(args.index)
+    dim = vectors.shape[1]
+    logger.info(f"读取到 {len(vectors)} 个 {dim} 维向量。")
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=min(args.num_queries, len(vectors)), replace=False)]
+
+    reference = index_factory.build_index(ids, vectors, dim, 'flat')
+    metrics = index_factory.benchmark_index(reference, reference, queries, args.k)
+    results = [dict(backend='flat', encoding='float32', param=None, build_s=0.0, bytes_per_vector=index_factory.bytes_per_vector(reference),
+                    rerank_recall=metrics[f'recall@{args.k}'], **metrics)]
+
+    for backend in args.backends:
+        if backend == 'flat':
+            continue
+        start = time.perf_counter()
+        index = index_factory.build_index(ids, vectors, dim, backend, INDEX_PARAMS)
+        build_s = time.perf_counter() - start
+        param_name, values = ('ef_search', args.ef_search) if backend == 'hnsw' else ('nprobe', args.nprobe)
+        bytes_per_vector = index_factory.bytes_per_vector(index)
+        for value in values:
+            index_factory.apply_search_params(index, {**INDEX_PARAMS, param_name: value})
+            metrics = index_factory.benchmark_index(index, reference, queries, args.k)
+            results.append(dict(backend=backend, encoding=INDEX_PARAMS.get('encoding', 'float32'), param=f"{param_name}={value}",
+                                build_s=build_s, bytes_per_vector=bytes_per_vector, rerank_recall=None, **metrics))
+
+    # 压缩编码：同时评估直接检索与用原始向量精确重排后的召回率
+    lookup = make_lookup(ids, vectors)
+    for encoding in args.encodings:
+        for pca_dim in args.pca_dims:
+            params = {**INDEX_PARAMS, 'encoding': encoding, 'pca_dim': pca_dim}
+            try:
+                start = time.perf_counter()
+                index = index_factory.build_index(ids, vectors, dim, args.compression_backend, params)
+                build_s = time.perf_counter() - start
+            except ValueError as e:
+                logger.warning(f"跳过 {encoding} pca_dim={pca_dim}: {e}")
+                continue
+            rerank_factor = params.get('rerank_factor', index_factory.DEFAULT_INDEX_PARAMS['rerank_factor'])
+            reranked = index_factory.benchmark_index(
+                index, reference, queries, args.k,
+                search_fn=lambda q, k: index_factory.search_and_rerank(index, q, k, lookup, rerank_factor)
+            )
+            metrics = index_factory.benchmark_index(index, reference, queries, args.k)
+            # 延迟以带重排的检索为准，即线上实际的检索方式
+            metrics.update({key: reranked[key] for key in ('p50_ms', 'p99_ms', 'qps')})
+            results.append(dict(backend=args.compression_backend, encoding=encoding, param=f"pca_dim={pca_dim}" if pca_dim else None,
+                                build_s=build_s, bytes_per_vector=index_factory.bytes_per_vector(index),
+                                rerank_recall=reranked[f'recall@{args.k}'], **metrics))
+
+    recall_col = f'recall@{args.k}'
+    print(f"\n{'backend':<8}{'encoding':<10}{'param':<16}{'bytes/vec':>10}{recall_col:>10}{'reranked':>10}"
+          f"{'p50(ms)':>10}{'p99(ms)':>10}{'QPS':>10}{'build(s)':>10}")
+    for r in results:
+        reranked = f"{r['rerank_recall']:.4f}" if r['rerank_recall'] is not None else '-'
+        print(f"{r['backend']:<8}{r['encoding']:<10}{str(r['param'] or '-'):<16}{r['bytes_per_vector']:>10.0f}{r[recall_col]:>10.4f}{reranked:>10}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['qps']:>10.0f}{r['build_s']:>10.2f}")
+    logger.info(f"压缩编码的召回率以 {args.compression_backend} 后端、rerank_factor={INDEX_PARAMS.get('rerank_factor', index_factory.DEFAULT_INDEX_PARAMS['rerank_factor'])} 测量，"
+                f"原始向量保存在磁盘上 (内存映射)，不计入每向量字节数。")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"结果已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
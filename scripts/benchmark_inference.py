@@ -0,0 +1,172 @@
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import numpy as np
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search import database
+from image_search.embedding_generator import EmbeddingGenerator
+from image_search.inference_backends import INFERENCE_BACKENDS
+from config import (
+    DATABASE_PATH,
+    CLIP_MODEL_NAME,
+    ENCODE_BATCH_SIZE,
+    ENCODE_NUM_WORKERS,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
+    TEXT_PASSAGE_OVERLAP,
+    setup_logging
+)
+
+def load_corpus(db_path, num_images, num_texts):
+    """从数据库中随机抽取已下载的图片与广告文本作为测试语料。"""
+    cursor = database.get_connection(db_path).cursor()
+    cursor.execute(
+        "SELECT local_path FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+        (num_images,)
+    )
+    image_paths = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT title, creative FROM advertisements WHERE title IS NOT NULL OR creative IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+        (num_texts,)
+    )
+    rows = cursor.fetchall()
+    queries = [title for title, _ in rows if title]
+    texts = [creative for _, creative in rows if creative] or queries
+    return image_paths, queries, texts
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q)) * 1000 if latencies else 0.0
+
+def measure(embedder, image_paths, queries, token_lists, batch_size, num_latency):
+    """
+    测量一个后端的单条查询延迟、批量吞吐，并返回语料上的向量。
+
+    Returns:
+        Tuple[dict, np.ndarray, np.ndarray, np.ndarray, np.ndarray]: (指标, 图片向量, 图片失败掩码, 文本向量, 文本失败掩码)。
+    """
+    # 预热，排除首次调用的初始化开销
+    if queries:
+        embedder.encode_text(queries[0])
+    if image_paths:
+        embedder.encode_image(image_paths[0])
+
+    text_latencies = []
+    for query in queries[:num_latency]:
+        start = time.perf_counter()
+        embedder.encode_text(query)
+        text_latencies.append(time.perf_counter() - start)
+    image_latencies = []
+    for path in image_paths[:num_latency]:
+        start = time.perf_counter()
+        embedder.encode_image(path)
+        image_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    image_embeddings, image_failed = embedder.encode_images(image_paths, batch_size=batch_size)
+    image_s = time.perf_counter() - start
+    start = time.perf_counter()
+    text_embeddings, text_failed = embedder.encode_token_lists(token_lists, batch_size=batch_size)
+    text_s = time.perf_counter() - start
+
+    metrics = {
+        'text_p50_ms': percentile_ms(text_latencies, 50),
+        'text_p95_ms': percentile_ms(text_latencies, 95),
+        'image_p50_ms': percentile_ms(image_latencies, 50),
+        'image_p95_ms': percentile_ms(image_latencies, 95),
+        'image_throughput': len(image_paths) / image_s if image_s > 0 else 0.0,
+        'text_throughput': len(token_lists) / text_s if text_s > 0 else 0.0,
+    }
+    return metrics, image_embeddings, image_failed, text_embeddings, text_failed
+
+def cosine_drift(reference, candidate, failed):
+    """逐行计算 1 - 余弦相似度 (向量已归一化)，返回 (平均偏差, p99偏差)。"""
+    drift = 1.0 - np.einsum('ij,ij->i', reference[~failed], candidate[~failed])
+    if not len(drift):
+        return 0.0, 0.0
+    return float(drift.mean()), float(np.percentile(drift, 99))
+
+def main():
+    """
+    评估各CPU推理后端相对fp32 PyTorch模型的速度与精度：
+    1. 从数据库抽取图片与广告文本 (按token窗口切分为段落) 作为语料。
+    2. 依次加载各后端 (ONNX文件不存在时自动导出/量化)，测量单条查询延迟与批量吞吐。
+    3. 计算与fp32向量的余弦偏差，写入偏差报告。
+       EmbeddingGenerator 只会启用报告中偏差不超过 INFERENCE_MAX_DRIFT 的后端，否则回退为fp32。
+    """
+    parser = argparse.ArgumentParser(description="CLIP编码推理后端的延迟/吞吐/偏差基准测试")
+    parser.add_argument("--backends", nargs="+", default=[b for b in INFERENCE_BACKENDS if b != 'torch'],
+                        choices=INFERENCE_BACKENDS, help="参与对比的后端 (fp32的torch后端始终作为基准)")
+    parser.add_argument("--num-images", type=int, default=256)
+    parser.add_argument("--num-texts", type=int, default=256)
+    parser.add_argument("--num-latency", type=int, default=50, help="测量单条查询延迟的次数")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--report", default=INFERENCE_DRIFT_REPORT, help="偏差报告输出路径")
+    args = parser.parse_args()
+
+    logger = setup_logging()
+
+    image_paths, queries, texts = load_corpus(DATABASE_PATH, args.num_images, args.num_texts)
+    logger.info(f"语料：{len(image_paths)} 张图片，{len(texts)} 条广告文本，{len(queries)} 条查询。")
+
+    def load(backend):
+        return EmbeddingGenerator(model_name=CLIP_MODEL_NAME, num_workers=ENCODE_NUM_WORKERS, backend=backend,
+                                  onnx_dir=ONNX_MODEL_DIR, artifact_dir=MODEL_ARTIFACT_DIR, device='cpu')
+
+    # fp32基准 (在CPU上测量，与无GPU的线上环境一致)
+    reference = load('torch')
+    token_lists = [tokens for text in texts for tokens in reference.tokenize_windows(text, TEXT_PASSAGE_OVERLAP)]
+    metrics, ref_images, ref_image_failed, ref_texts, ref_text_failed = measure(
+        reference, image_paths, queries, token_lists, args.batch_size, args.num_latency
+    )
+    results = {'torch': dict(metrics, image_mean_drift=0.0, image_p99_drift=0.0, text_mean_drift=0.0, text_p99_drift=0.0)}
+    del reference
+    gc.collect()
+
+    for backend in args.backends:
+        if backend == 'torch':
+            continue
+        embedder = load(backend)
+        metrics, images, image_failed, text_vectors, text_failed = measure(
+            embedder, image_paths, queries, token_lists, args.batch_size, args.num_latency
+        )
+        image_mean, image_p99 = cosine_drift(ref_images, images, image_failed | ref_image_failed)
+        text_mean, text_p99 = cosine_drift(ref_texts, text_vectors, text_failed | ref_text_failed)
+        results[backend] = dict(metrics, image_mean_drift=image_mean, image_p99_drift=image_p99,
+                                text_mean_drift=text_mean, text_p99_drift=text_p99)
+        del embedder
+        gc.collect()
+
+    print(f"\n{'backend':<12}{'text p50':>10}{'text p95':>10}{'img p50':>10}{'img p95':>10}{'text/s':>10}{'img/s':>10}"
+          f"{'text p99 drift':>16}{'img p99 drift':>16}{'usable':>8}")
+    for backend, r in results.items():
+        usable = max(r['image_p99_drift'], r['text_p99_drift']) <= INFERENCE_MAX_DRIFT
+        r['usable'] = usable
+        print(f"{backend:<12}{r['text_p50_ms']:>10.2f}{r['text_p95_ms']:>10.2f}{r['image_p50_ms']:>10.2f}{r['image_p95_ms']:>10.2f}"
+              f"{r['text_throughput']:>10.1f}{r['image_throughput']:>10.1f}{r['text_p99_drift']:>16.5f}{r['image_p99_drift']:>16.5f}"
+              f"{'yes' if usable else 'no':>8}")
+
+    # 合并已有报告中其他后端的结果，便于分多次测量
+    report = {'model_name': CLIP_MODEL_NAME, 'backends': {}}
+    if os.path.exists(args.report):
+        with open(args.report, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('model_name') == CLIP_MODEL_NAME:
+            report['backends'] = previous.get('backends', {})
+    report['backends'].update(results)
+    report['max_drift'] = INFERENCE_MAX_DRIFT
+    report['num_images'], report['num_texts'] = len(image_paths), len(token_lists)
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"偏差报告已写入 {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import (
+    CLIP_MODEL_NAME,
+    MODEL_ARTIFACT_DIR,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    setup_logging
+)
+
+# 对比的加载方式：原始checkpoint整模型加载，以及从序列化编码塔按需加载的各种组合
+SCENARIOS = {
+    'checkpoint': None,
+    'text': ('text',),
+    'image': ('image',),
+    'image+text': ('image', 'text'),
+}
+
+def rss_mb():
+    """当前进程的常驻内存 (MB) 与峰值常驻内存 (MB)。"""
+    current = peak = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return current if current is not None else peak, peak
+
+def run_child(scenario, backend):
+    """
+    在独立进程中测量一种加载方式：导入耗时、加载耗时 (含首次编码) 与加载后的内存占用。
+    结果以一行JSON输出到stdout。
+    """
+    start = time.perf_counter()
+    base_rss, _ = rss_mb()
+    if scenario == 'checkpoint':
+        import torch
+        from cn_clip.clip import load_from_name, tokenize
+        import_s = time.perf_counter() - start
+        model, _ = load_from_name(CLIP_MODEL_NAME, device='cpu', download_root='./models')
+        model.eval()
+        with torch.no_grad():
+            model.encode_text(tokenize(['测试'], context_length=52))
+    else:
+        from image_search.embedding_generator import EmbeddingGenerator
+        import_s = time.perf_counter() - start
+        towers = SCENARIOS[scenario]
+        embedder = EmbeddingGenerator(model_name=CLIP_MODEL_NAME, backend=backend, onnx_dir=ONNX_MODEL_DIR,
+                                      towers=towers, artifact_dir=MODEL_ARTIFACT_DIR, device='cpu')
+        # 每个编码塔做一次编码，确保其已加载
+        if 'text' in towers:
+            embedder.encode_texts(['测试'])
+        if 'image' in towers:
+            from PIL import Image
+            embedder.encode_image_tensors(embedder.preprocess(Image.new('RGB', (224, 224))).unsqueeze(0))
+    total_s = time.perf_counter() - start
+    rss, peak = rss_mb()
+    print(json.dumps({
+        'scenario': scenario, 'import_s': import_s, 'load_s': total_s - import_s, 'total_s': total_s,
+        'rss_mb': rss, 'peak_rss_mb': peak, 'base_rss_mb': base_rss,
+    }))
+
+def main():
+    """
+    测量不同编码塔组合的冷启动耗时与常驻内存：
+    1. 确保序列化编码塔已生成 (首次运行时从checkpoint转换，不计入结果)。
+    2. 每种加载方式在独立子进程中运行若干次，避免相互影响的缓存与内存。
+    3. 输出各方式的平均耗时与内存。
+    """
+    parser = argparse.ArgumentParser(description="编码塔加载耗时/内存基准测试")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--backend", default=INFERENCE_BACKEND, help="从序列化编码塔加载时使用的推理后端")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式重复运行的次数")
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.backend)
+        return
+
+    logger = setup_logging()
+    from image_search import model_loader
+    model_loader.load_meta(CLIP_MODEL_NAME, MODEL_ARTIFACT_DIR)
+
+    results = []
+    for scenario in args.scenarios:
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario, '--backend', args.backend],
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        result = {'scenario': scenario}
+        for key in ('import_s', 'load_s', 'total_s', 'rss_mb', 'peak_rss_mb'):
+            result[key] = sum(run[key] for run in runs) / len(runs)
+        results.append(result)
+        logger.info(f"{scenario}: {result}")
+
+    print(f"\n{'scenario':<14}{'import(s)':>10}{'load(s)':>10}{'total(s)':>10}{'RSS(MB)':>10}{'peak(MB)':>10}")
+    for r in results:
+        print(f"{r['scenario']:<14}{r['import_s']:>10.2f}{r['load_s']:>10.2f}{r['total_s']:>10.2f}{r['rss_mb']:>10.0f}{r['peak_rss_mb']:>10.0f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"结果已写入 {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import resource
+import subprocess
+import numpy as np
+import faiss
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from PIL import Image
+from tqdm import tqdm
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search import database, index_factory, lexical, passages
+from image_search.embedding_store import EmbeddingStore
+from image_search.filters import SearchFilter
+from image_search.search_engine import SearchEngine
+from config import (
+    EMBEDDING_DIM,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
+    CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    ENCODE_NUM_WORKERS,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    PHASH_MAX_DISTANCE,
+    PROJECT_ROOT,
+    setup_logging
+)
+
+# 语料规模 (图片数)，广告数为图片数的 1/IMAGES_PER_AD
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+IMAGES_PER_AD = 4
+SEARCH_MODES = ('text_to_image', 'text_to_text', 'image_to_image', 'image_to_text', 'hybrid')
+# 带过滤条件的单条检索 (记为 <mode>/filtered)：合成语料中约保留 1/6 * 1/2 * 1/2 的广告
+BENCHMARK_FILTER = SearchFilter(categories=['汽车'], min_score=5, published_from='2020')
+BENCHMARK_DIR = os.path.join(PROJECT_ROOT, 'data', 'benchmark')
+
+# 生成广告文本的词表
+WORDS = ('品牌', '创意', '广告', '夏日', '城市', '年轻人', '手机', '咖啡', '运动', '旅行', '家庭', '科技', '环保', '音乐', '节日',
+         '美食', '汽车', '时尚', '故事', '温暖', '未来', '梦想', '童年', '回忆', '自由', '微笑', '朋友', '海报', '视频', '互动')
+
+# ---- 模型替身 ----
+
+class _HostTensor:
+    """模拟torch张量在CPU上的 .cpu().numpy() 接口。"""
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+class StubEmbedder:
+    """
+    与 EmbeddingGenerator 接口相同的模型替身：向量由输入内容的哈希确定性地生成，
+    不加载模型，用于只测量检索、元数据与构建流程本身的开销。图片仍会完整读取文件。
+    """
+    backend = 'stub'
+    model_name = 'stub'
+
+    def __init__(self, embedding_dim: int = 512, context_length: int = 52):
+        self.embedding_dim = embedding_dim
+        self.context_length = context_length
+
+    def _vector(self, data: bytes) -> np.ndarray:
+        seed = int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.embedding_dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    @staticmethod
+    def _read(image) -> bytes:
+        if hasattr(image, 'read'):
+            data = image.read()
+            image.seek(0)
+            return data
+        with open(image, 'rb') as f:
+            return f.read()
+
+    def warmup(self, towers=None, background=False):
+        return None
+
+    def encode_text(self, text: str):
+        return _HostTensor(self._vector(text.encode('utf-8'))[None, :])
+
+    def encode_image(self, image):
+        try:
+            return _HostTensor(self._vector(self._read(image))[None, :])
+        except OSError:
+            return None
+
+    def encode_texts(self, texts, batch_size: int = 64):
+        vectors = np.stack([self._vector(text.encode('utf-8')) for text in texts]) if texts else np.zeros((0, self.embedding_dim), dtype=np.float32)
+        return vectors, np.zeros(len(texts), dtype=bool)
+
+    def preprocess_images(self, image_paths):
+        contents, failed = [], np.zeros(len(image_paths), dtype=bool)
+        for i, path in enumerate(image_paths):
+            try:
+                contents.append(self._read(path))
+            except OSError:
+                failed[i] = True
+        return (contents or None), failed
+
+    def encode_image_tensors(self, contents) -> np.ndarray:
+        return np.stack([self._vector(data) for data in contents])
+
+    def encode_images(self, image_paths, batch_size: int = 64):
+        contents, failed = self.preprocess_images(image_paths)
+        vectors = np.zeros((len(image_paths), self.embedding_dim), dtype=np.float32)
+        if contents:
+            vectors[~failed] = self.encode_image_tensors(contents)
+        return vectors, failed
+
+    def tokenize_windows(self, text: str, overlap: int = 8):
+        # 以字符代替token，窗口长度与真实模型一致
+        size = self.context_length - 2
+        tokens = [ord(ch) for ch in text]
+        step = max(1, size - overlap)
+        return [tokens[start:start + size] for start in range(0, max(1, len(tokens) - overlap), step)] if tokens else []
+
+    def encode_token_lists(self, token_lists, batch_size: int = 64):
+        vectors = [self._vector(np.asarray(tokens, dtype=np.int64).tobytes()) for tokens in token_lists]
+        vectors = np.stack(vectors) if vectors else np.zeros((0, self.embedding_dim), dtype=np.float32)
+        return vectors, np.zeros(len(token_lists), dtype=bool)
+
+# ---- 阶段计时与内存 ----
+
+def _read_status(field: str):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return None
+
+def _reset_peak_rss() -> bool:
+    """重置进程的峰值常驻内存 (Linux的VmHWM)，以便分阶段测量峰值。不支持时返回False。"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb() -> float:
+    peak = _read_status('VmHWM')
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return peak
+
+class StageRecorder:
+    """记录每个阶段的耗时、阶段内的峰值常驻内存与阶段结束时的常驻内存。"""
+    def __init__(self):
+        self.stages = {}
+        self.per_stage_peak = True
+
+    @contextmanager
+    def stage(self, name: str):
+        self.per_stage_peak = _reset_peak_rss() and self.per_stage_peak
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = {
+                'seconds': time.perf_counter() - start,
+                'peak_rss_mb': _peak_rss_mb(),
+                'rss_mb': _read_status('VmRSS'),
+            }
+
+# ---- 生成语料 ----
+
+def corpus_paths(corpus_dir: str) -> dict:
+    return {
+        'db': os.path.join(corpus_dir, 'advertisements.db'),
+        'images': os.path.join(corpus_dir, 'images'),
+        'image_index': os.path.join(corpus_dir, 'index', 'image_embeddings.index'),
+        'text_index': os.path.join(corpus_dir, 'index', 'text_passages.index'),
+        'build_image_index': os.path.join(corpus_dir, 'build', 'image_embeddings.index'),
+        'build_text_index': os.path.join(corpus_dir, 'build', 'text_passages.index'),
+        'build_checkpoint': os.path.join(corpus_dir, 'build', 'build_checkpoint.json'),
+        'manifest': os.path.join(corpus_dir, 'manifest.json'),
+    }
+
+def random_vectors(rng, count: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def random_text(rng, min_words: int, max_words: int) -> str:
+    return ''.join(rng.choice(WORDS, size=int(rng.integers(min_words, max_words + 1))))
+
+def write_dummy_image(path: str, seed: int, size: int):
+    """写入一张随机噪声JPEG，每张内容不同，避免被去重合并。"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(pixels).save(path, format='JPEG', quality=85)
+    return os.path.getsize(path)
+
+def generate(corpus_dir: str, num_images: int, seed: int = 0, image_size: int = 32, chunk_size: int = 50_000, workers: int = 8):
+    """
+    生成一份合成语料：数据库、图片文件，以及与之对应的图片/文本索引 (随机归一化向量)。
+
+    Args:
+        corpus_dir (str): 输出目录，已存在的语料会被覆盖。
+        num_images (int): 图片数量，广告数为其 1/IMAGES_PER_AD。
+        seed (int): 随机种子。
+        image_size (int): 图片边长。
+        chunk_size (int): 每批写入的图片数。
+        workers (int): 写图片文件的线程数。
+    """
+    logger = setup_logging()
+    paths = corpus_paths(corpus_dir)
+    for path in (paths['db'], paths['db'] + '-wal', paths['db'] + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    os.makedirs(os.path.dirname(paths['image_index']), exist_ok=True)
+    rng = np.random.default_rng(seed)
+    num_ads = max(1, num_images // IMAGES_PER_AD)
+    categories = ['快消', '汽车', '数码', '公益', '金融', '旅游']
+
+    # 1. 广告与文本索引 (每条广告1-4个段落)
+    conn = database.get_connection(paths['db'])
+    text_index = index_factory.create_index(EMBEDDING_DIM, 'flat')
+    for start in tqdm(range(0, num_ads, chunk_size), desc="生成广告", unit="批"):
+        count = min(chunk_size, num_ads - start)
+        ad_ids = np.arange(start + 1, start + count + 1)
+        rows = [(
+            int(ad_id), f"合成广告{ad_id}", f"https://example.com/ad/{ad_id}", random_text(rng, 2, 6),
+            random_text(rng, 10, 40), random_text(rng, 5, 20), random_text(rng, 20, 120),
+            float(rng.uniform(0, 10)), categories[int(ad_id) % len(categories)],
+            f"20{int(rng.integers(15, 25))}-{int(rng.integers(1, 13)):02d}-01", int(ad_id)
+        ) for ad_id in ad_ids]
+        conn.executemany(
+            "INSERT INTO advertisements (id, name, url, title, background, insight, creative, score, category, publish_time, text_embedding_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        lexical.index_ads(conn, [(row[0], row[3], row[6], row[5], row[4]) for row in rows])
+        counts = rng.integers(1, 5, size=count)
+        passage_ids = np.concatenate([passages.passage_ids_of(int(ad_id), int(n)) for ad_id, n in zip(ad_ids, counts)])
+        text_index.add_with_ids(random_vectors(rng, len(passage_ids), EMBEDDING_DIM), passage_ids)
+        conn.commit()
+
+    # 2. 图片文件、图片记录、图片索引与原始向量存储
+    image_index = index_factory.create_index(EMBEDDING_DIM, INDEX_BACKEND, INDEX_PARAMS, num_vectors=num_images)
+    if not image_index.is_trained:
+        sample = min(num_images, max(index_factory.training_size(image_index), 1000))
+        index_factory.train_index(image_index, random_vectors(np.random.default_rng(seed + 1), sample, EMBEDDING_DIM))
+    store_writer = EmbeddingStore(os.path.splitext(paths['image_index'])[0] + '.npy').writer(EMBEDDING_DIM)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in tqdm(range(0, num_images, chunk_size), desc="生成图片", unit="批"):
+            count = min(chunk_size, num_images - start)
+            image_ids = np.arange(start + 1, start + count + 1)
+            files = [os.path.join(paths['images'], f"{image_id % 256:02x}", f"{image_id}.jpg") for image_id in image_ids]
+            sizes = list(pool.map(lambda args: write_dummy_image(*args, image_size), zip(files, (seed * 1_000_003 + image_ids).tolist())))
+            ad_ids = (image_ids - 1) % num_ads + 1
+            conn.executemany(
+                "INSERT INTO images (id, ad_id, image_url, local_path, width, height, file_size, download_status, canonical_id, embedding_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'completed', ?, ?)",
+                [(int(i), int(a), f"https://example.com/img/{i}.jpg", path, image_size, image_size, size, int(i), int(i))
+                 for i, a, path, size in zip(image_ids, ad_ids, files, sizes)]
+            )
+            vectors = random_vectors(rng, count, EMBEDDING_DIM)
+            image_index.add_with_ids(vectors, image_ids.astype(np.int64))
+            store_writer.append(image_ids.astype(np.int64), vectors)
+            conn.commit()
+    store_writer.finalize()
+
+    faiss.write_index(image_index, paths['image_index'])
+    faiss.write_index(text_index, paths['text_index'])
+    manifest = {
+        'num_images': num_images, 'num_ads': num_ads, 'num_passages': int(text_index.ntotal), 'seed': seed,
+        'embedding_dim': EMBEDDING_DIM, 'index_backend': INDEX_BACKEND, 'index_params': INDEX_PARAMS,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(paths['manifest'], 'w') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    logger.info(f"合成语料已生成: {corpus_dir} ({num_images} 张图片, {num_ads} 条广告, {text_index.ntotal} 个段落)")
+
+# ---- 运行基准 ----
+
+def percentiles_ms(latencies) -> dict:
+    latencies = np.asarray(latencies) * 1000
+    if not len(latencies):
+        return {}
+    return {'p50_ms': float(np.percentile(latencies, 50)), 'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)), 'mean_ms': float(latencies.mean())}
+
+def make_queries(corpus_dir: str, num_queries: int, seed: int = 1):
+    """文本查询取自词表的随机组合，图片查询从语料中随机抽取 (以字节传入，与HTTP服务一致)。"""
+    rng = np.random.default_rng(seed)
+    texts = [random_text(rng, 1, 4) for _ in range(num_queries)]
+    cursor = database.get_connection(corpus_paths(corpus_dir)['db']).cursor()
+    cursor.execute("SELECT local_path FROM images ORDER BY RANDOM() LIMIT ?", (num_queries,))
+    images = []
+    for (path,) in cursor.fetchall():
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return texts, images
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(corpus_dir: str, output: str, stub: bool = True, num_queries: int = 200, top_k: int = 10,
+        modes=SEARCH_MODES, build: bool = True, batch_size: int = 64):
+    """
+    在一份合成语料上运行基准：加载、各搜索模式的单条 (含带过滤条件的单条)/批量检索，以及 build_index.py 的完整构建。
+
+    Args:
+        corpus_dir (str): generate 生成的语料目录。
+        output (str): 结果JSON路径。
+        stub (bool): 使用 StubEmbedder 代替真实模型。
+        num_queries (int): 每种模式的查询数量。
+        top_k (int): 每个查询返回的广告数量。
+        modes: 参与测试的搜索模式。
+        build (bool): 是否测量完整构建 (索引写入语料目录下的 build/，不覆盖语料自带的索引)。
+        batch_size (int): batch_search 每批的查询数。
+    """
+    logger = setup_logging()
+    paths = corpus_paths(corpus_dir)
+    with open(paths['manifest']) as f:
+        manifest = json.load(f)
+    recorder = StageRecorder()
+
+    with recorder.stage('load_model'):
+        if stub:
+            embedder = StubEmbedder(EMBEDDING_DIM)
+        else:
+            from image_search.embedding_generator import EmbeddingGenerator
+            embedder = EmbeddingGenerator(model_name=CLIP_MODEL_NAME, num_workers=ENCODE_NUM_WORKERS, backend=INFERENCE_BACKEND,
+                                          onnx_dir=ONNX_MODEL_DIR, towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR, lazy=False)
+    with recorder.stage('load_engine'):
+        # 不启用缓存，测量的是每次检索的完整开销
+        search_engine = SearchEngine(
+            embedding_generator=embedder, embedding_dim=EMBEDDING_DIM, db_path=paths['db'],
+            image_index_path=paths['image_index'], text_index_path=paths['text_index'],
+            index_backend=INDEX_BACKEND, index_params=INDEX_PARAMS,
+            passage_overlap=TEXT_PASSAGE_OVERLAP, max_passages_per_ad=MAX_PASSAGES_PER_AD
+        )
+
+    texts, images = make_queries(corpus_dir, num_queries)
+    latencies = {}
+    for mode in modes:
+        is_text = not mode.startswith('image')
+        queries = texts if is_text else images
+        search_fn = getattr(search_engine, f"{mode}_search")
+        mode_latencies = []
+        with recorder.stage(f"search/{mode}"):
+            for query in queries:
+                start = time.perf_counter()
+                search_fn(query if is_text else io.BytesIO(query), top_k=top_k)
+                mode_latencies.append(time.perf_counter() - start)
+        latencies[mode] = percentiles_ms(mode_latencies)
+        filtered_latencies = []
+        with recorder.stage(f"search/{mode}/filtered"):
+            for query in queries:
+                start = time.perf_counter()
+                search_fn(query if is_text else io.BytesIO(query), top_k=top_k, filters=BENCHMARK_FILTER)
+                filtered_latencies.append(time.perf_counter() - start)
+        latencies[f"{mode}/filtered"] = percentiles_ms(filtered_latencies)
+        if is_text:
+            # batch_search的图片模式只接受文件路径，批量测量仅针对文本查询
+            with recorder.stage(f"batch_search/{mode}"):
+                search_engine.batch_search(queries, mode=mode, top_k=top_k, batch_size=batch_size)
+            recorder.stages[f"batch_search/{mode}"]['qps'] = len(queries) / max(recorder.stages[f"batch_search/{mode}"]['seconds'], 1e-9)
+        logger.info(f"{mode}: {latencies[mode]}")
+
+    if build:
+        import scripts.build_index as build_index
+        os.makedirs(os.path.dirname(paths['build_checkpoint']), exist_ok=True)
+        # 每次都从未计算哈希的状态构建，使多次运行测量的工作量相同
+        with database.transaction(paths['db']) as conn:
+            conn.execute("UPDATE images SET content_hash = NULL, phash = NULL, canonical_id = NULL")
+        build_engine = SearchEngine(
+            embedding_generator=embedder, embedding_dim=EMBEDDING_DIM, db_path=paths['db'],
+            image_index_path=paths['build_image_index'], text_index_path=paths['build_text_index'],
+            index_backend=INDEX_BACKEND, index_params=INDEX_PARAMS,
+            passage_overlap=TEXT_PASSAGE_OVERLAP, max_passages_per_ad=MAX_PASSAGES_PER_AD,
+            phash_max_distance=PHASH_MAX_DISTANCE
+        )
+        build_recorder = StageRecorder()
+        with recorder.stage('build/total'):
+            build_index.run_build(embedder, build_engine, paths['db'], paths['build_checkpoint'], restart=True, timer=build_recorder)
+        for name, result in build_recorder.stages.items():
+            recorder.stages[f"build/{name}"] = result
+
+    result = {
+        'meta': {
+            'corpus': os.path.abspath(corpus_dir), 'num_images': manifest['num_images'], 'num_ads': manifest['num_ads'],
+            'num_passages': manifest['num_passages'], 'stub_model': stub, 'num_queries': num_queries, 'top_k': top_k,
+            'index_backend': INDEX_BACKEND, 'index_params': INDEX_PARAMS, 'git_revision': git_revision(),
+            'python': platform.python_version(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+            'per_stage_peak_rss': recorder.per_stage_peak, 'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'stages': recorder.stages,
+        'latency': latencies,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{'stage':<32}{'seconds':>10}{'peak RSS(MB)':>14}")
+    for name, stage in recorder.stages.items():
+        print(f"{name:<32}{stage['seconds']:>10.3f}{stage['peak_rss_mb']:>14.0f}")
+    print(f"\n{'mode':<24}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for mode, stats in latencies.items():
+        print(f"{mode:<24}{stats.get('p50_ms', 0):>10.2f}{stats.get('p95_ms', 0):>10.2f}{stats.get('p99_ms', 0):>10.2f}")
+    logger.info(f"结果已写入 {output}")
+    return result
+
+# ---- 对比 ----
+
+def _metrics(result: dict) -> dict:
+    """展开为 {指标名: (数值, 是否越大越好)}。"""
+    metrics = {}
+    for name, stage in result.get('stages', {}).items():
+        metrics[f"{name}.seconds"] = (stage['seconds'], False)
+        metrics[f"{name}.peak_rss_mb"] = (stage['peak_rss_mb'], False)
+        if 'qps' in stage:
+            metrics[f"{name}.qps"] = (stage['qps'], True)
+    for mode, stats in result.get('latency', {}).items():
+        for key, value in stats.items():
+            metrics[f"latency/{mode}.{key}"] = (value, False)
+    return metrics
+
+def compare(baseline_path: str, candidate_path: str, threshold: float = 0.1, min_seconds: float = 0.005, min_mb: float = 16) -> int:
+    """
+    对比两次运行的结果，变差超过 threshold (相对值) 的指标标记为回归。
+    耗时差小于 min_seconds、内存差小于 min_mb 的变化视为噪声。
+
+    Returns:
+        int: 回归的指标数量。
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    for key in ('num_images', 'stub_model', 'num_queries', 'top_k'):
+        if baseline['meta'].get(key) != candidate['meta'].get(key):
+            print(f"警告: 两次运行的 {key} 不同 ({baseline['meta'].get(key)} vs {candidate['meta'].get(key)})，结果不可直接比较。")
+
+    base_metrics, cand_metrics = _metrics(baseline), _metrics(candidate)
+    regressions = 0
+    print(f"{'metric':<44}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, (base, higher_is_better) in base_metrics.items():
+        if name not in cand_metrics or base is None or cand_metrics[name][0] is None:
+            continue
+        cand = cand_metrics[name][0]
+        change = (cand - base) / base if base else 0.0
+        worse = -change if higher_is_better else change
+        if name.endswith('peak_rss_mb'):
+            noise = abs(cand - base) < min_mb
+        elif name.endswith('.qps'):
+            noise = False
+        else:
+            scale = 1000 if '_ms' in name else 1
+            noise = abs(cand - base) < min_seconds * scale
+        flag = ''
+        if worse > threshold and not noise:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif worse < -threshold and not noise:
+            flag = '  improved'
+        print(f"{name:<44}{base:>12.3f}{cand:>12.3f}{change:>+10.1%}{flag}")
+    print(f"\n共 {regressions} 项回归 (阈值 {threshold:.0%})。")
+    return regressions
+
+def main():
+    """
+    合成数据基准测试：
+      generate  生成指定规模的语料 (数据库、图片文件、随机向量索引)。
+      run       在语料上测量加载、四种搜索模式与完整构建的各阶段耗时和峰值内存，写入JSON。
+      compare   对比两次运行的结果，存在回归时以非零状态码退出。
+    """
+    parser = argparse.ArgumentParser(description="合成数据基准测试")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help="生成合成语料")
+    gen.add_argument("--scale", default='10k', choices=list(SCALES))
+    gen.add_argument("--num-images", type=int, help="自定义图片数量，覆盖 --scale")
+    gen.add_argument("--dir", help="语料目录，默认 data/benchmark/<scale>")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--image-size", type=int, default=32, help="合成图片的边长")
+    gen.add_argument("--workers", type=int, default=8, help="写图片文件的线程数")
+
+    run_parser = sub.add_parser('run', help="运行基准")
+    run_parser.add_argument("--scale", default='10k', choices=list(SCALES))
+    run_parser.add_argument("--dir", help="语料目录，默认 data/benchmark/<scale>")
+    run_parser.add_argument("--output", help="结果JSON路径，默认写入语料目录下的 results/")
+    run_parser.add_argument("--real-model", action="store_true", help="使用真实的CLIP模型 (默认使用哈希向量的模型替身)")
+    run_parser.add_argument("--num-queries", type=int, default=200)
+    run_parser.add_argument("--top-k", type=int, default=10)
+    run_parser.add_argument("--modes", nargs="+", default=list(SEARCH_MODES), choices=SEARCH_MODES)
+    run_parser.add_argument("--skip-build", action="store_true", help="不测量 build_index.py 的完整构建")
+
+    cmp_parser = sub.add_parser('compare', help="对比两次运行结果")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("candidate")
+    cmp_parser.add_argument("--threshold", type=float, default=0.1, help="判定为回归的相对变化")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        corpus_dir = args.dir or os.path.join(BENCHMARK_DIR, args.scale)
+        generate(corpus_dir, args.num_images or SCALES[args.scale], args.seed, args.image_size, workers=args.workers)
+    elif args.command == 'run':
+        corpus_dir = args.dir or os.path.join(BENCHMARK_DIR, args.scale)
+        output = args.output or os.path.join(corpus_dir, 'results', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+        run(corpus_dir, output, stub=not args.real_model, num_queries=args.num_queries, top_k=args.top_k,
+            modes=args.modes, build=not args.skip_build)
+    else:
+        sys.exit(1 if compare(args.baseline, args.candidate, args.threshold) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 import os
 import sys
-import sqlite3
+import json
+import queue
+import contextlib
+import argparse
+import threading
 import numpy as np
+import faiss
 from tqdm import tqdm
 from loguru import logger
 
@@ -9,88 +14,365 @@ from loguru import logger
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from image_search.embedding_generator import EmbeddingGenerator
+from image_search import database, dedup
 from image_search.search_engine import SearchEngine
+from image_search import index_factory, passages
 from config import (
     DATABASE_PATH,
     IMAGE_INDEX_PATH,
     TEXT_INDEX_PATH,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
     EMBEDDING_DIM,
     CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
+    ENCODE_BATCH_SIZE,
+    ENCODE_NUM_WORKERS,
+    INDEX_BUILD_CHUNK_SIZE,
+    INDEX_BUILD_CHECKPOINT_EVERY,
+    INDEX_BUILD_CHECKPOINT_PATH,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    PHASH_MAX_DISTANCE,
     setup_logging
 )
 
-def fetch_data_from_db(db_path):
-    """从数据库获取图片和文本数据。"""
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        # 获取已下载的图片
-        cursor.execute("SELECT id, local_path FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL")
-        images = cursor.fetchall()
-        # 获取广告文本
-        cursor.execute("SELECT id, title, background, insight, creative FROM advertisements")
-        texts = cursor.fetchall()
-    return images, texts
-
-def update_embedding_id_in_db(db_path, image_id, embedding_id):
-    """更新数据库中图片的embedding_id。"""
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE images SET embedding_id = ? WHERE id = ?", (embedding_id, image_id))
+# 流水线各阶段之间的队列长度，限制在途批次数量以控制内存
+PIPELINE_QUEUE_SIZE = 4
+
+def count_pending_images(db_path, after_id=0):
+    """统计id大于after_id、需要生成向量的已下载图片 (每组重复图片只计canonical图片) 数量。"""
+    cursor = database.get_connection(db_path).cursor()
+    cursor.execute(
+        "SELECT COUNT(*) FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL "
+        "AND id = canonical_id AND id > ?",
+        (after_id,)
+    )
+    return cursor.fetchone()[0]
+
+def iter_image_batches(db_path, batch_size, after_id=0):
+    """
+    按id分页流式读取已下载的图片，重复图片只读取每组的canonical图片。
+    每页都是独立的短查询，WAL模式下读取不会阻塞写入阶段的提交。
+    """
+    last_id = after_id
+    cursor = database.get_connection(db_path).cursor()
+    while True:
+        cursor.execute(
+            "SELECT id, local_path FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL "
+            "AND id = canonical_id AND id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def iter_text_batches(db_path, batch_size):
+    """按id分页流式读取广告文本。"""
+    last_id = 0
+    cursor = database.get_connection(db_path).cursor()
+    while True:
+        cursor.execute(
+            "SELECT id, title, background, insight, creative FROM advertisements WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def load_checkpoint(checkpoint_path):
+    """读取构建断点，返回 (状态字典, 部分索引)；不存在时返回 (None, None)。"""
+    if not os.path.exists(checkpoint_path):
+        return None, None
+    with open(checkpoint_path, 'r') as f:
+        state = json.load(f)
+    index = faiss.read_index(state['index_path'])
+    return state, index
+
+def save_checkpoint(checkpoint_path, state, index):
+    """
+    原子地保存构建断点。
+    部分索引按向量数写入新文件，断点文件写入成功后才删除旧的部分索引，
+    因此任意时刻崩溃，断点文件总是指向一份与之一致的索引。
+    """
+    previous_index_path = state.get('index_path')
+    index_path = f"{os.path.splitext(checkpoint_path)[0]}.{state['last_image_id']}.index"
+    faiss.write_index(index, index_path + '.tmp')
+    os.replace(index_path + '.tmp', index_path)
+
+    state['index_path'] = index_path
+    with open(checkpoint_path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    if previous_index_path and previous_index_path != index_path and os.path.exists(previous_index_path):
+        os.remove(previous_index_path)
+
+def clear_checkpoint(checkpoint_path):
+    """构建完成后删除断点文件及部分索引。"""
+    if not os.path.exists(checkpoint_path):
+        return
+    with open(checkpoint_path, 'r') as f:
+        index_path = json.load(f).get('index_path')
+    if index_path and os.path.exists(index_path):
+        os.remove(index_path)
+    os.remove(checkpoint_path)
+
+def decode_stage(embedder, db_path, batch_size, after_id, decode_queue, errors):
+    """第一阶段：读取图片并在线程池中解码/预处理。"""
+    try:
+        for rows in iter_image_batches(db_path, batch_size, after_id):
+            image_input, failed = embedder.preprocess_images([path for _, path in rows])
+            decode_queue.put((rows, image_input, failed))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        decode_queue.put(None)
+
+def write_stage(db_path, index, store_writer, state, write_queue, chunk_size, checkpoint_every, checkpoint_path, errors):
+    """
+    第三阶段：分块调用index.add_with_ids并追加到向量存储，用executemany在大事务中回写embedding_id。
+    向量id即canonical图片的images.id，同组的重复图片的embedding_id都指向它。
+    每写入checkpoint_every个向量提交一次事务并保存断点。
+    """
+    conn = database.get_connection(db_path)  # 写入线程专用的连接
+    pending_vectors, pending_ids = [], []
+    pending_count, since_checkpoint = 0, 0
+
+    def flush(final=False):
+        nonlocal pending_count
+        if pending_vectors and not index.is_trained:
+            # IVF索引需先训练：攒够训练样本 (或数据已全部读完) 后再训练并写入
+            if pending_count < index_factory.training_size(index) and not final:
+                return
+            index_factory.train_index(index, np.vstack(pending_vectors))
+        if pending_vectors:
+            vectors, ids = np.vstack(pending_vectors), np.array(pending_ids, dtype=np.int64)
+            index.add_with_ids(vectors, ids)
+            store_writer.append(ids, vectors)
+            conn.executemany("UPDATE images SET embedding_id = canonical_id WHERE canonical_id = ? AND download_status = 'completed'",
+                             [(i,) for i in pending_ids])
+            pending_vectors.clear()
+            pending_ids.clear()
+        pending_count = 0
+
+    def checkpoint(final=False):
+        nonlocal since_checkpoint
+        flush(final)
+        if pending_vectors:
+            return  # 索引尚未训练，暂不保存断点
+        store_writer.flush()
         conn.commit()
+        save_checkpoint(checkpoint_path, state, index)
+        since_checkpoint = 0
+
+    try:
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            if errors:
+                continue  # 出错后仅排空队列，避免上游阻塞
+            last_image_id, image_ids, embeddings = item
+            pending_vectors.append(embeddings)
+            pending_ids.extend(image_ids)
+            state['num_vectors'] += len(image_ids)
+            state['last_image_id'] = last_image_id
+            pending_count += len(image_ids)
+            since_checkpoint += len(image_ids)
+
+            if pending_count >= chunk_size:
+                flush()
+            if since_checkpoint >= checkpoint_every:
+                checkpoint()
+        if not errors:
+            state['images_done'] = True
+            checkpoint(final=True)
+    except Exception as e:
+        errors.append(e)
+        while write_queue.get() is not None:
+            pass
+    finally:
+        conn.rollback()  # 丢弃最后一个断点之后未提交的回写
+
+def build_image_index(embedder, search_engine, db_path, state, index, store_writer, checkpoint_path):
+    """
+    流水线式构建图片索引：解码、模型推理、分块写入三个阶段并行进行。
+    """
+    total = count_pending_images(db_path, state['last_image_id'])
+    progress = tqdm(total=total, desc="生成图片向量", unit="张")
+    decode_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    errors = []
+
+    decoder = threading.Thread(
+        target=decode_stage,
+        args=(embedder, db_path, ENCODE_BATCH_SIZE, state['last_image_id'], decode_queue, errors),
+        daemon=True
+    )
+    writer = threading.Thread(
+        target=write_stage,
+        args=(db_path, index, store_writer, state, write_queue, INDEX_BUILD_CHUNK_SIZE, INDEX_BUILD_CHECKPOINT_EVERY,
+              checkpoint_path, errors)
+    )
+    decoder.start()
+    writer.start()
+
+    # 第二阶段：模型推理在主线程中进行
+    try:
+        while True:
+            item = decode_queue.get()
+            if item is None or errors:
+                break
+            rows, image_input, failed = item
+            embeddings = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+            if image_input is not None:
+                try:
+                    embeddings = embedder.encode_image_tensors(image_input)
+                except Exception as e:
+                    logger.error(f"批量处理图片失败 (id {rows[0][0]} - {rows[-1][0]}), 错误: {e}")
+                    failed[:] = True
+            image_ids = [image_id for (image_id, _), is_failed in zip(rows, failed) if not is_failed]
+            write_queue.put((rows[-1][0], image_ids, embeddings if image_ids else embeddings[:0]))
+            progress.update(len(rows))
+    except BaseException as e:
+        # 通知写入阶段放弃未提交的数据，下次从最近的断点继续
+        errors.append(e)
+        raise
+    finally:
+        write_queue.put(None)
+        writer.join()
+        progress.close()
+
+    if errors:
+        raise errors[0]
+    search_engine.set_index(index, 'image')
+
+def build_text_index(embedder, search_engine, db_path):
+    """
+    分页读取广告文本，每条广告的各字段切分为token窗口段落，整页段落一起批量编码后添加到文本索引。
+    向量id为段落id (见 passages 模块)，可直接还原出advertisements.id。
+    """
+    index = search_engine.create_index('text')
+    num_ads = 0
+    with database.transaction(db_path) as conn:
+        conn.execute("UPDATE advertisements SET text_embedding_id = NULL WHERE text_embedding_id IS NOT NULL")
+        for rows in tqdm(iter_text_batches(db_path, INDEX_BUILD_CHUNK_SIZE), desc="生成文本向量", unit="批"):
+            embeddings, passage_ids, ad_ids = passages.encode_ad_passages(
+                embedder, rows, ENCODE_BATCH_SIZE, TEXT_PASSAGE_OVERLAP, MAX_PASSAGES_PER_AD
+            )
+            if not len(passage_ids):
+                continue
+            index.add_with_ids(embeddings, passage_ids)
+            conn.executemany("UPDATE advertisements SET text_embedding_id = id WHERE id = ?", [(int(i),) for i in ad_ids])
+            num_ads += len(ad_ids)
+    logger.info(f"文本索引：{num_ads} 条广告切分为 {index.ntotal} 个段落。")
+    search_engine.set_index(index, 'text')
+
+def run_build(embedder, search_engine, db_path, checkpoint_path, restart=False, timer=None):
+    """
+    执行一次完整的索引构建 (可从断点继续)，main 与基准测试 (scripts/benchmark_suite.py) 共用。
+
+    Args:
+        embedder: 向量生成器 (EmbeddingGenerator 或接口相同的替身)。
+        search_engine (SearchEngine): 目标搜索引擎，索引写入其配置的路径。
+        db_path (str): SQLite数据库路径。
+        checkpoint_path (str): 断点文件路径。
+        restart (bool): 忽略已有断点，从头开始构建。
+        timer (optional): 提供 stage(name) 上下文管理器的计时器，用于记录各阶段耗时。
+    """
+    stage = timer.stage if timer is not None else (lambda name: contextlib.nullcontext())
+
+    # 读取断点
+    if restart:
+        clear_checkpoint(checkpoint_path)
+    state, index = load_checkpoint(checkpoint_path)
+    if state is None:
+        state = {'last_image_id': 0, 'num_vectors': 0, 'images_done': False}
+        with stage('dedup'):
+            dedup.prepare_images(db_path, phash_max_distance=search_engine.phash_max_distance)
+        index = search_engine.create_index('image', num_vectors=count_pending_images(db_path))
+        # 全量重建时清除旧的embedding_id，避免残留过期映射
+        with database.transaction(db_path) as conn:
+            conn.execute("UPDATE images SET embedding_id = NULL WHERE embedding_id IS NOT NULL")
+        save_checkpoint(checkpoint_path, state, index)
+    else:
+        logger.info(f"从断点继续构建：已处理到图片id {state['last_image_id']}，已写入 {index.ntotal} 个向量。")
+
+    # 构建图片索引，原始向量同时流式写入索引旁的向量存储
+    store = search_engine.image_store
+    with stage('image_index'):
+        if state['images_done']:
+            search_engine.set_index(index, 'image')
+        else:
+            logger.info("开始构建图片索引...")
+            store_writer = store.writer(EMBEDDING_DIM, resume_count=state['num_vectors'])
+            try:
+                build_image_index(embedder, search_engine, db_path, state, index, store_writer, checkpoint_path)
+            finally:
+                store_writer.close()
+        if os.path.exists(store.vectors_path + '.partial'):
+            store.writer(EMBEDDING_DIM, resume_count=state['num_vectors']).finalize()
+
+    # 构建文本索引
+    logger.info("开始构建文本索引...")
+    with stage('text_index'):
+        build_text_index(embedder, search_engine, db_path)
+
+    # 保存索引
+    with stage('save'):
+        search_engine.save_indexes()
+    clear_checkpoint(checkpoint_path)
 
 def main():
     """
     执行索引构建流程：
     1. 初始化日志、向量生成器和搜索引擎。
-    2. 从数据库获取数据。
-    3. 生成并构建图片索引。
+    2. 读取断点(如有)，从上次中断处继续；全新构建前先按内容哈希对图片去重。
+    3. 流水线式生成并构建图片索引，定期保存断点。
     4. 生成并构建文本索引。
-    5. 保存索引。
+    5. 保存索引并清理断点。
     """
+    parser = argparse.ArgumentParser(description="构建图片和文本向量索引")
+    parser.add_argument("--restart", action="store_true", help="忽略已有断点，从头开始构建")
+    args = parser.parse_args()
+
     setup_logging()
 
     # 1. 初始化
-    embedder = EmbeddingGenerator(model_name=CLIP_MODEL_NAME)
-    search_engine = SearchEngine(EMBEDDING_DIM, IMAGE_INDEX_PATH, TEXT_INDEX_PATH)
-
-    # 2. 获取数据
-    logger.info("正在从数据库获取数据...")
-    images, texts = fetch_data_from_db(DATABASE_PATH)
-    logger.info(f"获取到 {len(images)} 张图片和 {len(texts)} 条文本。")
-
-    # 3. 构建图片索引
-    logger.info("开始构建图片索引...")
-    image_embeddings = []
-    current_embedding_id = 0
-    for image_id, image_path in tqdm(images, desc="生成图片向量"):
-        embedding = embedder.encode_image(image_path)
-        if embedding is not None:
-            image_embeddings.append(embedding.cpu().numpy().flatten())
-            # 更新数据库
-            update_embedding_id_in_db(DATABASE_PATH, image_id, current_embedding_id)
-            current_embedding_id += 1
-    
-    if image_embeddings:
-        search_engine.build_index(np.array(image_embeddings), 'image')
-
-    # 4. 构建文本索引
-    logger.info("开始构建文本索引...")
-    text_embeddings = []
-    for ad_id, title, background, insight, creative in tqdm(texts, desc="生成文本向量"):
-        # 将多个文本字段合并为一个长文本
-        full_text = ' '.join(filter(None, [title, background, insight, creative]))
-        if full_text:
-            embedding = embedder.encode_text(full_text)
-            if embedding is not None:
-                text_embeddings.append(embedding.cpu().numpy().flatten())
-
-    if text_embeddings:
-        search_engine.build_index(np.array(text_embeddings), 'text')
-
-    # 5. 保存索引
-    search_engine.save_indexes()
-    
+    database.get_connection(DATABASE_PATH)  # 确保数据库表结构为最新版本
+    embedder = EmbeddingGenerator(
+        model_name=CLIP_MODEL_NAME, num_workers=ENCODE_NUM_WORKERS,
+        backend=INFERENCE_BACKEND, onnx_dir=ONNX_MODEL_DIR,
+        drift_report=INFERENCE_DRIFT_REPORT, max_drift=INFERENCE_MAX_DRIFT,
+        towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR
+    )
+    search_engine = SearchEngine(
+        embedding_generator=embedder,
+        embedding_dim=EMBEDDING_DIM,
+        db_path=DATABASE_PATH,
+        image_index_path=IMAGE_INDEX_PATH,
+        text_index_path=TEXT_INDEX_PATH,
+        index_backend=INDEX_BACKEND,
+        index_params=INDEX_PARAMS,
+        passage_overlap=TEXT_PASSAGE_OVERLAP,
+        max_passages_per_ad=MAX_PASSAGES_PER_AD,
+        phash_max_distance=PHASH_MAX_DISTANCE
+    )
+
+    # 2-5. 构建
+    run_build(embedder, search_engine, DATABASE_PATH, INDEX_BUILD_CHECKPOINT_PATH, restart=args.restart)
+
     logger.info("索引构建流程完成。")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search import database
+from image_search.thumbnails import ThumbnailStore
+from config import (
+    DATABASE_PATH,
+    THUMBNAIL_DIR,
+    THUMBNAIL_SIZES,
+    MAX_DOWNLOAD_WORKERS,
+    setup_logging
+)
+
+def main():
+    """
+    为已下载的图片补生成缩略图：
+    1. 读取所有下载完成的图片路径。
+    2. 跳过已有全部档位缩略图的图片，其余在线程池中生成。
+    """
+    parser = argparse.ArgumentParser(description="为已下载的图片生成各档位的WebP缩略图")
+    parser.add_argument("--workers", type=int, default=MAX_DOWNLOAD_WORKERS, help="并行生成的线程数")
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    store = ThumbnailStore(THUMBNAIL_DIR, THUMBNAIL_SIZES)
+
+    # 1. 读取图片路径
+    cursor = database.get_connection(DATABASE_PATH).cursor()
+    cursor.execute("SELECT DISTINCT local_path FROM images WHERE download_status = 'completed' AND local_path IS NOT NULL")
+    paths = [row[0] for row in cursor.fetchall()]
+
+    # 2. 只处理缺少缩略图的图片
+    missing = [path for path in paths if not all(os.path.exists(store.path_for(path, size)) for size in store.sizes)]
+    logger.info(f"共 {len(paths)} 张图片，其中 {len(missing)} 张需要生成缩略图。")
+    if not missing:
+        return
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(tqdm(executor.map(store.generate, missing), total=len(missing), desc="生成缩略图"))
+    logger.info(f"缩略图生成完成：成功 {sum(r is not None for r in results)} 张，失败 {sum(r is None for r in results)} 张。")
+
+if __name__ == "__main__":
+    main()
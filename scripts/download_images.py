@@ -1,16 +1,24 @@
 import os
 import sys
+import argparse
 
 # 将项目根目录添加到Python路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from image_search.downloader import Downloader
+from image_search.thumbnails import ThumbnailStore
 from config import (
     DATABASE_PATH, 
     IMAGE_DIR, 
     MAX_DOWNLOAD_WORKERS, 
     DOWNLOAD_TIMEOUT, 
     MAX_RETRIES,
+    MAX_IMAGE_BYTES,
+    THUMBNAIL_DIR,
+    THUMBNAIL_SIZES,
+    ASYNC_DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_PER_HOST_CONCURRENCY,
+    DOWNLOAD_PER_HOST_RATE,
     setup_logging
 )
 
@@ -18,18 +26,42 @@ def main():
     """
     执行图片下载流程：
     1. 配置日志。
-    2. 初始化Downloader。
+    2. 初始化Downloader (--async 时使用基于asyncio的AsyncDownloader)。
     3. 运行下载流程。
     """
+    parser = argparse.ArgumentParser(description="下载数据库中待下载的图片")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用异步下载器 (连接池 + 按主机限流)")
+    parser.add_argument("--concurrency", type=int, default=ASYNC_DOWNLOAD_CONCURRENCY, help="异步下载的全局最大在途请求数")
+    parser.add_argument("--per-host", type=int, default=DOWNLOAD_PER_HOST_CONCURRENCY, help="每个主机的最大在途请求数")
+    parser.add_argument("--per-host-rate", type=float, default=DOWNLOAD_PER_HOST_RATE, help="每个主机每秒最多请求数，0表示不限速")
+    args = parser.parse_args()
+
     setup_logging()
-    
-    downloader = Downloader(
-        db_path=DATABASE_PATH,
-        image_dir=IMAGE_DIR,
-        max_workers=MAX_DOWNLOAD_WORKERS,
-        timeout=DOWNLOAD_TIMEOUT,
-        max_retries=MAX_RETRIES
-    )
+
+    thumbnail_store = ThumbnailStore(THUMBNAIL_DIR, THUMBNAIL_SIZES)
+    if args.use_async:
+        from image_search.async_downloader import AsyncDownloader
+        downloader = AsyncDownloader(
+            db_path=DATABASE_PATH,
+            image_dir=IMAGE_DIR,
+            max_concurrency=args.concurrency,
+            per_host_concurrency=args.per_host,
+            per_host_rate=args.per_host_rate,
+            timeout=DOWNLOAD_TIMEOUT,
+            max_retries=MAX_RETRIES,
+            max_image_bytes=MAX_IMAGE_BYTES,
+            thumbnail_store=thumbnail_store
+        )
+    else:
+        downloader = Downloader(
+            db_path=DATABASE_PATH,
+            image_dir=IMAGE_DIR,
+            max_workers=MAX_DOWNLOAD_WORKERS,
+            timeout=DOWNLOAD_TIMEOUT,
+            max_retries=MAX_RETRIES,
+            max_image_bytes=MAX_IMAGE_BYTES,
+            thumbnail_store=thumbnail_store
+        )
     
     downloader.run()
 
@@ -0,0 +1,41 @@
+import os
+import sys
+import glob
+import argparse
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search.data_processor import DataProcessor
+from config import (
+    DATABASE_PATH,
+    RAW_DATA_DIR,
+    INGEST_CHUNK_SIZE,
+    setup_logging
+)
+
+def main():
+    """
+    将CSV/Excel导出文件导入数据库：
+    1. 分块流式读取，每块一个事务，按广告URL与图片URL批量upsert。
+    2. 可以重复执行；重新导入更新后的导出文件只写入有变化的行，文本变化的广告等待 update_index.py 重新生成文本向量。
+    """
+    parser = argparse.ArgumentParser(description="流式导入CSV/Excel广告数据 (可重复执行)")
+    parser.add_argument("paths", nargs="*", help=f"要导入的文件，默认为 {RAW_DATA_DIR} 下全部 .csv/.xlsx 文件")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE, help="每块的行数 (每个事务写入的广告数)")
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    paths = args.paths or sorted(glob.glob(os.path.join(RAW_DATA_DIR, '*.csv')) + glob.glob(os.path.join(RAW_DATA_DIR, '*.xlsx')))
+    if not paths:
+        logger.error(f"未找到要导入的文件: {RAW_DATA_DIR}")
+        return
+
+    processor = DataProcessor(DATABASE_PATH)
+    for path in paths:
+        stats = processor.ingest(path, chunk_size=args.chunk_size)
+        logger.info(f"导入完成 {path}：新增 {stats['inserted']} 条广告，更新 {stats['updated']} 条，未变化 {stats['unchanged']} 条，"
+                    f"跳过 {stats['skipped']} 行，新增 {stats['new_images']} 个图片URL。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import sys
+import argparse
+from aiohttp import web
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search.embedding_cache import EmbeddingCache
+from image_search.embedding_generator import EmbeddingGenerator
+from image_search.metrics import SearchMetrics
+from image_search.result_cache import ResultCache
+from image_search.search_engine import SearchEngine
+from image_search.server import SearchService
+from image_search.startup import STARTUP_MODES, StartupTimer
+from config import (
+    DATABASE_PATH,
+    IMAGE_INDEX_PATH,
+    TEXT_INDEX_PATH,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
+    CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
+    EMBEDDING_DIM,
+    ENCODE_NUM_WORKERS,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_PATH,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    HYBRID_RRF_K,
+    FILTER_EXACT_THRESHOLD,
+    METRICS_ENABLED,
+    METRICS_WINDOW,
+    SLOW_QUERY_MS,
+    SLOW_QUERY_LOG_PATH,
+    DEFAULT_TOP_K,
+    MAX_TOP_K,
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_MAX_BATCH_SIZE,
+    SERVER_MAX_WAIT_MS,
+    STARTUP_MODE,
+    setup_logging
+)
+
+def main():
+    """
+    启动HTTP搜索服务：
+    1. 初始化向量生成器和搜索引擎。lazy模式下以内存映射方式打开索引，模型在后台加载。
+    2. 创建带动态微批处理的aiohttp应用并开始监听，输出启动各阶段耗时。
+    """
+    parser = argparse.ArgumentParser(description="启动HTTP搜索服务")
+    parser.add_argument("--host", default=SERVER_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="监听端口")
+    parser.add_argument("--max-batch-size", type=int, default=SERVER_MAX_BATCH_SIZE, help="每批最多合并的请求数")
+    parser.add_argument("--max-wait-ms", type=float, default=SERVER_MAX_WAIT_MS, help="第一个请求到达后最多等待合并的毫秒数")
+    parser.add_argument("--startup-mode", default=STARTUP_MODE, choices=STARTUP_MODES, help="启动模式")
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    timer = StartupTimer()
+    eager = args.startup_mode == 'eager'
+
+    # 1. 初始化
+    with timer.stage('embedder'):
+        embedder = EmbeddingGenerator(
+            model_name=CLIP_MODEL_NAME, num_workers=ENCODE_NUM_WORKERS,
+            backend=INFERENCE_BACKEND, onnx_dir=ONNX_MODEL_DIR,
+            drift_report=INFERENCE_DRIFT_REPORT, max_drift=INFERENCE_MAX_DRIFT,
+            towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR, lazy=not eager
+        )
+    with timer.stage('search_engine'):
+        search_engine = SearchEngine(
+            embedding_generator=embedder,
+            embedding_dim=EMBEDDING_DIM,
+            db_path=DATABASE_PATH,
+            image_index_path=IMAGE_INDEX_PATH,
+            text_index_path=TEXT_INDEX_PATH,
+            index_backend=INDEX_BACKEND,
+            index_params=INDEX_PARAMS,
+            embedding_cache=EmbeddingCache(f"{CLIP_MODEL_NAME}/{embedder.backend}", max_entries=EMBEDDING_CACHE_SIZE, disk_path=EMBEDDING_CACHE_PATH),
+            result_cache=ResultCache(max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL),
+            passage_overlap=TEXT_PASSAGE_OVERLAP,
+            max_passages_per_ad=MAX_PASSAGES_PER_AD,
+            mmap_indexes=not eager,
+            metrics=SearchMetrics(enabled=METRICS_ENABLED, window=METRICS_WINDOW, slow_query_ms=SLOW_QUERY_MS, slow_log_path=SLOW_QUERY_LOG_PATH),
+            rrf_k=HYBRID_RRF_K,
+            filter_exact_threshold=FILTER_EXACT_THRESHOLD
+        )
+    if not eager:
+        embedder.warmup(background=True)
+    timer.report(f"启动耗时 (startup_mode={args.startup_mode})")
+
+    # 2. 启动服务
+    service = SearchService(
+        search_engine,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        default_top_k=DEFAULT_TOP_K,
+        max_top_k=MAX_TOP_K,
+        startup_timer=timer
+    )
+    logger.info(f"搜索服务监听 http://{args.host}:{args.port} (max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms})")
+    web.run_app(service.create_app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -7,39 +7,67 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from image_search.embedding_generator import EmbeddingGenerator
 from image_search.search_engine import SearchEngine
+from image_search.startup import StartupTimer
 from config import (
     DATABASE_PATH,
     IMAGE_INDEX_PATH,
     TEXT_INDEX_PATH,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
     CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
     EMBEDDING_DIM,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    STARTUP_MODE,
     setup_logging
 )
 
 def main():
     """
     执行搜索功能测试：
-    1. 初始化模块。
+    1. 初始化模块 (按 STARTUP_MODE 延迟加载模型、内存映射打开索引)。
     2. 执行一次文搜图搜索。
-    3. 打印结果。
+    3. 打印结果与启动耗时。
     """
     setup_logging()
+    timer = StartupTimer()
+    eager = STARTUP_MODE == 'eager'
 
     # 1. 初始化
-    embedder = EmbeddingGenerator(model_name=CLIP_MODEL_NAME)
-    search_engine = SearchEngine(
-        embedding_generator=embedder,
-        embedding_dim=EMBEDDING_DIM,
-        db_path=DATABASE_PATH,
-        image_index_path=IMAGE_INDEX_PATH,
-        text_index_path=TEXT_INDEX_PATH
-    )
+    with timer.stage('embedder'):
+        embedder = EmbeddingGenerator(
+            model_name=CLIP_MODEL_NAME,
+            backend=INFERENCE_BACKEND, onnx_dir=ONNX_MODEL_DIR,
+            drift_report=INFERENCE_DRIFT_REPORT, max_drift=INFERENCE_MAX_DRIFT,
+            towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR, lazy=not eager
+        )
+    with timer.stage('search_engine'):
+        search_engine = SearchEngine(
+            embedding_generator=embedder,
+            embedding_dim=EMBEDDING_DIM,
+            db_path=DATABASE_PATH,
+            image_index_path=IMAGE_INDEX_PATH,
+            text_index_path=TEXT_INDEX_PATH,
+            index_backend=INDEX_BACKEND,
+            index_params=INDEX_PARAMS,
+            passage_overlap=TEXT_PASSAGE_OVERLAP,
+            max_passages_per_ad=MAX_PASSAGES_PER_AD,
+            mmap_indexes=not eager
+        )
 
     # 2. 执行文搜图
     query_text = "一个男人在看手机"
     print(f"执行文搜图搜索，查询: '{query_text}'")
     
-    results = search_engine.text_to_image_search(query_text, top_k=5)
+    with timer.stage('first_query'):
+        results = search_engine.text_to_image_search(query_text, top_k=5)
+    timer.mark_first_query()
 
     # 3. 打印结果
     print("\n搜索结果:")
@@ -47,6 +75,7 @@ def main():
         pprint.pprint(results)
     else:
         print("没有找到匹配的结果。")
+    timer.report(f"启动耗时 (startup_mode={STARTUP_MODE})")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
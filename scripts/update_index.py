@@ -0,0 +1,77 @@
+import os
+import sys
+import argparse
+
+# 将项目根目录添加到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from image_search import database
+from image_search.embedding_generator import EmbeddingGenerator
+from image_search.search_engine import SearchEngine
+from config import (
+    DATABASE_PATH,
+    IMAGE_INDEX_PATH,
+    TEXT_INDEX_PATH,
+    INDEX_BACKEND,
+    INDEX_PARAMS,
+    EMBEDDING_DIM,
+    CLIP_MODEL_NAME,
+    INFERENCE_BACKEND,
+    ONNX_MODEL_DIR,
+    MODEL_ARTIFACT_DIR,
+    ENCODER_TOWERS,
+    INFERENCE_DRIFT_REPORT,
+    INFERENCE_MAX_DRIFT,
+    ENCODE_BATCH_SIZE,
+    ENCODE_NUM_WORKERS,
+    TEXT_PASSAGE_OVERLAP,
+    MAX_PASSAGES_PER_AD,
+    PHASH_MAX_DISTANCE,
+    setup_logging
+)
+
+def main():
+    """
+    增量更新索引，无需全量重建：
+    1. 将下载失败的图片从图片索引中移除。
+    2. 为新增或变更的图片生成向量并加入图片索引。
+    3. 为新增或变更的广告生成文本向量并加入文本索引。
+    4. (可选) 按当前配置的后端用已存储的向量重新训练并构建图片索引。
+    """
+    parser = argparse.ArgumentParser(description="增量更新图片和文本向量索引")
+    parser.add_argument("--rebuild-image-index", action="store_true", help="更新后按INDEX_BACKEND与INDEX_PARAMS (含压缩编码) 重新训练并构建图片索引")
+    args = parser.parse_args()
+
+    logger = setup_logging()
+
+    database.get_connection(DATABASE_PATH)  # 确保数据库表结构为最新版本
+    embedder = EmbeddingGenerator(
+        model_name=CLIP_MODEL_NAME, num_workers=ENCODE_NUM_WORKERS,
+        backend=INFERENCE_BACKEND, onnx_dir=ONNX_MODEL_DIR,
+        drift_report=INFERENCE_DRIFT_REPORT, max_drift=INFERENCE_MAX_DRIFT,
+        towers=ENCODER_TOWERS, artifact_dir=MODEL_ARTIFACT_DIR
+    )
+    search_engine = SearchEngine(
+        embedding_generator=embedder,
+        embedding_dim=EMBEDDING_DIM,
+        db_path=DATABASE_PATH,
+        image_index_path=IMAGE_INDEX_PATH,
+        text_index_path=TEXT_INDEX_PATH,
+        index_backend=INDEX_BACKEND,
+        index_params=INDEX_PARAMS,
+        passage_overlap=TEXT_PASSAGE_OVERLAP,
+        max_passages_per_ad=MAX_PASSAGES_PER_AD,
+        phash_max_distance=PHASH_MAX_DISTANCE
+    )
+
+    removed = search_engine.tombstone_failed_images()
+    added_images = search_engine.add_images(batch_size=ENCODE_BATCH_SIZE)
+    added_ads = search_engine.add_ads(batch_size=ENCODE_BATCH_SIZE)
+    if args.rebuild_image_index:
+        search_engine.rebuild_index('image')
+        search_engine.save_indexes()
+
+    logger.info(f"增量更新完成：移除 {removed} 张失效图片，新增 {added_images} 个图片向量、{added_ads} 个文本向量。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import asyncio
+
+from image_search import async_downloader
+from image_search.async_downloader import HostLimiter
+
+class FakeClock:
+    """替换 time.monotonic 与 asyncio.sleep：sleep只推进虚拟时间，测试无需真实等待。"""
+    def __init__(self):
+        self.now = 0.0
+        self._sleep = asyncio.sleep
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        await self._sleep(0)
+
+def _acquire_times(monkeypatch, rate: float, count: int):
+    clock = FakeClock()
+    monkeypatch.setattr(async_downloader.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(async_downloader.asyncio, 'sleep', clock.sleep)
+
+    async def run():
+        limiter = HostLimiter(concurrency=1, rate=rate)
+        times = []
+        for _ in range(count):
+            await asyncio.wait_for(limiter.acquire_token(), timeout=5)
+            times.append(clock.now)
+        return times
+
+    return asyncio.run(run())
+
+def test_rate_below_one_issues_tokens(monkeypatch):
+    # rate=0.5：第一个令牌立即取得，之后每2秒一个
+    times = _acquire_times(monkeypatch, 0.5, 3)
+    assert times[0] == 0
+    assert [round(b - a, 6) for a, b in zip(times, times[1:])] == [2.0, 2.0]
+
+def test_burst_is_capped_at_rate(monkeypatch):
+    # rate=4：初始可连续取得4个令牌，第5个需等待 1/4 秒
+    times = _acquire_times(monkeypatch, 4, 5)
+    assert times[:4] == [0, 0, 0, 0]
+    assert round(times[4], 6) == 0.25